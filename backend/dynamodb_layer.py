@@ -4,314 +4,3957 @@ Provides MongoDB-like interface for DynamoDB operations
 """
 
 import aioboto3
+import asyncio
+import base64
+import bisect
+import contextvars
+import copy
+import heapq
+import json
+import logging
+import os
+import random
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Mapping
+from contextlib import AsyncExitStack, contextmanager
+from datetime import date, datetime, timezone
+from pathlib import Path
 from typing import Dict, List, Any, Optional
 from decimal import Decimal
-import json
-from boto3.dynamodb.conditions import Key, Attr
+from aiobotocore.config import AioConfig
+from boto3.dynamodb.conditions import Key, Attr, ConditionExpressionBuilder
+from boto3.dynamodb.types import Binary, TypeDeserializer, TypeSerializer
+from botocore.exceptions import ClientError
+
+try:
+    import fcntl
+except ImportError:  # not POSIX: the change journal is then safe for one process only
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Python types DynamoDB accepts for a key attribute of each scalar type
+_KEY_VALUE_TYPES = {
+    'S': (str,),
+    'N': (int, float, Decimal),
+    'B': (bytes, bytearray),
+}
+
+_NO_VALUE = object()
+
+_serializer = TypeSerializer()
+_deserializer = TypeDeserializer()
+
+# BatchGetItem accepts at most 100 keys per request
+BATCH_GET_SIZE = 100
+# BatchWriteItem accepts at most 25 put/delete requests per request
+BATCH_WRITE_SIZE = 25
+# Attempts for batch requests that keep returning unprocessed keys/items
+BATCH_MAX_ATTEMPTS = 8
+# TransactWriteItems accepts at most 100 actions per request
+TRANSACT_WRITE_SIZE = 100
+# Seconds a table whose DescribeTable failed is planned without it before describing it again
+SCHEMA_RETRY_SECONDS = 30.0
+# Key schemas and indexes of the tables, used when DescribeTable fails (DYNAMODB_TABLE_DEFINITIONS)
+TABLE_DEFINITIONS_PATH = Path(__file__).resolve().parent.parent / 'dynamodb-tables.json'
+# Error codes DynamoDB returns for requests over provisioned/account throughput
+THROTTLE_ERROR_CODES = frozenset({
+    'ProvisionedThroughputExceededException',
+    'ThrottlingException',
+    'RequestLimitExceeded',
+})
+
+# Upper bounds (seconds) of the request latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Operations whose ConsumedCapacity is read capacity
+READ_OPERATIONS = frozenset({'GetItem', 'BatchGetItem', 'Query', 'Scan'})
+# Operations that accept ReturnConsumedCapacity
+CAPACITY_OPERATIONS = READ_OPERATIONS | {
+    'PutItem', 'UpdateItem', 'DeleteItem', 'BatchWriteItem', 'TransactWriteItems', 'TransactGetItems',
+}
+
+# Tables of the request in progress, so botocore retry events can be attributed to them
+_current_tables = contextvars.ContextVar('dynamodb_current_tables', default=())
+# Endpoint the request in progress is attributed to in DynamoDBMetrics
+_current_endpoint = contextvars.ContextVar('dynamodb_current_endpoint', default='')
+# ScanBudget of the request in progress (see DynamoDBDatabase.scan_budget)
+_current_budget = contextvars.ContextVar('dynamodb_current_budget', default=None)
+
+
+async def _backoff(attempt: int, base: float = 0.05, cap: float = 5.0):
+    """Sleep with full-jitter exponential backoff before retry `attempt` (0-based)"""
+    await asyncio.sleep(random.uniform(0, min(cap, base * (2 ** attempt))))
+
+
+def to_dynamodb_value(value: Any) -> Any:
+    """
+    Convert a Python value to a DynamoDB-storable value in a single pass:
+    float -> Decimal, datetime/date -> ISO string, tuple -> list, empty set -> list,
+    recursing into dicts, lists and sets. Exact-type checks keep the common
+    str/int/bool/None leaves on the fastest path.
+    """
+    value_type = type(value)
+    if value_type is str or value_type is int or value_type is bool or value is None:
+        return value
+    if value_type is float:
+        return Decimal(repr(value))
+    if value_type is dict:
+        return {k if type(k) is str else str(k): to_dynamodb_value(v) for k, v in value.items()}
+    if value_type is list or value_type is tuple:
+        return [to_dynamodb_value(v) for v in value]
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, (set, frozenset)):
+        # DynamoDB has no empty set type
+        return {to_dynamodb_value(v) for v in value} if value else []
+    if isinstance(value, dict):
+        return {str(k): to_dynamodb_value(v) for k, v in value.items()}
+    if isinstance(value, float):
+        return Decimal(repr(value))
+    return value
+
+
+def from_dynamodb_value(value: Any) -> Any:
+    """
+    Convert a value read from DynamoDB to plain Python in a single pass:
+    Decimal -> int when integral, else float; sets -> lists; Binary -> bytes.
+    """
+    value_type = type(value)
+    if value_type is str or value_type is bool or value is None:
+        return value
+    if value_type is Decimal:
+        return int(value) if value == value.to_integral_value() else float(value)
+    if value_type is dict:
+        return {k: from_dynamodb_value(v) for k, v in value.items()}
+    if value_type is list or value_type is set:
+        return [from_dynamodb_value(v) for v in value]
+    if value_type is Binary:
+        return value.value
+    return value
+
+
+def encode_item(item: Dict) -> Dict:
+    """Low-level AttributeValue map of an item already in DynamoDB format"""
+    return {k: _serializer.serialize(v) for k, v in item.items()}
+
+
+def decode_attribute(attribute_value: Dict) -> Any:
+    """Decode one low-level AttributeValue ({"S": "..."}, {"N": "1"}, ...) to plain Python"""
+    return from_dynamodb_value(_deserializer.deserialize(attribute_value))
+
+
+class LazyItem(Mapping):
+    """
+    Read-only mapping over a low-level DynamoDB item that decodes each
+    attribute on first access, so endpoints reading a couple of fields do not
+    pay for deserializing the whole item. dict(item) decodes everything.
+    """
+    
+    __slots__ = ('raw', '_decoded')
+    
+    def __init__(self, raw: Dict):
+        self.raw = raw
+        self._decoded = {}
+    
+    def __getitem__(self, key: str) -> Any:
+        try:
+            return self._decoded[key]
+        except KeyError:
+            value = decode_attribute(self.raw[key])
+            self._decoded[key] = value
+            return value
+    
+    def __contains__(self, key) -> bool:
+        return key in self.raw
+    
+    def __iter__(self):
+        return iter(self.raw)
+    
+    def __len__(self) -> int:
+        return len(self.raw)
+    
+    def to_dict(self) -> Dict:
+        return {key: self[key] for key in self.raw}
+    
+    def __repr__(self):
+        return f"LazyItem({list(self.raw)})"
+
+
+def sort_value(value: Any) -> tuple:
+    """
+    Total-order sort key for mixed-type field values, so None, numbers and
+    strings in the same field never raise TypeError. Follows MongoDB's
+    ordering: None < numbers < strings < maps < lists < booleans.
+    """
+    if value is None:
+        return (0, 0)
+    if isinstance(value, bool):
+        return (5, value)
+    if isinstance(value, (int, float, Decimal)):
+        return (1, value)
+    if isinstance(value, str):
+        return (2, value)
+    if isinstance(value, Mapping):
+        return (3, str(value))
+    if isinstance(value, (list, tuple, set)):
+        return (4, str(value))
+    return (6, str(value))
+
+
+def _merge_request(kwargs: Dict, extra: Dict) -> Dict:
+    """Merge request parameters, combining ExpressionAttributeNames"""
+    for param, value in extra.items():
+        if param == 'ExpressionAttributeNames' and param in kwargs:
+            kwargs[param] = {**kwargs[param], **value}
+        else:
+            kwargs[param] = value
+    return kwargs
+
+
+class BulkWriteResult:
+    """Per-item outcome of a batched write, by position in the input list"""
+    
+    def __init__(self):
+        self.succeeded: List[int] = []
+        self.failed: Dict[int, str] = {}  # input index -> error message
+    
+    @property
+    def ok(self) -> bool:
+        return not self.failed
+    
+    def __repr__(self):
+        return f"BulkWriteResult(succeeded={len(self.succeeded)}, failed={len(self.failed)})"
+
+
+class ItemCache:
+    """
+    Read-through cache of one collection's documents, keyed by primary/index key
+    Entries expire after `ttl` seconds and the least recently used entry is
+    evicted beyond `max_items`. A write through the collection invalidates every
+    entry of the written primary key (whichever key it was cached under); writes
+    made by other processes are only picked up once the entry expires.
+    """
+    
+    def __init__(self, ttl: float = 30.0, max_items: int = 1000):
+        self.ttl = ttl
+        self.max_items = max_items
+        self._entries = OrderedDict()  # cache key -> (expires_at, primary key, document)
+        self._by_primary_key = {}  # primary key -> cache keys holding that document
+        # Bumped by every invalidation so reads that raced a write are not stored
+        self.version = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+    
+    def get(self, cache_key: tuple) -> Optional[Dict]:
+        """Cached document (a private copy) or None on a miss"""
+        entry = self._entries.get(cache_key)
+        if entry is not None and entry[0] <= time.monotonic():
+            self._remove(cache_key)
+            entry = None
+        if entry is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(cache_key)
+        self.hits += 1
+        return copy.deepcopy(entry[2])
+    
+    def put(self, cache_key: tuple, primary_key: Any, document: Dict, version: int):
+        """Store a document read when the cache was at `version`"""
+        if version != self.version or self.max_items <= 0:
+            return
+        if cache_key in self._entries:
+            self._remove(cache_key)
+        self._entries[cache_key] = (time.monotonic() + self.ttl, primary_key, copy.deepcopy(document))
+        self._by_primary_key.setdefault(primary_key, set()).add(cache_key)
+        while len(self._entries) > self.max_items:
+            self._remove(next(iter(self._entries)))
+            self.evictions += 1
+    
+    def invalidate(self, primary_key: Any):
+        """Drop every entry of a primary key"""
+        self.version += 1
+        for cache_key in list(self._by_primary_key.get(primary_key, ())):
+            self._remove(cache_key)
+            self.invalidations += 1
+    
+    def clear(self):
+        """Drop every entry"""
+        self.version += 1
+        self.invalidations += len(self._entries)
+        self._entries.clear()
+        self._by_primary_key.clear()
+    
+    def _remove(self, cache_key: tuple):
+        _, primary_key, _ = self._entries.pop(cache_key)
+        cache_keys = self._by_primary_key.get(primary_key)
+        if cache_keys is not None:
+            cache_keys.discard(cache_key)
+            if not cache_keys:
+                del self._by_primary_key[primary_key]
+    
+    def stats(self) -> Dict:
+        """Hit/miss/eviction counters and current size"""
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': round(self.hits / lookups, 4) if lookups else 0.0,
+            'evictions': self.evictions,
+            'invalidations': self.invalidations,
+            'size': len(self._entries),
+            'max_items': self.max_items,
+            'ttl': self.ttl,
+        }
+
+
+def _freeze(value: Any) -> Any:
+    """Hashable, key-order independent form of a filter/projection"""
+    if isinstance(value, dict):
+        return tuple(sorted(((k, _freeze(v)) for k, v in value.items()), key=lambda kv: str(kv[0])))
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(v) for v in value)
+    if isinstance(value, (set, frozenset)):
+        return frozenset(_freeze(v) for v in value)
+    if isinstance(value, bool):
+        # True == 1 for hashing, but {"active": True} and {"active": 1} are different filters
+        return 'bool', value
+    return value
+
+
+class SingleFlight:
+    """
+    Coalesces identical concurrent reads into one underlying request
+    The first caller for a key starts the read; callers arriving while it is
+    in flight await the same task. Every caller but the last to collect the
+    result gets a deep copy, so callers can still mutate what they receive.
+    """
+    
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self._in_flight = {}  # key -> [task, callers still to collect the result]
+        self.calls = 0
+        self.coalesced = 0
+    
+    async def run(self, key: tuple, factory) -> Any:
+        """Await factory() once for all concurrent callers with an equal key"""
+        self.calls += 1
+        try:
+            entry = self._in_flight.get(key) if self.enabled else None
+        except TypeError:
+            # Unhashable filter value; nothing to share
+            return await factory()
+        if entry is None:
+            if not self.enabled:
+                return await factory()
+            entry = [asyncio.ensure_future(self._lead(key, factory)), 1]
+            self._in_flight[key] = entry
+        else:
+            self.coalesced += 1
+            entry[1] += 1
+        # Shielded so one caller's cancellation does not cancel the shared read
+        result = await asyncio.shield(entry[0])
+        entry[1] -= 1
+        return result if entry[1] == 0 else copy.deepcopy(result)
+    
+    async def _lead(self, key: tuple, factory) -> Any:
+        try:
+            return await factory()
+        finally:
+            # Removed before the result is handed out, so late callers start a fresh read
+            self._in_flight.pop(key, None)
+    
+    def stats(self) -> Dict:
+        """Read calls, calls served by another caller's request, and reads in flight"""
+        return {
+            'calls': self.calls,
+            'coalesced': self.coalesced,
+            'in_flight': len(self._in_flight),
+        }
+
+
+class TokenBucket:
+    """
+    Client-side rate limit for one table: `rate` requests per second with
+    bursts up to `burst`. The rate adapts: it halves on every throttle
+    (down to a tenth of the configured rate) and creeps back up as requests
+    succeed, so a hot table backs off instead of retrying into more throttles.
+    """
+    
+    def __init__(self, rate: float, burst: Optional[float] = None):
+        self.max_rate = rate
+        self.rate = rate
+        self.burst = burst or rate
+        self.waited = 0.0
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+    
+    async def acquire(self, tokens: float = 1.0):
+        """Wait until `tokens` requests may be sent"""
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+                delay = (tokens - self._tokens) / self.rate
+                self.waited += delay
+                await asyncio.sleep(delay)
+    
+    def on_throttle(self):
+        self.rate = max(self.max_rate / 10, self.rate / 2)
+    
+    def on_success(self):
+        if self.rate < self.max_rate:
+            self.rate = min(self.max_rate, self.rate + self.max_rate / 100)
+
+
+def _parse_rate_limits(spec: Any) -> Dict[str, TokenBucket]:
+    """
+    Per-collection request rate limits: {collection: TokenBucket}
+    Accepts {collection: rate or (rate, burst)} or a string like
+    "assessment_submissions:50,certificate_candidates:100:200" (collection:rate[:burst]).
+    """
+    if isinstance(spec, dict):
+        items = [(name, settings if isinstance(settings, (tuple, list)) else (settings,))
+                 for name, settings in spec.items()]
+    else:
+        items = []
+        for entry in (spec or '').split(','):
+            parts = [part.strip() for part in entry.split(':')]
+            if parts[0] and len(parts) > 1 and parts[1]:
+                items.append((parts[0], [float(part) for part in parts[1:] if part]))
+    return {name: TokenBucket(*(float(value) for value in settings)) for name, settings in items}
+
+
+def _parse_cache_tables(spec: Any) -> Dict[str, tuple]:
+    """
+    Per-collection cache settings: {collection: (ttl, max_items)}
+    Accepts such a dict or a string like "users,employees:60,certificate_templates:300:200"
+    (collection[:ttl seconds[:max items]]); missing values use DYNAMODB_CACHE_TTL (default 30)
+    and DYNAMODB_CACHE_MAX_ITEMS (default 1000).
+    """
+    default_ttl = float(os.environ.get('DYNAMODB_CACHE_TTL', '30'))
+    default_max_items = int(os.environ.get('DYNAMODB_CACHE_MAX_ITEMS', '1000'))
+    if isinstance(spec, dict):
+        return {name: tuple(settings or (default_ttl, default_max_items)) for name, settings in spec.items()}
+    tables = {}
+    for entry in (spec or '').split(','):
+        parts = [part.strip() for part in entry.split(':')]
+        if not parts[0]:
+            continue
+        ttl = float(parts[1]) if len(parts) > 1 and parts[1] else default_ttl
+        max_items = int(parts[2]) if len(parts) > 2 and parts[2] else default_max_items
+        tables[parts[0]] = (ttl, max_items)
+    return tables
+
+
+def _parse_search_fields(spec: Any) -> Dict[str, tuple]:
+    """
+    Per-collection search fields: {collection: (field, ...)}
+    Accepts such a dict or a string like "employees:designation:role,leads:company_name"
+    """
+    if isinstance(spec, dict):
+        return {name: tuple(fields) for name, fields in spec.items()}
+    collections = {}
+    for entry in (spec or '').split(','):
+        parts = [part.strip() for part in entry.split(':') if part.strip()]
+        if len(parts) > 1:
+            collections[parts[0]] = tuple(parts[1:])
+    return collections
+
+
+def _aggregate_fields(group: Any) -> tuple:
+    """Fields of an aggregate given as "status", "status+assigned_to" or a list of fields"""
+    if isinstance(group, str):
+        return tuple(field.strip() for field in group.split('+') if field.strip())
+    return tuple(group)
+
+
+def _parse_aggregates(spec: Any) -> Dict[str, tuple]:
+    """
+    Per-collection aggregate counters: {collection: ((field, ...), ...)}
+    Accepts such a dict (groups as field names, "a+b" or lists) or a string like
+    "delivery_tasks:status,leads:status,leads:assigned_to" (collection:field[+field...]);
+    a collection may be listed once per aggregate.
+    """
+    if isinstance(spec, dict):
+        return {name: tuple(_aggregate_fields(group) for group in groups) for name, groups in spec.items()}
+    collections = {}
+    for entry in (spec or '').split(','):
+        parts = [part.strip() for part in entry.split(':')]
+        if len(parts) == 2 and parts[0] and _aggregate_fields(parts[1]):
+            groups = collections.setdefault(parts[0], ())
+            if _aggregate_fields(parts[1]) not in groups:
+                collections[parts[0]] = groups + (_aggregate_fields(parts[1]),)
+    return collections
+
+
+def _optional_int(value: Optional[str]) -> Optional[int]:
+    return int(value) if value else None
+
+
+def _operation_name(method) -> str:
+    """DynamoDB operation of a client/Table method (get_item -> GetItem)"""
+    return ''.join(part.title() for part in getattr(method, '__name__', 'unknown').split('_'))
+
+
+def _prometheus_labels(**labels) -> str:
+    escaped = (
+        f'{name}="' + str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') + '"'
+        for name, value in labels.items()
+    )
+    return '{' + ','.join(escaped) + '}'
+
+
+class DynamoDBMetrics:
+    """
+    Latency histograms, item counts and consumed capacity (RCU/WCU) of every
+    request the layer issues, by endpoint, table, index and operation.
+    The endpoint is whatever the caller labelled the current request with
+    (see endpoint()); requests outside a labelled block count under "".
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        # (endpoint, table, operation) -> request totals and latency bucket counts
+        self._requests = {}
+        # (endpoint, table, index, operation) -> [read units, write units]; index "" is the table itself
+        self._capacity = {}
+        # endpoint -> labelled requests (e.g. HTTP requests served)
+        self._endpoints = {}
+
+    @contextmanager
+    def endpoint(self, name: str):
+        """Attribute the DynamoDB requests made inside this block to an endpoint"""
+        self._endpoints[name] = self._endpoints.get(name, 0) + 1
+        token = _current_endpoint.set(name)
+        try:
+            yield
+        finally:
+            _current_endpoint.reset(token)
+
+    def record(self, tables: tuple, operation: str, seconds: float, response: Dict,
+               error_code: Optional[str] = None):
+        """Record one request: its latency, outcome, items read and ConsumedCapacity"""
+        endpoint = _current_endpoint.get()
+        for table_name in tables:
+            entry = self._requests.get((endpoint, table_name, operation))
+            if entry is None:
+                entry = self._requests[(endpoint, table_name, operation)] = {
+                    'requests': 0,
+                    'errors': 0,
+                    'seconds': 0.0,
+                    'returned': 0,
+                    'scanned': 0,
+                    'buckets': [0] * (len(LATENCY_BUCKETS) + 1),
+                }
+            entry['requests'] += 1
+            entry['seconds'] += seconds
+            entry['buckets'][bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+            if error_code is not None:
+                entry['errors'] += 1
+                continue
+            returned, scanned = self._item_counts(table_name, response)
+            entry['returned'] += returned
+            entry['scanned'] += scanned
+
+        consumed = response.get('ConsumedCapacity') or []
+        for capacity in consumed if isinstance(consumed, list) else [consumed]:
+            table_name = capacity.get('TableName', tables[0] if tables else '')
+            if 'Table' in capacity:
+                self._add_capacity(endpoint, table_name, '', operation, capacity['Table'])
+                for section in ('GlobalSecondaryIndexes', 'LocalSecondaryIndexes'):
+                    for index_name, units in capacity.get(section, {}).items():
+                        self._add_capacity(endpoint, table_name, index_name, operation, units)
+            else:
+                self._add_capacity(endpoint, table_name, '', operation, capacity)
+
+    @staticmethod
+    def _item_counts(table_name: str, response: Dict) -> tuple:
+        """(items returned, items read) by a Query/Scan/GetItem/BatchGetItem response"""
+        if 'Count' in response:
+            return response['Count'], response.get('ScannedCount', response['Count'])
+        if 'Item' in response:
+            return 1, 1
+        if 'Responses' in response:
+            returned = len(response['Responses'].get(table_name, []))
+            return returned, returned
+        return 0, 0
+
+    def _add_capacity(self, endpoint: str, table_name: str, index_name: str, operation: str, units: Dict):
+        entry = self._capacity.setdefault((endpoint, table_name, index_name, operation), [0.0, 0.0])
+        if 'ReadCapacityUnits' in units or 'WriteCapacityUnits' in units:
+            entry[0] += units.get('ReadCapacityUnits', 0.0)
+            entry[1] += units.get('WriteCapacityUnits', 0.0)
+        elif operation in READ_OPERATIONS:
+            entry[0] += units.get('CapacityUnits', 0.0)
+        else:
+            entry[1] += units.get('CapacityUnits', 0.0)
+
+    def summary(self) -> Dict:
+        """JSON-friendly metrics, plus per-endpoint totals (RCU/WCU per labelled request)"""
+        requests = []
+        for (endpoint, table_name, operation), entry in sorted(self._requests.items()):
+            requests.append({
+                'endpoint': endpoint,
+                'table': table_name,
+                'operation': operation,
+                'requests': entry['requests'],
+                'errors': entry['errors'],
+                'latency_seconds_sum': round(entry['seconds'], 6),
+                'latency_seconds_avg': round(entry['seconds'] / entry['requests'], 6),
+                'latency_buckets': dict(zip([str(bound) for bound in LATENCY_BUCKETS] + ['+Inf'],
+                                            self._cumulative(entry['buckets']))),
+                'items_returned': entry['returned'],
+                'items_scanned': entry['scanned'],
+                'scanned_per_returned': round(entry['scanned'] / entry['returned'], 2) if entry['returned'] else None,
+            })
+        capacity = []
+        endpoints = {}
+        for (endpoint, table_name, index_name, operation), (read, write) in sorted(self._capacity.items()):
+            capacity.append({
+                'endpoint': endpoint,
+                'table': table_name,
+                'index': index_name,
+                'operation': operation,
+                'read_capacity_units': read,
+                'write_capacity_units': write,
+            })
+            totals = endpoints.setdefault(endpoint, {'requests': 0, 'read_capacity_units': 0.0,
+                                                     'write_capacity_units': 0.0})
+            totals['read_capacity_units'] += read
+            totals['write_capacity_units'] += write
+        for endpoint, count in self._endpoints.items():
+            endpoints.setdefault(endpoint, {'requests': 0, 'read_capacity_units': 0.0,
+                                            'write_capacity_units': 0.0})['requests'] = count
+        for totals in endpoints.values():
+            if totals['requests']:
+                totals['read_capacity_units_per_request'] = round(totals['read_capacity_units'] / totals['requests'], 2)
+                totals['write_capacity_units_per_request'] = round(totals['write_capacity_units'] / totals['requests'], 2)
+        return {'requests': requests, 'capacity': capacity, 'endpoints': endpoints}
+
+    @staticmethod
+    def _cumulative(buckets: List[int]) -> List[int]:
+        counts = []
+        total = 0
+        for count in buckets:
+            total += count
+            counts.append(total)
+        return counts
+
+    def prometheus(self, table_stats: Optional[Dict[str, Dict]] = None) -> str:
+        """Metrics in the Prometheus text exposition format (version 0.0.4)"""
+        lines = []
+
+        def family(name: str, kind: str, help_text: str):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+
+        family('dynamodb_request_duration_seconds', 'histogram', 'DynamoDB request latency, including retries')
+        for (endpoint, table_name, operation), entry in sorted(self._requests.items()):
+            bounds = [str(bound) for bound in LATENCY_BUCKETS] + ['+Inf']
+            for bound, count in zip(bounds, self._cumulative(entry['buckets'])):
+                labels = _prometheus_labels(endpoint=endpoint, table=table_name, operation=operation, le=bound)
+                lines.append(f"dynamodb_request_duration_seconds_bucket{labels} {count}")
+            labels = _prometheus_labels(endpoint=endpoint, table=table_name, operation=operation)
+            lines.append(f"dynamodb_request_duration_seconds_sum{labels} {entry['seconds']:.6f}")
+            lines.append(f"dynamodb_request_duration_seconds_count{labels} {entry['requests']}")
+
+        for name, field, help_text in (
+            ('dynamodb_request_errors_total', 'errors', 'DynamoDB requests that failed after retries'),
+            ('dynamodb_items_returned_total', 'returned', 'Items returned by reads (after filters)'),
+            ('dynamodb_items_scanned_total', 'scanned', 'Items read by reads (before filters)'),
+        ):
+            family(name, 'counter', help_text)
+            for (endpoint, table_name, operation), entry in sorted(self._requests.items()):
+                labels = _prometheus_labels(endpoint=endpoint, table=table_name, operation=operation)
+                lines.append(f"{name}{labels} {entry[field]}")
+
+        for name, position, help_text in (
+            ('dynamodb_consumed_read_capacity_units_total', 0, 'Read capacity units consumed'),
+            ('dynamodb_consumed_write_capacity_units_total', 1, 'Write capacity units consumed'),
+        ):
+            family(name, 'counter', help_text)
+            for (endpoint, table_name, index_name, operation), units in sorted(self._capacity.items()):
+                labels = _prometheus_labels(endpoint=endpoint, table=table_name, index=index_name, operation=operation)
+                lines.append(f"{name}{labels} {units[position]}")
+
+        family('dynamodb_endpoint_requests_total', 'counter', 'Labelled requests (e.g. HTTP requests) per endpoint')
+        for endpoint, count in sorted(self._endpoints.items()):
+            lines.append(f"dynamodb_endpoint_requests_total{_prometheus_labels(endpoint=endpoint)} {count}")
+
+        for field, help_text in (
+            ('retries', 'Retried DynamoDB request attempts'),
+            ('throttles', 'Throttled DynamoDB request attempts'),
+            ('throttled_requests', 'DynamoDB requests that failed throttled after retries'),
+            ('unprocessed', 'Batch keys/items DynamoDB returned unprocessed'),
+        ):
+            family(f'dynamodb_{field}_total', 'counter', help_text)
+            for table_name, stats in sorted((table_stats or {}).items()):
+                lines.append(f"dynamodb_{field}_total{_prometheus_labels(table=table_name)} {stats.get(field, 0)}")
+        return '\n'.join(lines) + '\n'
+
+
+class ScanBudgetExceeded(Exception):
+    """A request read more items/pages with Scans than its ScanBudget allows"""
+    
+    def __init__(self, budget: 'ScanBudget', table_name: str):
+        super().__init__(
+            f"Scan budget exceeded on {table_name}: {budget.items} items in {budget.pages} pages "
+            f"(budget: {budget.max_items} items, {budget.max_pages} pages)"
+        )
+        self.budget = budget
+        self.table_name = table_name
+
+
+class ScanBudget:
+    """
+    Items and pages one request may read with Scans (Query/GetItem are not
+    charged). Once spent, mode='raise' raises ScanBudgetExceeded instead of
+    reading further; mode='truncate' ends scans early (results are partial)
+    and sets truncated. Without limits it only counts.
+    """
+    
+    def __init__(self, max_items: Optional[int] = None, max_pages: Optional[int] = None,
+                 mode: str = 'truncate'):
+        if mode not in ('raise', 'truncate'):
+            raise ValueError(f"Unknown scan budget mode: {mode}")
+        self.max_items = max_items
+        self.max_pages = max_pages
+        self.mode = mode
+        self.items = 0
+        self.pages = 0
+        self.truncated = False
+    
+    @property
+    def limited(self) -> bool:
+        return self.max_items is not None or self.max_pages is not None
+    
+    @property
+    def exhausted(self) -> bool:
+        return ((self.max_items is not None and self.items >= self.max_items)
+                or (self.max_pages is not None and self.pages >= self.max_pages))
+    
+    def remaining_items(self) -> Optional[int]:
+        return None if self.max_items is None else max(0, self.max_items - self.items)
+    
+    def charge(self, response: Dict):
+        """Count a Scan page (its ScannedCount)"""
+        self.pages += 1
+        self.items += response.get('ScannedCount', response.get('Count', 0))
+
+
+def _parse_key_schema(key_schema: List[Dict]) -> tuple:
+    """Return (hash_key, range_key) from a DynamoDB KeySchema list"""
+    hash_key = next((k['AttributeName'] for k in key_schema if k['KeyType'] == 'HASH'), None)
+    range_key = next((k['AttributeName'] for k in key_schema if k['KeyType'] == 'RANGE'), None)
+    return hash_key, range_key
+
+
+class TableSchema:
+    """Primary key and secondary index layout of a DynamoDB table"""
+    
+    def __init__(self, hash_key: Optional[str], range_key: Optional[str] = None,
+                 indexes: Optional[Dict[str, tuple]] = None,
+                 attribute_types: Optional[Dict[str, str]] = None,
+                 item_count: int = 0, size_bytes: int = 0):
+        self.hash_key = hash_key
+        self.range_key = range_key
+        self.indexes = indexes or {}  # index name -> (hash_key, range_key)
+        self.attribute_types = attribute_types or {}
+        # Approximate, refreshed by DynamoDB roughly every six hours
+        self.item_count = item_count
+        self.size_bytes = size_bytes
+    
+    @classmethod
+    def from_description(cls, description: Dict) -> 'TableSchema':
+        """Build from describe_table()['Table'] (or a dynamodb-tables.json entry)"""
+        hash_key, range_key = _parse_key_schema(description['KeySchema'])
+        indexes = {}
+        secondary = description.get('GlobalSecondaryIndexes', []) + description.get('LocalSecondaryIndexes', [])
+        for index in secondary:
+            # Only usable indexes that project every attribute can answer a find()
+            if index.get('IndexStatus', 'ACTIVE') != 'ACTIVE':
+                continue
+            if index.get('Projection', {}).get('ProjectionType', 'ALL') != 'ALL':
+                continue
+            indexes[index['IndexName']] = _parse_key_schema(index['KeySchema'])
+        attribute_types = {
+            a['AttributeName']: a['AttributeType'] for a in description.get('AttributeDefinitions', [])
+        }
+        return cls(hash_key, range_key, indexes, attribute_types,
+                   description.get('ItemCount', 0), description.get('TableSizeBytes', 0))
+    
+    @property
+    def signature(self) -> tuple:
+        """Everything a query plan depends on, as a hashable value (part of PlanCache keys)"""
+        return (self.hash_key, self.range_key, tuple(sorted(self.indexes.items())),
+                tuple(sorted(self.attribute_types.items())))
+    
+    def key_sources(self):
+        """Yield (index_name, hash_key, range_key); index_name is None for the base table"""
+        if self.hash_key:
+            yield None, self.hash_key, self.range_key
+        for index_name, (hash_key, range_key) in self.indexes.items():
+            yield index_name, hash_key, range_key
+    
+    def key_attributes(self) -> List[str]:
+        """Primary key attribute names of the base table"""
+        return [k for k in (self.hash_key, self.range_key) if k]
+    
+    def key_of(self, item: Dict) -> Any:
+        """Primary key identity of an item: the hash value, or a (hash, range) tuple"""
+        if self.range_key:
+            return item.get(self.hash_key), item.get(self.range_key)
+        return item.get(self.hash_key)
+    
+    def key_dict(self, key: Any) -> Dict:
+        """Key dict for a key given as a dict, a bare hash value or a (hash, range) tuple"""
+        if isinstance(key, dict):
+            return {k: key[k] for k in self.key_attributes()}
+        if self.range_key:
+            hash_value, range_value = key
+            return {self.hash_key: hash_value, self.range_key: range_value}
+        return {self.hash_key: key}
+    
+    def primary_key_from_filter(self, filter_dict: Dict) -> Optional[Dict]:
+        """Full primary key if the filter pins every key attribute by equality"""
+        if not self.hash_key:
+            return None
+        key = {}
+        for attribute in (self.hash_key, self.range_key):
+            if attribute is None:
+                continue
+            value = _equality_value(filter_dict.get(attribute, _NO_VALUE))
+            if value is _NO_VALUE or not self.accepts_key_value(attribute, value):
+                return None
+            key[attribute] = value
+        return key
+    
+    def accepts_key_value(self, attribute: str, value: Any) -> bool:
+        """Check that value has the type declared for a key attribute"""
+        if isinstance(value, _Slot):
+            value = value.value
+        if isinstance(value, bool):
+            return False
+        expected = _KEY_VALUE_TYPES.get(self.attribute_types.get(attribute, 'S'), ())
+        return isinstance(value, expected)
+
+
+def load_table_definitions(path: Optional[Any] = None) -> Dict[str, Dict]:
+    """
+    CreateTable definitions of dynamodb-tables.json by table name (its
+    simple_tables are keyed by a string 'id')
+    """
+    with open(path or TABLE_DEFINITIONS_PATH) as f:
+        definitions = json.load(f)
+    tables = {table['TableName']: table for table in definitions.get('tables', [])}
+    for table_name in definitions.get('simple_tables', []):
+        tables[table_name] = {
+            'TableName': table_name,
+            'KeySchema': [{'AttributeName': 'id', 'KeyType': 'HASH'}],
+            'AttributeDefinitions': [{'AttributeName': 'id', 'AttributeType': 'S'}],
+        }
+    return tables
+
+
+class UnsupportedFilterError(ValueError):
+    """A filter uses a Mongo operator (or regex) that cannot be evaluated by DynamoDB"""
+
+
+# Compiled condition of a filter that can never match (e.g. {"$in": []});
+# None stands for "no condition", i.e. everything matches
+_MATCH_NOTHING = object()
+
+# Prefix of the lowercased shadow attributes kept for case-insensitive $regex
+# (see DynamoDBCollection.search_fields)
+SEARCH_ATTRIBUTE_PREFIX = '_lc_'
+# DynamoDB accepts at most 100 operands in an IN comparison
+_IN_OPERANDS = 100
+_FIELD_OPERATORS = ('$eq', '$ne', '$gt', '$gte', '$lt', '$lte', '$in', '$nin', '$exists',
+                    '$regex', '$options', '$not', '$size', '$all')
+_REGEX_SPECIAL = set('.^$*+?()[]{}|\\')
+
+
+def search_attribute(field: str) -> str:
+    """Name of the lowercased shadow attribute of a field"""
+    return SEARCH_ATTRIBUTE_PREFIX + field
+
+
+def _and(conditions: List[Any]) -> Any:
+    """AND compiled conditions (None matches everything, _MATCH_NOTHING nothing)"""
+    result = None
+    for condition in conditions:
+        if condition is _MATCH_NOTHING:
+            return _MATCH_NOTHING
+        if condition is not None:
+            result = condition if result is None else result & condition
+    return result
+
+
+def _or(conditions: List[Any]) -> Any:
+    """OR compiled conditions (None matches everything, _MATCH_NOTHING nothing)"""
+    result = _MATCH_NOTHING
+    for condition in conditions:
+        if condition is None:
+            return None
+        if condition is not _MATCH_NOTHING:
+            result = condition if result is _MATCH_NOTHING else result | condition
+    return result
+
+
+def _not(condition: Any) -> Any:
+    if condition is None:
+        return _MATCH_NOTHING
+    if condition is _MATCH_NOTHING:
+        return None
+    return ~condition
+
+
+def _is_null(key: str):
+    """Mongo's {key: None}: the field is missing or null"""
+    return Attr(key).not_exists() | Attr(key).attribute_type('NULL')
+
+
+def _equals(key: str, value: Any):
+    return _is_null(key) if value is None else Attr(key).eq(value)
+
+
+def _in(key: str, values: List[Any]) -> Any:
+    """key is one of values (chunked to DynamoDB's IN operand limit)"""
+    values = list(values)
+    conditions = [_is_null(key)] if any(v is None for v in values) else []
+    values = [v for v in values if v is not None]
+    for i in range(0, len(values), _IN_OPERANDS):
+        chunk = values[i:i + _IN_OPERANDS]
+        conditions.append(Attr(key).eq(chunk[0]) if len(chunk) == 1 else Attr(key).is_in(chunk))
+    return _or(conditions)
+
+
+def _regex_literal(pattern: str, key: str) -> tuple:
+    """
+    (anchored at start, anchored at end, literal text) of a regex that is a
+    plain string with optional ^/$ anchors; anything else is unsupported
+    """
+    starts = pattern.startswith('^')
+    ends = pattern.endswith('$') and not pattern.endswith('\\$')
+    body = pattern[1 if starts else 0:len(pattern) - 1 if ends else len(pattern)]
+    literal = []
+    i = 0
+    while i < len(body):
+        char = body[i]
+        if char == '\\' and i + 1 < len(body) and not body[i + 1].isalnum():
+            literal.append(body[i + 1])
+            i += 2
+            continue
+        if char in _REGEX_SPECIAL:
+            raise UnsupportedFilterError(
+                f"$regex {pattern!r} on {key!r} is not supported: only literal text with optional ^/$ anchors "
+                f"can be evaluated by DynamoDB (contains/begins_with)"
+            )
+        literal.append(char)
+        i += 1
+    return starts, ends, ''.join(literal)
+
+
+def _regex_condition(key: str, pattern: Any, options: str, search_fields: tuple):
+    """
+    $regex as contains/begins_with/equality. Case-insensitive matches use the
+    lowercased shadow attribute where the collection keeps one (see
+    DynamoDBCollection.search_fields), falling back on items without it to
+    the common capitalizations of the text
+    """
+    if not isinstance(pattern, str):
+        raise UnsupportedFilterError(f"$regex on {key!r} must be a string pattern")
+    unsupported = set(options or '') - {'i'}
+    if unsupported:
+        raise UnsupportedFilterError(f"$options {''.join(sorted(unsupported))!r} on {key!r} are not supported")
+    starts, ends, literal = _regex_literal(pattern, key)
+    if ends and not starts:
+        raise UnsupportedFilterError(f"$regex {pattern!r} on {key!r} is not supported: DynamoDB has no ends_with")
+    
+    def match(attribute: str, text: str):
+        if starts and ends:
+            return Attr(attribute).eq(text)
+        if not text:
+            return Attr(attribute).attribute_type('S')
+        if starts:
+            return Attr(attribute).begins_with(text)
+        return Attr(attribute).contains(text)
+    
+    if 'i' not in (options or '') or not any(c.isalpha() for c in literal):
+        return match(key, literal)
+    variants = list(dict.fromkeys([literal, literal.lower(), literal.upper(), literal.title(),
+                                   literal[:1].upper() + literal[1:].lower()]))
+    fallback = _or([match(key, variant) for variant in variants])
+    if key not in search_fields:
+        return fallback
+    shadow = search_attribute(key)
+    return match(shadow, literal.casefold()) | (Attr(shadow).not_exists() & fallback)
+
+
+def _field_condition(key: str, value: Any, search_fields: tuple) -> Any:
+    """Compile the condition on one field: a value (equality) or a dict of operators"""
+    if not (isinstance(value, dict) and value and all(isinstance(op, str) and op.startswith('$') for op in value)):
+        if isinstance(value, dict) and any(isinstance(op, str) and op.startswith('$') for op in value):
+            raise UnsupportedFilterError(f"Filter on {key!r} mixes operators and fields: {sorted(value)}")
+        return _equals(key, value)
+    
+    unknown = [op for op in value if op not in _FIELD_OPERATORS]
+    if unknown:
+        raise UnsupportedFilterError(
+            f"Unsupported filter operator {unknown[0]!r} on {key!r}; supported: {', '.join(_FIELD_OPERATORS)}"
+        )
+    if '$options' in value and '$regex' not in value:
+        raise UnsupportedFilterError(f"$options on {key!r} requires $regex")
+    
+    conditions = []
+    if '$gte' in value and '$lte' in value:
+        conditions.append(Attr(key).between(value['$gte'], value['$lte']))
+    else:
+        for op in ('$gte', '$lte'):
+            if op in value:
+                conditions.append(getattr(Attr(key), op[1:])(value[op]))
+    for op in ('$gt', '$lt'):
+        if op in value:
+            conditions.append(getattr(Attr(key), op[1:])(value[op]))
+    if '$eq' in value:
+        conditions.append(_equals(key, value['$eq']))
+    if '$ne' in value:
+        conditions.append(_not(_equals(key, value['$ne'])))
+    if '$in' in value:
+        conditions.append(_in(key, value['$in']))
+    if '$nin' in value:
+        conditions.append(_not(_in(key, value['$nin'])))
+    if '$exists' in value:
+        conditions.append(Attr(key).exists() if value['$exists'] else Attr(key).not_exists())
+    if '$regex' in value:
+        conditions.append(_regex_condition(key, value['$regex'], value.get('$options', ''), search_fields))
+    if '$not' in value:
+        conditions.append(_not(_field_condition(key, value['$not'], search_fields)))
+    if '$size' in value:
+        conditions.append(Attr(key).size().eq(value['$size']))
+    if '$all' in value:
+        conditions.append(_and([Attr(key).contains(v) for v in value['$all']]) if value['$all'] else _MATCH_NOTHING)
+    return _and(conditions)
+
+
+def compile_filter(filter_dict: Dict, search_fields: tuple = ()) -> Any:
+    """
+    Compile a Mongo-style filter to a boto3 condition evaluated by DynamoDB.
+    Supports field equality, $eq $ne $gt $gte $lt $lte $in $nin $exists $not
+    $size $all, $regex with $options "i" (literal text with optional ^/$
+    anchors), and nested $and/$or/$nor. Returns None when the filter matches
+    everything and _MATCH_NOTHING when it can match nothing; raises
+    UnsupportedFilterError for anything else.
+    """
+    conditions = []
+    for key, value in filter_dict.items():
+        if key in ('$and', '$or', '$nor'):
+            if not isinstance(value, list) or not value:
+                raise UnsupportedFilterError(f"{key} needs a non-empty list of filters")
+            compiled = [compile_filter(sub_filter, search_fields) for sub_filter in value]
+            if key == '$and':
+                conditions.append(_and(compiled))
+            elif key == '$or':
+                conditions.append(_or(compiled))
+            else:
+                conditions.append(_not(_or(compiled)))
+        elif key.startswith('$'):
+            raise UnsupportedFilterError(f"Unsupported top-level filter operator {key!r}; supported: $and, $or, $nor")
+        else:
+            conditions.append(_field_condition(key, value, search_fields))
+    return _and(conditions)
+
+
+def _equality_value(value: Any) -> Any:
+    """Value of a plain/$eq equality condition, or _NO_VALUE"""
+    if isinstance(value, dict):
+        if set(value) == {"$eq"}:
+            return value["$eq"]
+        return _NO_VALUE
+    return value
+
+
+def _range_key_condition(schema: TableSchema, key: str, value: Any):
+    """Key condition for a sort key filter, or None if it cannot be a key condition"""
+    operators = set(value) if isinstance(value, dict) else {"$eq"}
+    if not isinstance(value, dict):
+        value = {"$eq": value}
+    if not all(schema.accepts_key_value(key, value[op]) for op in operators):
+        return None
+    if operators == {"$gte", "$lte"}:
+        return Key(key).between(value["$gte"], value["$lte"])
+    if len(operators) != 1:
+        return None
+    op = operators.pop()
+    builders = {"$eq": Key(key).eq, "$gt": Key(key).gt, "$gte": Key(key).gte,
+                "$lt": Key(key).lt, "$lte": Key(key).lte}
+    if op not in builders:
+        return None
+    return builders[op](value[op])
+
+
+def _projection_fields(projection: Optional[Dict]) -> tuple:
+    """Split a Mongo-style projection into (included fields or None, excluded fields)"""
+    if not projection:
+        return None, []
+    included = [k for k, v in projection.items() if v]
+    excluded = [k for k, v in projection.items() if not v]
+    return (included or None), excluded
+
+
+def _projection_kwargs(fields: Optional[List[str]]) -> Dict:
+    """ProjectionExpression (with name placeholders, as most field names are reserved words)"""
+    if not fields:
+        return {}
+    names = {}
+    paths = []
+    for field in dict.fromkeys(fields):
+        parts = []
+        for part in field.split('.'):
+            placeholder = f"#p{len(names)}"
+            names[placeholder] = part
+            parts.append(placeholder)
+        paths.append('.'.join(parts))
+    return {'ProjectionExpression': ', '.join(paths), 'ExpressionAttributeNames': names}
+
+
+class QueryPlan:
+    """
+    How a filter is executed: a Query on the table/an index, or a Scan
+    The conditions are boto3 conditions, or expression strings when the plan
+    was bound from a PlanTemplate (attribute_names/attribute_values set).
+    """
+    
+    def __init__(self, operation: str, index_name: Optional[str] = None,
+                 key_condition=None, filter_expression=None,
+                 hash_key: Optional[str] = None, range_key: Optional[str] = None,
+                 attribute_names: Optional[Dict] = None, attribute_values: Optional[Dict] = None):
+        self.operation = operation  # 'query' or 'scan'
+        self.index_name = index_name
+        self.key_condition = key_condition
+        # The filter can match nothing (e.g. an empty $in): nothing needs to be read
+        self.matches_nothing = filter_expression is _MATCH_NOTHING
+        self.filter_expression = None if self.matches_nothing else filter_expression
+        # Key schema of the queried table/index, for sort pushdown
+        self.hash_key = hash_key
+        self.range_key = range_key
+        self.attribute_names = attribute_names
+        self.attribute_values = attribute_values
+    
+    @property
+    def is_rendered(self) -> bool:
+        return self.attribute_values is not None
+    
+    @property
+    def is_query(self) -> bool:
+        return self.operation == 'query'
+    
+    @property
+    def operation_name(self) -> str:
+        """DynamoDB operation the plan issues ('Query' or 'Scan')"""
+        return 'Query' if self.is_query else 'Scan'
+    
+    def returns_sorted_by(self, field: Optional[str]) -> bool:
+        """Whether DynamoDB already returns results ordered by field"""
+        # The hash key is pinned to one value, the range key orders the partition
+        return self.is_query and field is not None and field in (self.hash_key, self.range_key)
+    
+    def request_kwargs(self) -> Dict:
+        """Keyword arguments for table.query()/table.scan()"""
+        kwargs = {}
+        if self.index_name:
+            kwargs['IndexName'] = self.index_name
+        if self.key_condition is not None:
+            kwargs['KeyConditionExpression'] = self.key_condition
+        if self.filter_expression is not None:
+            kwargs['FilterExpression'] = self.filter_expression
+        if self.attribute_names:
+            kwargs['ExpressionAttributeNames'] = dict(self.attribute_names)
+        if self.attribute_values:
+            kwargs['ExpressionAttributeValues'] = dict(self.attribute_values)
+        return kwargs
+    
+    def client_kwargs(self, table_name: str) -> Dict:
+        """Parameters for the low-level client's query()/scan(): rendered expressions, serialized values"""
+        if self.is_rendered:
+            kwargs = self.request_kwargs()
+            kwargs['TableName'] = table_name
+            if self.attribute_values:
+                kwargs['ExpressionAttributeValues'] = {
+                    k: _serializer.serialize(v) for k, v in self.attribute_values.items()
+                }
+            return kwargs
+        kwargs = {'TableName': table_name}
+        if self.index_name:
+            kwargs['IndexName'] = self.index_name
+        names, values = {}, {}
+        for param, built in self.render():
+            kwargs[param] = built.condition_expression
+            names.update(built.attribute_name_placeholders)
+            values.update(built.attribute_value_placeholders)
+        if names:
+            kwargs['ExpressionAttributeNames'] = names
+        if values:
+            kwargs['ExpressionAttributeValues'] = {
+                k: _serializer.serialize(to_dynamodb_value(v)) for k, v in values.items()
+            }
+        return kwargs
+    
+    def render(self) -> List[tuple]:
+        """(parameter, BuiltConditionExpression) of the key condition and filter, with shared placeholders"""
+        builder = ConditionExpressionBuilder()
+        return [
+            (param, builder.build_expression(condition, is_key_condition=is_key_condition))
+            for param, condition, is_key_condition in (
+                ('KeyConditionExpression', self.key_condition, True),
+                ('FilterExpression', self.filter_expression, False),
+            )
+            if condition is not None
+        ]
+    
+    def __repr__(self):
+        return f"QueryPlan({self.operation}, index={self.index_name})"
+
+
+def filter_shape(value: Any) -> Any:
+    """A filter with its values replaced by "?", for logging which filters run (not their data)"""
+    if isinstance(value, dict):
+        return {k: filter_shape(v) for k, v in sorted(value.items())}
+    if isinstance(value, (list, tuple)) and any(isinstance(v, dict) for v in value):
+        return [filter_shape(v) for v in value]
+    return '?'
+
+
+def plan_query(schema: TableSchema, filter_dict: Dict, sort_key: Optional[str] = None,
+               search_fields: tuple = ()) -> QueryPlan:
+    """
+    Pick the cheapest way to evaluate a Mongo-style filter.
+    Uses a Query on the base table or an index whose hash key has an equality
+    condition (preferring one whose range key is also constrained, then one
+    whose range key is sort_key); every other predicate is compiled into the
+    FilterExpression (see compile_filter). Falls back to a Scan.
+    """
+    best = None
+    for index_name, hash_key, range_key in schema.key_sources():
+        if hash_key not in filter_dict:
+            continue
+        hash_value = _equality_value(filter_dict[hash_key])
+        if hash_value is _NO_VALUE or not schema.accepts_key_value(hash_key, hash_value):
+            continue
+        key_condition = Key(hash_key).eq(hash_value)
+        used_keys = {hash_key}
+        range_constrained = False
+        if range_key and range_key in filter_dict:
+            range_condition = _range_key_condition(schema, range_key, filter_dict[range_key])
+            if range_condition is not None:
+                key_condition = key_condition & range_condition
+                used_keys.add(range_key)
+                range_constrained = True
+        if index_name and range_key and not range_constrained:
+            # Index entries only exist for items that have the range key attribute
+            continue
+        score = (range_constrained, range_key is not None and range_key == sort_key)
+        # Ties keep the earlier candidate, so the base table wins over indexes
+        if best is None or score > best[0]:
+            best = (score, index_name, key_condition, used_keys, hash_key, range_key)
+    
+    if best is None:
+        return QueryPlan('scan', filter_expression=compile_filter(filter_dict, search_fields))
+    
+    _, index_name, key_condition, used_keys, hash_key, range_key = best
+    remaining = {k: v for k, v in filter_dict.items() if k not in used_keys}
+    return QueryPlan('query', index_name, key_condition, compile_filter(remaining, search_fields),
+                     hash_key, range_key)
+
+
+class _Slot:
+    """Stand-in for a filter value while a filter shape is compiled (see PlanTemplate)"""
+    __slots__ = ('index', 'value')
+    
+    def __init__(self, index: int, value: Any):
+        self.index = index
+        # The value of the compiling call: only its type is part of the shape
+        self.value = value
+    
+    def __repr__(self):
+        return f"_Slot({self.index})"
+
+
+# Operator arguments that shape the compiled expression itself, and operators taking a list of values
+_SHAPE_OPERATORS = frozenset({'$exists', '$regex', '$options'})
+_LIST_OPERATORS = frozenset({'$in', '$nin', '$all'})
+
+
+def _constant_template(value: Any) -> tuple:
+    return ('=', _freeze(value)), value
+
+
+def _value_template(value: Any, values: List[Any], build: bool) -> tuple:
+    """A bound value becomes a slot (None stays literal: it compiles to a different condition)"""
+    if value is None:
+        return _constant_template(value)
+    values.append(value)
+    return ('?', type(value)), (_Slot(len(values) - 1, value) if build else None)
+
+
+def _list_template(items: List[Any], values: List[Any], build: bool, template) -> tuple:
+    parts = [template(item, values, build) for item in items]
+    return ('[]', tuple(shape for shape, _ in parts)), [slotted for _, slotted in parts]
+
+
+def _field_template(value: Any, values: List[Any], build: bool) -> tuple:
+    """(shape, slotted value) of one field's condition, mirroring _field_condition"""
+    if not (isinstance(value, dict) and value and all(isinstance(op, str) and op.startswith('$') for op in value)):
+        if isinstance(value, dict) and any(isinstance(op, str) and op.startswith('$') for op in value):
+            return _constant_template(value)
+        return _value_template(value, values, build)
+    shapes = []
+    slotted = {}
+    for op, argument in value.items():
+        if op == '$not':
+            shape, slotted[op] = _field_template(argument, values, build)
+        elif op in _LIST_OPERATORS and isinstance(argument, (list, tuple)):
+            shape, slotted[op] = _list_template(argument, values, build, _value_template)
+        elif op in _SHAPE_OPERATORS or op in _LIST_OPERATORS:
+            shape, slotted[op] = _constant_template(argument)
+        else:
+            shape, slotted[op] = _value_template(argument, values, build)
+        shapes.append((op, shape))
+    return ('{}', tuple(shapes)), slotted
+
+
+def _filter_template(filter_dict: Dict, values: List[Any], build: bool = False) -> tuple:
+    """
+    (shape, slotted filter) of a Mongo-style filter. The shape is hashable and
+    equal for filters that compile to the same expression: it keeps the
+    structure, operators, value types, list lengths, None and the arguments
+    of $exists/$regex/$options, and drops every other value. Those values are
+    appended to `values` in slot order; with build=True the slotted filter has
+    them replaced by _Slot markers, ready for plan_query.
+    """
+    shapes = []
+    slotted = {}
+    for key, value in filter_dict.items():
+        if key in ('$and', '$or', '$nor') and isinstance(value, list):
+            shape, slotted[key] = _list_template(value, values, build, _sub_filter_template)
+        else:
+            shape, slotted[key] = _field_template(value, values, build)
+        shapes.append((key, shape))
+    return tuple(shapes), slotted
+
+
+def _sub_filter_template(sub_filter: Any, values: List[Any], build: bool) -> tuple:
+    if not isinstance(sub_filter, dict):
+        return _constant_template(sub_filter)
+    return _filter_template(sub_filter, values, build)
+
+
+class PlanTemplate:
+    """
+    A QueryPlan compiled once for a filter shape: the rendered key condition and
+    filter expression strings with their name placeholders, and for every value
+    placeholder either the filter value (slot) it is bound to or a constant of
+    the expression itself (e.g. 'NULL' for a None equality)
+    """
+    
+    def __init__(self, plan: QueryPlan):
+        self.operation = plan.operation
+        self.index_name = plan.index_name
+        self.hash_key = plan.hash_key
+        self.range_key = plan.range_key
+        self.matches_nothing = plan.matches_nothing
+        self.expressions = {}
+        self.names = {}
+        self.slots = {}  # value placeholder -> slot index
+        self.constants = {}  # value placeholder -> value
+        for param, built in plan.render():
+            self.expressions[param] = built.condition_expression
+            self.names.update(built.attribute_name_placeholders)
+            for placeholder, value in built.attribute_value_placeholders.items():
+                if isinstance(value, _Slot):
+                    self.slots[placeholder] = value.index
+                else:
+                    self.constants[placeholder] = value
+    
+    def bind(self, values: List[Any]) -> QueryPlan:
+        """QueryPlan for one call, given the filter values in slot order"""
+        bound = dict(self.constants)
+        for placeholder, index in self.slots.items():
+            bound[placeholder] = to_dynamodb_value(values[index])
+        return QueryPlan(self.operation, self.index_name,
+                         self.expressions.get('KeyConditionExpression'),
+                         _MATCH_NOTHING if self.matches_nothing else self.expressions.get('FilterExpression'),
+                         self.hash_key, self.range_key, self.names, bound)
+
+
+class PlanCache:
+    """
+    LRU of PlanTemplates keyed by table, schema, sort key, search fields and filter shape
+    server.py issues a few dozen filter shapes with changing values: each shape
+    is planned, compiled and rendered to expression strings once, and later
+    calls only bind their values. max_items=0 disables caching (every call is
+    planned from scratch with boto3 conditions).
+    """
+    
+    def __init__(self, max_items: int = 512):
+        self.max_items = max_items
+        self._entries = OrderedDict()  # cache key -> PlanTemplate
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+    
+    def plan(self, table_name: str, schema: TableSchema, filter_dict: Dict,
+             sort_key: Optional[str] = None, search_fields: tuple = ()) -> QueryPlan:
+        """plan_query() through the cache (raises UnsupportedFilterError like compile_filter)"""
+        if self.max_items <= 0:
+            return plan_query(schema, filter_dict, sort_key, search_fields)
+        values = []
+        shape, _ = _filter_template(filter_dict, values)
+        # The schema is part of the key: plans made while it was unknown (scans
+        # only, see DynamoDBCollection.get_schema) must not outlive it
+        cache_key = (table_name, schema.signature, sort_key, search_fields, shape)
+        template = self._entries.get(cache_key)
+        if template is not None:
+            self._entries.move_to_end(cache_key)
+            self.hits += 1
+            return template.bind(values)
+        self.misses += 1
+        _, slotted = _filter_template(filter_dict, [], build=True)
+        template = PlanTemplate(plan_query(schema, slotted, sort_key, search_fields))
+        self._entries[cache_key] = template
+        while len(self._entries) > self.max_items:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+        return template.bind(values)
+    
+    def clear(self):
+        self._entries.clear()
+    
+    def stats(self) -> Dict:
+        """Hit/miss/eviction counters and current size"""
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': round(self.hits / lookups, 4) if lookups else 0.0,
+            'evictions': self.evictions,
+            'size': len(self._entries),
+            'max_items': self.max_items,
+        }
+
+
+class DynamoDBCollection:
+    """Simulates MongoDB collection interface for DynamoDB"""
+    
+    def __init__(self, database: 'DynamoDBDatabase', table_name: str):
+        self.database = database
+        self.table_name = table_name
+        self._schema = None
+        self._schema_retry_at = 0.0  # monotonic time DescribeTable may be retried after a failure
+        self.cache = None
+        # Fields with a lowercased shadow attribute for case-insensitive $regex
+        self.search_fields = ()
+        # Field groups counted by the database's DynamoDBAggregates
+        self.aggregates = ()
+        # Bumped after every write so later reads never join a read that started before it
+        self.write_generation = 0
+    
+    def enable_search_fields(self, fields: List[str]):
+        """
+        Keep a lowercased copy of these string fields in SEARCH_ATTRIBUTE_PREFIX
+        shadow attributes on every write, so case-insensitive $regex filters on
+        them are exact (see compile_filter). Shadows are hidden from reads;
+        rebuild_search_attributes() adds them to items written before.
+        """
+        self.search_fields = tuple(fields)
+    
+    def enable_aggregates(self, groups: List[Any]):
+        """
+        Count documents per value of each group of fields ("status",
+        "status+assigned_to" or a list of fields) in db.aggregates; single-item
+        writes then go through counted transactions (see DynamoDBAggregates)
+        """
+        self.aggregates = tuple(_aggregate_fields(group) for group in groups)
+    
+    @property
+    def aggregate_fields(self) -> List[str]:
+        """Every field some aggregate of this collection groups by"""
+        return list(dict.fromkeys(field for fields in self.aggregates for field in fields))
+    
+    async def _write_counted(self, kind: str, item_or_key: Dict, update_kwargs: Optional[Dict] = None) -> Optional[Dict]:
+        """One put/update/delete with its aggregate deltas, as a transaction; returns the item it replaced"""
+        transaction = DynamoDBTransaction(self.database)
+        transaction._add(self, kind, item_or_key, update_kwargs)
+        await transaction.commit()
+        return transaction.old_images.get(0)
+    
+    async def _write_one(self, kind: str, item_or_key: Dict, update_kwargs: Optional[Dict] = None) -> Dict:
+        """One PutItem/UpdateItem/DeleteItem, published to the change feed (with the item it replaced)"""
+        table = await self._get_table()
+        publish = self.database.changes.active
+        extra = {'ReturnValues': 'ALL_OLD'} if publish else {}
+        if kind == 'put':
+            response = await self._call(table.put_item, Item=item_or_key, **extra)
+        elif kind == 'update':
+            response = await self._call(table.update_item, Key=item_or_key, **update_kwargs, **extra)
+        else:
+            response = await self._call(table.delete_item, Key=item_or_key, **extra)
+        if publish:
+            old = response.get('Attributes')
+            await self._publish_changes([(item_or_key, old, self._new_item(kind, old, item_or_key, update_kwargs))])
+        return response
+    
+    @classmethod
+    def _new_item(cls, kind: str, old: Optional[Dict], item_or_key: Dict, update_kwargs: Optional[Dict]) -> Optional[Dict]:
+        """The item a put/update/delete leaves behind, given the item it replaced"""
+        if kind == 'put':
+            return item_or_key
+        if kind == 'update':
+            return cls._updated_item(old if old is not None else item_or_key, update_kwargs)
+        return None
+    
+    async def _publish_changes(self, writes: List[tuple]):
+        """Publish (item or key, old item, new item) writes of this table as ChangeEvents"""
+        schema = await self.get_schema()
+        events = (ChangeEvent.of_write(self.table_name, schema.key_dict(key), old, new) for key, old, new in writes)
+        await self.database.changes.publish([event for event in events if event is not None])
+    
+    def _with_search_attributes(self, item: Dict) -> Dict:
+        """The item plus the shadow attributes of its search fields"""
+        if not self.search_fields:
+            return item
+        item = dict(item)
+        for field in self.search_fields:
+            if isinstance(item.get(field), str):
+                item[search_attribute(field)] = item[field].casefold()
+            else:
+                item.pop(search_attribute(field), None)
+        return item
+    
+    def _from_dynamodb(self, item: Dict) -> Dict:
+        """Convert an item read from the table, hiding search shadow attributes"""
+        return self._convert_from_dynamodb(self._strip_search_attributes(item))
+    
+    def _strip_search_attributes(self, item: Dict) -> Dict:
+        if not self.search_fields:
+            return item
+        return {k: v for k, v in item.items() if not k.startswith(SEARCH_ATTRIBUTE_PREFIX)}
+    
+    async def rebuild_search_attributes(self) -> int:
+        """Add/refresh the shadow attributes of every item whose shadows are stale; returns items updated"""
+        if not self.search_fields:
+            return 0
+        table = await self._get_table()
+        schema = await self.get_schema()
+        updated = 0
+        try:
+            async for page in self.find({})._raw_pages(table, QueryPlan('scan')):
+                for item in page:
+                    expected = self._with_search_attributes(item)
+                    if expected == item:
+                        continue
+                    shadows = {k: v for k, v in expected.items() if k.startswith(SEARCH_ATTRIBUTE_PREFIX)}
+                    stale = [k for k in item if k.startswith(SEARCH_ATTRIBUTE_PREFIX) and k not in expected]
+                    await self._call(table.update_item, Key=schema.key_dict(item),
+                                     **self._update_kwargs(shadows, remove=stale))
+                    updated += 1
+        finally:
+            self.write_generation += 1
+            if self.cache is not None:
+                self.cache.clear()
+        return updated
+    
+    def enable_cache(self, ttl: float = 30.0, max_items: int = 1000) -> ItemCache:
+        """Serve key lookups (find_one, find_many_by_keys) through a read-through ItemCache"""
+        self.cache = ItemCache(ttl, max_items)
+        return self.cache
+    
+    @staticmethod
+    def _cache_key(schema: TableSchema, filter_dict: Dict) -> Optional[tuple]:
+        """
+        Cache key for a filter that is exactly the primary key, or a single
+        equality on an index hash key; None if the lookup is not cacheable
+        """
+        if not filter_dict:
+            return None
+        key = schema.primary_key_from_filter(filter_dict)
+        if key is not None and len(key) == len(filter_dict):
+            return tuple(sorted(key.items()))
+        if len(filter_dict) != 1:
+            return None
+        attribute, value = next(iter(filter_dict.items()))
+        value = _equality_value(value)
+        if value is _NO_VALUE or isinstance(value, bytearray) or not schema.accepts_key_value(attribute, value):
+            return None
+        if any(index_name and hash_key == attribute for index_name, hash_key, _ in schema.key_sources()):
+            return ((attribute, value),)
+        return None
+    
+    async def _single_flight(self, operation: str, factory, *args) -> Any:
+        """
+        Run a read through the database's SingleFlight, keyed by its arguments
+        and endpoint (whose metrics it is charged to). Reads under a limiting
+        ScanBudget run on their own: what they return depends on that budget.
+        """
+        budget = _current_budget.get()
+        if budget is not None and budget.limited:
+            return await factory()
+        key = (self.table_name, self.write_generation, _current_endpoint.get(), operation)
+        key += tuple(_freeze(arg) for arg in args)
+        return await self.database.single_flight.run(key, factory)
+    
+    async def _invalidate(self, key: Dict):
+        """Drop cached copies of a written item (key dict or full item)"""
+        self.write_generation += 1
+        if self.cache is None:
+            return
+        schema = await self.get_schema()
+        if schema.hash_key and all(k in key for k in schema.key_attributes()):
+            self.cache.invalidate(schema.key_of(key))
+        else:
+            # Not addressed by its primary key; nothing tells which entries are stale
+            self.cache.clear()
+    
+    async def _get_table(self):
+        """Get DynamoDB table resource from the database's shared connection pool"""
+        return await self.database.get_table(self.table_name)
+    
+    async def _call(self, method, **kwargs) -> Dict:
+        """One request against this table (rate limited and counted by the database)"""
+        return await self.database.call(self.table_name, method, **kwargs)
+    
+    async def get_schema(self) -> TableSchema:
+        """
+        Key schema and indexes of the table (describe_table, cached). If
+        DescribeTable fails, the table's definition in dynamodb-tables.json
+        (or a key-less schema: scans only) is returned without caching it, and
+        the table is described again after SCHEMA_RETRY_SECONDS.
+        """
+        if self._schema is not None:
+            return self._schema
+        if time.monotonic() < self._schema_retry_at:
+            return self._fallback_schema()
+        client = await self.database.get_client()
+        try:
+            response = await client.describe_table(TableName=self.table_name)
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') in THROTTLE_ERROR_CODES:
+                # Transient; plan properly on the next call
+                raise
+            # e.g. a policy without dynamodb:DescribeTable, or a transient error
+            schema = self._fallback_schema()
+            source = "dynamodb-tables.json" if schema.hash_key else "scans only"
+            logger.warning(f"Could not describe {self.table_name}, planning from {source} "
+                           f"for {SCHEMA_RETRY_SECONDS:.0f}s: {e}")
+            self._schema_retry_at = time.monotonic() + SCHEMA_RETRY_SECONDS
+            return schema
+        self._schema = TableSchema.from_description(response['Table'])
+        return self._schema
+    
+    def _fallback_schema(self) -> TableSchema:
+        """Schema of the table's definition file entry, or a key-less one if it has none"""
+        definition = self.database.table_definition(self.table_name)
+        return TableSchema.from_description(definition) if definition else TableSchema(None)
+    
+    @staticmethod
+    def _apply_projection(item: Dict, projection: Optional[Dict]) -> Dict:
+        """
+        Apply a Mongo-style projection to a converted item.
+        Inclusions are also pushed down as a ProjectionExpression; DynamoDB has
+        no exclusion projection, so excluded fields (e.g. {"_id": 0}) are dropped here.
+        """
+        if not projection:
+            return item
+        included, excluded = _projection_fields(projection)
+        if included is not None:
+            top_level = {field.split('.')[0] for field in included}
+            item = {k: v for k, v in item.items() if k in top_level}
+        return {k: v for k, v in item.items() if k not in excluded}
+    
+    async def plan(self, filter_dict: Dict, sort_key: Optional[str] = None) -> QueryPlan:
+        """Query plan for a Mongo-style filter on this collection (scans are reported, see _plan)"""
+        return self._plan(await self.get_schema(), filter_dict, sort_key)
+    
+    def _plan(self, schema: TableSchema, filter_dict: Dict, sort_key: Optional[str] = None,
+              report: bool = True) -> QueryPlan:
+        if filter_dict:
+            plan = self.database.plan_cache.plan(self.table_name, schema, filter_dict, sort_key, self.search_fields)
+        else:
+            plan = QueryPlan('scan')
+        if report and not plan.is_query and not plan.matches_nothing:
+            self.database.report_scan(self.table_name, filter_dict)
+        return plan
+    
+    async def explain(self, filter_dict: Dict, sort_key: Optional[str] = None) -> Dict:
+        """
+        How find_one/find would read a filter, without reading anything:
+        {'operation': 'GetItem' | 'Query' | 'Scan' | None, 'index': ..., 'filter': shape}
+        (None: the filter can match nothing, so nothing is read)
+        """
+        filter_dict = filter_dict or {}
+        schema = await self.get_schema()
+        key = schema.primary_key_from_filter(filter_dict)
+        if key is not None and len(key) == len(filter_dict):
+            operation, index_name = 'GetItem', None
+        else:
+            # Through the plan cache, so this is the plan find() would run
+            plan = self._plan(schema, filter_dict, sort_key, report=False)
+            operation = None if plan.matches_nothing else plan.operation_name
+            index_name = plan.index_name
+        return {'table': self.table_name, 'operation': operation, 'index': index_name,
+                'filter': filter_shape(filter_dict)}
+    
+    @staticmethod
+    def _convert_to_dynamodb(item: Dict) -> Dict:
+        """Convert Python dict to DynamoDB format (floats, datetimes, sets)"""
+        return to_dynamodb_value(item)
+    
+    @staticmethod
+    def _convert_from_dynamodb(item: Dict) -> Dict:
+        """Convert DynamoDB format to Python dict (numbers stay numeric)"""
+        return from_dynamodb_value(item)
+    
+    async def find_one(self, filter_dict: Dict, projection: Optional[Dict] = None) -> Optional[Dict]:
+        """
+        Find a single document
+        Args:
+            filter_dict: Query filter (e.g., {"id": "123"} or {"mobile": "1234567890", "role": "COO"})
+            projection: Fields to include/exclude (e.g., {"_id": 0})
+        
+        Uses GetItem when the filter is exactly the primary key, otherwise a
+        Query on the best index (or a paginated Scan) that stops at the first match.
+        """
+        filter_dict = filter_dict or {}
+        table = await self._get_table()
+        schema = await self.get_schema()
+        
+        cache_key = self._cache_key(schema, filter_dict) if self.cache is not None else None
+        if cache_key is not None:
+            document = self.cache.get(cache_key)
+            if document is None:
+                # Cache the whole item so any projection can be served from it later
+                version = self.cache.version
+                document = await self._fetch_one(table, schema, filter_dict, {})
+                if document is None:
+                    return None
+                self.cache.put(cache_key, schema.key_of(document), document, version)
+            return self._apply_projection(document, projection)
+        
+        projection_kwargs = _projection_kwargs(_projection_fields(projection)[0])
+        document = await self._fetch_one(table, schema, filter_dict, projection_kwargs)
+        if document is None:
+            return None
+        return self._apply_projection(document, projection)
+    
+    async def _fetch_one(self, table, schema: TableSchema, filter_dict: Dict,
+                         projection_kwargs: Dict) -> Optional[Dict]:
+        """
+        Converted first match: GetItem for an exact primary key filter, otherwise
+        a query/scan. Concurrent identical lookups share one request.
+        """
+        async def fetch():
+            key = schema.primary_key_from_filter(filter_dict)
+            if key is not None and len(key) == len(filter_dict):
+                response = await self._call(table.get_item, Key=key, **projection_kwargs)
+                item = response.get('Item')
+            else:
+                plan = self._plan(schema, filter_dict)
+                item = None if plan.matches_nothing else await self._first_match(table, plan, projection_kwargs)
+            return None if item is None else self._from_dynamodb(item)
+        
+        return await self._single_flight('find_one', fetch, filter_dict, projection_kwargs)
+    
+    async def _first_match(self, table, plan: QueryPlan, projection_kwargs: Optional[Dict] = None) -> Optional[Dict]:
+        """Page through a query/scan until the first item passes the filter"""
+        kwargs = _merge_request(plan.request_kwargs(), projection_kwargs or {})
+        if plan.filter_expression is None:
+            # Every evaluated item matches, so one is enough
+            kwargs['Limit'] = 1
+        read = table.query if plan.is_query else table.scan
+        while True:
+            response = await self._call(read, **kwargs)
+            items = response.get('Items', [])
+            if items:
+                return items[0]
+            if 'LastEvaluatedKey' not in response:
+                return None
+            kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+    
+    def find(self, filter_dict: Dict = None, projection: Optional[Dict] = None):
+        """
+        Find multiple documents
+        Returns a cursor-like object with to_list() method
+        """
+        return DynamoDBCursor(self, filter_dict, projection)
+    
+    async def insert_one(self, document: Dict):
+        """Insert a single document"""
+        table = await self._get_table()
+        item = self._with_search_attributes(self._convert_to_dynamodb(document))
+        if self.aggregates:
+            await self._write_counted('put', item)
+            return
+        try:
+            await self._write_one('put', item)
+        finally:
+            await self._invalidate(item)
+    
+    async def insert_many(self, documents: List[Dict], concurrency: int = 4) -> BulkWriteResult:
+        """
+        Insert (put) many documents with 25-item BatchWriteItem calls
+        Args:
+            documents: documents to write; a later document with the same key replaces an earlier one
+            concurrency: number of batches in flight at once
+        Returns:
+            BulkWriteResult with the indexes of documents that were / were not written
+        """
+        requests = [
+            {'PutRequest': {'Item': self._with_search_attributes(self._convert_to_dynamodb(document))}}
+            for document in documents
+        ]
+        if not self.aggregates:
+            return await self._batch_write(requests, concurrency)
+        
+        # BatchWriteItem cannot return replaced items: read them first, count after the batch
+        schema = await self.get_schema()
+        items = [request['PutRequest']['Item'] for request in requests]
+        current = await self._current_items(schema, items, full=self.database.changes.active) if items else {}
+        result = await self._batch_write(requests, concurrency, current)
+        await self._count_bulk_writes(schema, [(schema.key_of(items[i]), items[i]) for i in result.succeeded], current)
+        return result
+    
+    put_many = insert_many
+    
+    @staticmethod
+    def _request_item(request: Dict) -> Dict:
+        """Item of a BatchWriteItem put request, or key of a delete request"""
+        if 'PutRequest' in request:
+            return request['PutRequest']['Item']
+        return request['DeleteRequest']['Key']
+    
+    @classmethod
+    def _request_key(cls, schema: TableSchema, request: Dict) -> Any:
+        """Primary key identity of a BatchWriteItem put/delete request"""
+        return schema.key_of(cls._request_item(request))
+    
+    async def _batch_write(self, requests: List[Dict], concurrency: int = 4,
+                           current: Optional[Dict[Any, Dict]] = None) -> BulkWriteResult:
+        """
+        Run put/delete requests as concurrent BatchWriteItem chunks
+        (current: the items at their keys, by primary key, if already read
+        in full; the change feed needs them)
+        """
+        schema = await self.get_schema()
+        if not schema.hash_key:
+            raise ValueError(f"Primary key of {self.table_name} is unknown; cannot batch write")
+        result = BulkWriteResult()
+        
+        # BatchWriteItem rejects two requests for the same key in one call; the last one wins
+        latest = {}
+        superseded = {}  # index of the request sent -> earlier requests for its key
+        for index, request in enumerate(requests):
+            key = self._request_key(schema, request)
+            if key in latest:
+                superseded[index] = superseded.pop(latest[key], []) + [latest[key]]
+            latest[key] = index
+        indexed = [(index, requests[index]) for index in sorted(latest.values())]
+        publish = self.database.changes.active
+        if publish and current is None:
+            current = await self._current_items(schema, [self._request_item(request) for _, request in indexed], full=True)
+        
+        chunks = [indexed[i:i + BATCH_WRITE_SIZE] for i in range(0, len(indexed), BATCH_WRITE_SIZE)]
+        semaphore = asyncio.Semaphore(max(1, concurrency))
+        
+        async def write_chunk(chunk):
+            async with semaphore:
+                await self._batch_write_chunk(schema, chunk, result)
+        
+        try:
+            await asyncio.gather(*(write_chunk(chunk) for chunk in chunks))
+        finally:
+            self.write_generation += 1
+            if self.cache is not None:
+                for key in latest:
+                    self.cache.invalidate(key)
+        # Replaced requests share the outcome of the request that was sent for their key
+        written = set(result.succeeded)
+        for index, earlier in superseded.items():
+            if index in written:
+                result.succeeded.extend(earlier)
+            elif index in result.failed:
+                result.failed.update({e: result.failed[index] for e in earlier})
+        result.succeeded.sort()
+        if publish:
+            written = set(result.succeeded)
+            images = dict(current)
+            writes = []
+            for index, request in indexed:
+                if index not in written:
+                    continue
+                item = self._request_item(request)
+                new = item if 'PutRequest' in request else None
+                writes.append((item, images.get(schema.key_of(item)), new))
+                images[schema.key_of(item)] = new
+            await self._publish_changes(writes)
+        return result
+    
+    async def _batch_write_chunk(self, schema: TableSchema, chunk: List[tuple], result: BulkWriteResult):
+        """One BatchWriteItem call (up to 25 requests), retrying unprocessed items"""
+        resource = await self.database.connect()
+        index_by_key = {self._request_key(schema, request): index for index, request in chunk}
+        pending = [request for _, request in chunk]
+        
+        for attempt in range(BATCH_MAX_ATTEMPTS):
+            try:
+                response = await self._call(resource.batch_write_item, RequestItems={self.table_name: pending})
+            except ClientError as e:
+                # The whole batch was rejected (e.g. one oversized item); isolate the bad items
+                logger.warning(f"BatchWriteItem on {self.table_name} failed, writing items individually: {e}")
+                await self._write_individually(schema, pending, index_by_key, result)
+                return
+            
+            unprocessed = response.get('UnprocessedItems', {}).get(self.table_name, [])
+            unprocessed_keys = {self._request_key(schema, request) for request in unprocessed}
+            for request in pending:
+                key = self._request_key(schema, request)
+                if key not in unprocessed_keys:
+                    result.succeeded.append(index_by_key[key])
+            if not unprocessed:
+                return
+            self.database.table_stats(self.table_name)['unprocessed'] += len(unprocessed)
+            pending = unprocessed
+            await _backoff(attempt)
+        
+        for request in pending:
+            index = index_by_key[self._request_key(schema, request)]
+            result.failed[index] = f"Unprocessed after {BATCH_MAX_ATTEMPTS} BatchWriteItem attempts"
+    
+    async def _write_individually(self, schema: TableSchema, requests: List[Dict],
+                                  index_by_key: Dict, result: BulkWriteResult):
+        """Fallback for a rejected batch: one PutItem/DeleteItem per request"""
+        table = await self._get_table()
+        for request in requests:
+            index = index_by_key[self._request_key(schema, request)]
+            try:
+                if 'PutRequest' in request:
+                    await self._call(table.put_item, Item=request['PutRequest']['Item'])
+                else:
+                    await self._call(table.delete_item, Key=request['DeleteRequest']['Key'])
+                result.succeeded.append(index)
+            except ClientError as e:
+                result.failed[index] = str(e)
+    
+    async def update_one(self, filter_dict: Dict, update_dict: Dict):
+        """
+        Update a single document
+        Args:
+            filter_dict: Query filter (e.g., {"id": "123"})
+            update_dict: Update operations (e.g., {"$set": {"name": "John"}})
+        """
+        table = await self._get_table()
+        key = self._key_from_filter(filter_dict)
+        update_kwargs = self._update_kwargs(update_dict, self.search_fields)
+        if self.aggregates:
+            await self._write_counted('update', key, update_kwargs)
+            return
+        
+        try:
+            await self._write_one('update', key, update_kwargs)
+        finally:
+            await self._invalidate(key)
+    
+    @staticmethod
+    def _key_from_filter(filter_dict: Dict) -> Dict:
+        """Key of a single-item write: the first filter field (e.g. {"id": "123"})"""
+        key_name = list(filter_dict.keys())[0]
+        return {key_name: filter_dict[key_name]}
+    
+    @classmethod
+    def _update_kwargs(cls, update_dict: Dict, search_fields: tuple = (), remove: List[str] = ()) -> Dict:
+        """
+        UpdateExpression and attribute names/values for a Mongo-style $set update
+        (also setting the shadow attributes of updated search_fields, and
+        removing the attributes in remove)
+        """
+        # Extract update values
+        if "$set" in update_dict:
+            update_values = update_dict["$set"]
+        else:
+            update_values = update_dict
+        
+        assignments = {k: cls._convert_to_dynamodb(v) for k, v in update_values.items()}
+        removals = list(remove)
+        for field in search_fields:
+            if field in update_values:
+                if isinstance(update_values[field], str):
+                    assignments[search_attribute(field)] = update_values[field].casefold()
+                else:
+                    removals.append(search_attribute(field))
+        
+        # Build update expression
+        clauses = []
+        if assignments:
+            clauses.append("SET " + ", ".join([f"#{k} = :{k}" for k in assignments]))
+        if removals:
+            clauses.append("REMOVE " + ", ".join([f"#{k}" for k in removals]))
+        kwargs = {
+            'UpdateExpression': " ".join(clauses),
+            'ExpressionAttributeNames': {f"#{k}": k for k in list(assignments) + removals},
+        }
+        if assignments:
+            kwargs['ExpressionAttributeValues'] = {f":{k}": v for k, v in assignments.items()}
+        return kwargs
+    
+    @staticmethod
+    def _updated_item(item: Dict, update_kwargs: Dict) -> Dict:
+        """item after an update built by _update_kwargs (SETs :<field>, REMOVEs the other named fields)"""
+        values = update_kwargs.get('ExpressionAttributeValues', {})
+        updated = dict(item)
+        for field in update_kwargs['ExpressionAttributeNames'].values():
+            if f":{field}" in values:
+                updated[field] = values[f":{field}"]
+            else:
+                updated.pop(field, None)
+        return updated
+    
+    async def _current_items(self, schema: TableSchema, keys: List[Dict], full: bool = False) -> Dict[Any, Dict]:
+        """
+        Key and aggregated fields (every attribute if full) of the items at
+        these keys (consistent BatchGetItem), by primary key
+        """
+        unique_keys = list({schema.key_of(key): schema.key_dict(key) for key in keys}.values())
+        request_template = {'ConsistentRead': True}
+        if not full:
+            request_template.update(_projection_kwargs(schema.key_attributes() + self.aggregate_fields))
+        pages = await asyncio.gather(*(
+            self._batch_get_chunk(unique_keys[i:i + BATCH_GET_SIZE], request_template)
+            for i in range(0, len(unique_keys), BATCH_GET_SIZE)
+        ))
+        return {schema.key_of(item): item for page in pages for item in page}
+    
+    async def _count_bulk_writes(self, schema: TableSchema, writes: List[tuple], current: Dict[Any, Dict]):
+        """Apply the aggregate deltas of (primary key, new item or None) writes in order, from current items"""
+        deltas = {}
+        for primary_key, item in writes:
+            self.database.aggregates.deltas(self, current.get(primary_key), item, deltas)
+            current[primary_key] = item
+        await self.database.aggregates.apply(deltas)
+    
+    async def delete_one(self, filter_dict: Dict):
+        """Delete a single document"""
+        table = await self._get_table()
+        key = self._key_from_filter(filter_dict)
+        if self.aggregates:
+            old = await self._write_counted('delete', key)
+            return {'Attributes': old} if old is not None else {}
+        
+        try:
+            response = await self._write_one('delete', key)
+        finally:
+            await self._invalidate(key)
+        return response
+    
+    async def delete_many(self, filter_dict: Dict, concurrency: int = 4) -> BulkWriteResult:
+        """
+        Delete every document matching filter
+        Reads only the key (and aggregated) attributes of matching items (following every page;
+        whole items while the change feed is active), then deletes them with concurrent 25-item
+        BatchWriteItem requests.
+        """
+        schema = await self.get_schema()
+        if not schema.hash_key:
+            raise ValueError(f"Primary key of {self.table_name} is unknown; cannot delete_many")
+        
+        projection = None
+        if not self.database.changes.active:
+            projection = {k: 1 for k in schema.key_attributes() + self.aggregate_fields}
+        cursor = self.find(filter_dict, projection)
+        items = []
+        async for page in cursor._iter_raw_pages():
+            items.extend(page)
+        if not items:
+            return BulkWriteResult()
+        requests = [{'DeleteRequest': {'Key': schema.key_dict(item)}} for item in items]
+        current = {schema.key_of(item): item for item in items}
+        result = await self._batch_write(requests, concurrency, current)
+        if self.aggregates:
+            await self._count_bulk_writes(schema, [(schema.key_of(items[i]), None) for i in result.succeeded], current)
+        return result
+    
+    async def count(self, filter_dict: Dict = None, approximate: bool = False,
+                    segments: Optional[int] = None) -> int:
+        """
+        Count documents matching filter server-side (Select='COUNT', no item transfer)
+        approximate: for an unfiltered count, return DescribeTable's ItemCount
+                     (free, but refreshed by DynamoDB only about every six hours)
+        segments: parallel scan segments (None picks automatically from table size)
+        """
+        if approximate and not filter_dict:
+            client = await self.database.get_client()
+            response = await client.describe_table(TableName=self.table_name)
+            return response['Table'].get('ItemCount', 0)
+        cursor = self.find(filter_dict or {})
+        if segments is not None:
+            cursor.parallel(segments)
+        return await cursor.count()
+    
+    async def count_documents(self, filter_dict: Dict = None) -> int:
+        """Count documents matching filter"""
+        return await self.count(filter_dict)
+    
+    async def find_many_by_keys(self, keys: List[Any], projection: Optional[Dict] = None) -> Dict[Any, Dict]:
+        """
+        Fetch many documents by primary key with BatchGetItem
+        Args:
+            keys: key dicts ({"id": "123"}), bare hash key values, or (hash, range) tuples
+            projection: Fields to include/exclude (e.g., {"_id": 0})
+        Returns:
+            {primary key (hash value or (hash, range) tuple): document}; missing keys are absent
+        
+        Keys are deduplicated and requested in concurrent chunks of 100;
+        UnprocessedKeys are retried with jittered exponential backoff. With a
+        cache enabled, cached keys are served without a request.
+        """
+        schema = await self.get_schema()
+        if not schema.hash_key:
+            raise ValueError(f"Primary key of {self.table_name} is unknown; cannot batch get")
+        
+        unique_keys = {}
+        for key in keys:
+            key_dict = schema.key_dict(key)
+            if all(v is not None for v in key_dict.values()):
+                unique_keys[schema.key_of(key_dict)] = key_dict
+        
+        found = {}
+        request_template = {}
+        if self.cache is not None:
+            # Serve cached keys; fetch the rest as whole items so they can be cached
+            version = self.cache.version
+            for primary_key, key_dict in list(unique_keys.items()):
+                document = self.cache.get(tuple(sorted(key_dict.items())))
+                if document is not None:
+                    found[primary_key] = self._apply_projection(document, projection)
+                    del unique_keys[primary_key]
+        else:
+            included = _projection_fields(projection)[0]
+            if included is not None:
+                # Key attributes are needed to map results back to their keys
+                request_template = _projection_kwargs(included + schema.key_attributes())
+        if not unique_keys:
+            return found
+        
+        key_list = list(unique_keys.values())
+        chunks = [key_list[i:i + BATCH_GET_SIZE] for i in range(0, len(key_list), BATCH_GET_SIZE)]
+        pages = await asyncio.gather(*(self._batch_get_chunk(chunk, request_template) for chunk in chunks))
+        
+        for page in pages:
+            for item in page:
+                document = self._from_dynamodb(item)
+                primary_key = schema.key_of(item)
+                if self.cache is not None:
+                    self.cache.put(tuple(sorted(schema.key_dict(document).items())), primary_key, document, version)
+                found[primary_key] = self._apply_projection(document, projection)
+        return found
+    
+    async def _batch_get_chunk(self, keys: List[Dict], request_template: Dict) -> List[Dict]:
+        """One BatchGetItem call (up to 100 keys), retrying unprocessed keys"""
+        resource = await self.database.connect()
+        request_items = {self.table_name: dict(request_template, Keys=keys)}
+        items = []
+        for attempt in range(BATCH_MAX_ATTEMPTS):
+            response = await self._call(resource.batch_get_item, RequestItems=request_items)
+            items.extend(response.get('Responses', {}).get(self.table_name, []))
+            request_items = response.get('UnprocessedKeys') or {}
+            if not request_items:
+                return items
+            unprocessed = len(request_items.get(self.table_name, {}).get('Keys', []))
+            self.database.table_stats(self.table_name)['unprocessed'] += unprocessed
+            await _backoff(attempt)
+        remaining = len(request_items.get(self.table_name, {}).get('Keys', []))
+        raise RuntimeError(f"BatchGetItem on {self.table_name} left {remaining} keys unprocessed")
+    
+    async def distinct(self, field_name: str, filter_dict: Dict = None) -> List[Any]:
+        """Get distinct values for a field"""
+        cursor = self.find(filter_dict or {})
+        items = await cursor.to_list(10000)
+        values = set()
+        for item in items:
+            if field_name in item and item[field_name] is not None:
+                values.add(item[field_name])
+        return list(values)
+
+
+class DynamoDBCursor:
+    """
+    Simulates MongoDB cursor for DynamoDB scans/queries
+    
+    Besides to_list(), results can be streamed with bounded memory:
+        async for item in db.leads.find({...}): ...
+        async for page in db.leads.find({...}).pages(): ...
+    
+    .lazy() and .raw() read through the low-level client instead of the
+    resource, returning LazyItem mappings or untouched AttributeValue dicts.
+    """
+    
+    def __init__(self, collection: DynamoDBCollection, filter_dict: Dict = None, 
+                 projection: Dict = None):
+        self.collection = collection
+        self.table_name = collection.table_name
+        self.filter_dict = filter_dict or {}
+        self.projection = projection
+        self._sort_key = None
+        self._sort_direction = 1
+        self._segments = None
+        self._order_by_key = False
+        self._mode = 'items'  # 'items', 'lazy' or 'raw'
+    
+    def sort(self, key: str, direction: int = 1):
+        """
+        Sort results. Pushed down to DynamoDB (ScanIndexForward, stopping at
+        the limit) when key orders the queried table/index; otherwise the
+        top `limit` items are kept in a heap while pages stream in.
+        """
+        self._sort_key = key
+        self._sort_direction = direction
+        return self
+    
+    def parallel(self, segments: int, order_by_key: bool = False):
+        """
+        Scan with `segments` concurrent Segment/TotalSegments workers
+        (1 forces a sequential scan; by default large tables are split
+        automatically). order_by_key returns merged results in primary key order.
+        """
+        self._segments = segments
+        self._order_by_key = order_by_key
+        return self
+    
+    def lazy(self):
+        """Return LazyItem mappings that decode attributes on first access (read-only)"""
+        self._mode = 'lazy'
+        return self
+    
+    def raw(self):
+        """Return low-level AttributeValue items untouched, for pass-through endpoints"""
+        self._mode = 'raw'
+        return self
+    
+    def _convert(self, items: List[Dict]) -> List[Dict]:
+        """Convert raw DynamoDB items according to the cursor's mode"""
+        if self.collection.search_fields:
+            items = [self.collection._strip_search_attributes(item) for item in items]
+        if self._mode == 'lazy':
+            return [LazyItem(item) for item in items]
+        if self._mode == 'raw':
+            return items
+        return [DynamoDBCollection._convert_from_dynamodb(item) for item in items]
+    
+    def _sort_value(self, item: Dict) -> tuple:
+        """Type-safe sort key of an unconverted item"""
+        return sort_value(self._raw_field(item, self._sort_key))
+    
+    def _select_top(self, top: List[Dict], page: List[Dict], limit: Optional[int]) -> List[Dict]:
+        """Merge a page into the running sorted top-`limit` items (stable)"""
+        candidates = top + page
+        descending = self._sort_direction == -1
+        if limit is None:
+            return sorted(candidates, key=self._sort_value, reverse=descending)
+        if descending:
+            return heapq.nlargest(limit, candidates, key=self._sort_value)
+        return heapq.nsmallest(limit, candidates, key=self._sort_value)
+    
+    async def _top_k(self, table, plan: QueryPlan, limit: Optional[int]) -> List[Dict]:
+        """Read every matching item, keeping only the sorted top `limit` in memory"""
+        async def segment_top(segment: Optional[tuple]) -> List[Dict]:
+            top = []
+            async for page in self._raw_pages(table, plan, segment=segment):
+                top = self._select_top(top, page, limit)
+            return top
+        
+        segments = await self._scan_segments(plan)
+        if segments > 1:
+            tops = await asyncio.gather(*(segment_top((segment, segments)) for segment in range(segments)))
+            return self._select_top([], [item for top in tops for item in top], limit)
+        return await segment_top(None)
+    
+    def _raw_field(self, item: Dict, field: str, default: Any = None) -> Any:
+        """Value of a top-level field of an unconverted item"""
+        if field not in item:
+            return default
+        if self._mode == 'items':
+            return item[field]
+        return decode_attribute(item[field])
+    
+    async def _reader(self, table, plan: QueryPlan) -> tuple:
+        """(read function, request parameters) for the cursor's mode"""
+        if self._mode == 'items':
+            kwargs = plan.request_kwargs()
+            read = table.query if plan.is_query else table.scan
+        else:
+            client = await self.collection.database.get_client()
+            kwargs = plan.client_kwargs(self.table_name)
+            read = client.query if plan.is_query else client.scan
+        return read, _merge_request(kwargs, self._projection_kwargs())
+    
+    def _project(self, items: List[Dict]) -> List[Dict]:
+        """Apply the cursor's projection"""
+        if not self.projection:
+            return items
+        return [DynamoDBCollection._apply_projection(item, self.projection) for item in items]
+    
+    def _projection_kwargs(self) -> Dict:
+        """ProjectionExpression for included fields, plus the sort key if sorting needs it"""
+        included = _projection_fields(self.projection)[0]
+        if included is None:
+            return {}
+        if self._sort_key:
+            included = included + [self._sort_key]
+        return _projection_kwargs(included)
+    
+    def _matches_nothing(self, plan: QueryPlan) -> bool:
+        """A filter that can match nothing (e.g. an empty $in), so nothing is read"""
+        return plan.matches_nothing
+    
+    async def _raw_pages(self, table, plan: QueryPlan, max_items: Optional[int] = None,
+                         page_size: Optional[int] = None, segment: Optional[tuple] = None,
+                         scan_forward: bool = True):
+        """
+        Yield raw item pages of a query/scan, following LastEvaluatedKey until
+        max_items matching items have been returned or the table is exhausted.
+        segment=(n, total) restricts a scan to one parallel scan segment;
+        scan_forward=False reads a query in descending range key order.
+        """
+        read, kwargs = await self._reader(table, plan)
+        if segment is not None:
+            kwargs['Segment'], kwargs['TotalSegments'] = segment
+        if not scan_forward:
+            kwargs['ScanIndexForward'] = False
+        returned = 0
+        while max_items is None or returned < max_items:
+            request_limit = page_size
+            if max_items is not None and plan.filter_expression is None:
+                # Unfiltered reads return exactly Limit items, so ask for no more than needed
+                remaining = max_items - returned
+                request_limit = min(request_limit or remaining, remaining)
+            if request_limit:
+                kwargs['Limit'] = request_limit
+            response = await self.collection._call(read, **kwargs)
+            items = response.get('Items', [])
+            returned += len(items)
+            yield items
+            if 'LastEvaluatedKey' not in response:
+                break
+            kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+    
+    async def _count_pages(self, table, plan: QueryPlan, segment: Optional[tuple] = None) -> int:
+        """Sum Select='COUNT' responses of a query/scan (or one scan segment)"""
+        kwargs = plan.request_kwargs()
+        kwargs['Select'] = 'COUNT'
+        if segment is not None:
+            kwargs['Segment'], kwargs['TotalSegments'] = segment
+        read = table.query if plan.is_query else table.scan
+        total = 0
+        while True:
+            response = await self.collection._call(read, **kwargs)
+            total += response.get('Count', 0)
+            if 'LastEvaluatedKey' not in response:
+                return total
+            kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+    
+    def _flight_args(self) -> tuple:
+        """Everything that shapes this cursor's result, for SingleFlight keys"""
+        return (self.filter_dict, self.projection, self._sort_key, self._sort_direction,
+                self._segments, self._order_by_key, self._mode)
+    
+    async def count(self) -> int:
+        """
+        Number of matching items, counted by DynamoDB without returning them
+        (concurrent identical counts share one request)
+        """
+        return await self.collection._single_flight('count', self._count, *self._flight_args())
+    
+    async def _count(self) -> int:
+        table = await self.collection._get_table()
+        plan = await self.collection.plan(self.filter_dict, self._sort_key)
+        if self._matches_nothing(plan):
+            return 0
+        segments = await self._scan_segments(plan)
+        if segments > 1:
+            counts = await asyncio.gather(*(
+                self._count_pages(table, plan, (segment, segments)) for segment in range(segments)
+            ))
+            return sum(counts)
+        return await self._count_pages(table, plan)
+    
+    async def _scan_segments(self, plan: QueryPlan) -> int:
+        """Degree of parallelism for this read (queries are always sequential)"""
+        if plan.is_query:
+            return 1
+        if self._segments is not None:
+            return max(1, self._segments)
+        schema = await self.collection.get_schema()
+        return self.collection.database.auto_scan_segments(schema)
+    
+    async def _parallel_scan(self, table, plan: QueryPlan, segments: int,
+                             max_items: Optional[int] = None) -> List[Dict]:
+        """Scan all segments concurrently and merge their raw items"""
+        collected = [[] for _ in range(segments)]
+        total = 0
+        
+        async def scan_segment(segment: int):
+            nonlocal total
+            async for page in self._raw_pages(table, plan, max_items=max_items,
+                                              segment=(segment, segments)):
+                collected[segment].extend(page)
+                total += len(page)
+                if max_items is not None and total >= max_items:
+                    break
+        
+        await asyncio.gather(*(scan_segment(segment) for segment in range(segments)))
+        items = [item for segment_items in collected for item in segment_items]
+        
+        if self._order_by_key:
+            key_attributes = (await self.collection.get_schema()).key_attributes()
+            items.sort(key=lambda item: tuple(self._raw_field(item, k) for k in key_attributes))
+        return items
+    
+    async def pages(self, page_size: Optional[int] = None):
+        """
+        Yield converted items one DynamoDB page at a time.
+        page_size caps items evaluated per request (default: DynamoDB's 1MB page).
+        A sorted cursor has to see every item first, so it yields one sorted page.
+        """
+        if self._sort_key:
+            yield await self.to_list(None)
+            return
+        
+        async for page in self._iter_raw_pages(page_size):
+            yield self._convert(self._project(page))
+    
+    async def _iter_raw_pages(self, page_size: Optional[int] = None):
+        """Yield non-empty pages of unconverted DynamoDB items"""
+        table = await self.collection._get_table()
+        plan = await self.collection.plan(self.filter_dict, self._sort_key)
+        if self._matches_nothing(plan):
+            return
+        async for page in self._raw_pages(table, plan, page_size=page_size):
+            if page:
+                yield page
+    
+    async def __aiter__(self):
+        async for page in self.pages():
+            for item in page:
+                yield item
+    
+    async def to_list(self, limit: Optional[int] = 1000) -> List[Dict]:
+        """
+        Convert cursor to list (limit=None reads every matching item)
+        Concurrent identical reads (same filter, projection, sort, limit) share one request.
+        """
+        return await self.collection._single_flight(
+            'to_list', lambda: self._to_list(limit), limit, *self._flight_args())
+    
+    async def _to_list(self, limit: Optional[int]) -> List[Dict]:
+        table = await self.collection._get_table()
+        plan = await self.collection.plan(self.filter_dict, self._sort_key)
+        
+        items = []
+        
+        if self._matches_nothing(plan):
+            pass
+        elif plan.returns_sorted_by(self._sort_key):
+            # DynamoDB returns the query in sort order: read only the first `limit`
+            async for page in self._raw_pages(table, plan, max_items=limit,
+                                              scan_forward=self._sort_direction != -1):
+                items.extend(page)
+        elif self._sort_key:
+            items = await self._top_k(table, plan, limit)
+        else:
+            segments = await self._scan_segments(plan)
+            if segments > 1:
+                items = await self._parallel_scan(table, plan, segments, limit)
+            else:
+                # Query or (filtered) scan, paginated until limit matching items
+                async for page in self._raw_pages(table, plan, max_items=limit):
+                    items.extend(page)
+        
+        return self._convert(self._project(items[:limit]))
 
 
-class DynamoDBCollection:
-    """Simulates MongoDB collection interface for DynamoDB"""
+class DynamoDBTransaction:
+    """
+    Puts, updates and deletes across tables, written together on exit:
+        async with db.transaction() as tx:
+            tx.put('certificate_candidates', certificate)
+            tx.update('work_orders', {"id": work_order_id}, {"$set": {"status": "completed"}})
     
-    def __init__(self, session, table_name: str, region: str = 'us-east-1'):
-        self.session = session
-        self.table_name = table_name
-        self.region = region
+    atomic=True sends one TransactWriteItems (all or nothing, at most 100
+    actions and one operation per item; a single operation is sent as a
+    plain conditional write). atomic=False writes puts/deletes as unordered
+    BatchWriteItem requests per table and updates concurrently; per-operation
+    failures are then reported in tx.result instead of raised. Nothing is
+    written if the block raises.
     
-    async def _get_table(self):
-        """Get DynamoDB table resource"""
-        async with self.session.resource('dynamodb', region_name=self.region) as dynamodb:
-            return await dynamodb.Table(self.table_name)
+    Operations on collections with aggregates also carry their counter deltas
+    (see DynamoDBAggregates); tx.old_images then holds the key and aggregated
+    fields of the item each of them replaced, by operation index. In an atomic
+    transaction every aggregate counted takes one of the 100 actions, so fewer
+    operations fit (see capacity()). While the
+    change feed is active, every operation's item is read in full first and
+    the committed operations are published (see DynamoDBChangeFeed).
+    """
+    
+    def __init__(self, database: 'DynamoDBDatabase', atomic: bool = True):
+        self.database = database
+        self.atomic = atomic
+        self.result = None
+        self.old_images = {}
+        self._operations = []  # (collection, 'put'/'update'/'delete', item or key, update kwargs)
+        self._aggregate_ids = set()  # aggregates the operations may update, one action each
+    
+    def __len__(self) -> int:
+        return len(self._operations)
+    
+    def _aggregate_ids_of(self, collection: 'DynamoDBCollection') -> set:
+        return {self.database.aggregates.aggregate_id(collection.table_name, fields)
+                for fields in collection.aggregates}
+    
+    def capacity(self, collection_names: List[str] = ()) -> int:
+        """
+        Operations on these collections that still fit in an atomic transaction:
+        TRANSACT_WRITE_SIZE less the operations queued and the counter updates
+        of every aggregate they (and the new ones) may change
+        """
+        aggregate_ids = set(self._aggregate_ids)
+        for collection_name in collection_names:
+            aggregate_ids |= self._aggregate_ids_of(getattr(self.database, collection_name))
+        return TRANSACT_WRITE_SIZE - len(self._operations) - len(aggregate_ids)
+    
+    def _add(self, collection: 'DynamoDBCollection', kind: str, item_or_key: Dict,
+             update_kwargs: Optional[Dict] = None):
+        if self.result is not None:
+            raise RuntimeError("Transaction has already been committed")
+        aggregate_ids = self._aggregate_ids | self._aggregate_ids_of(collection)
+        if self.atomic and len(self._operations) + 1 + len(aggregate_ids) > TRANSACT_WRITE_SIZE:
+            raise ValueError(f"A transaction holds at most {TRANSACT_WRITE_SIZE} actions "
+                             f"({len(aggregate_ids)} of them aggregate counter updates)")
+        self._aggregate_ids = aggregate_ids
+        self._operations.append((collection, kind, item_or_key, update_kwargs))
+    
+    def put(self, collection_name: str, document: Dict):
+        """Insert or replace a document"""
+        collection = getattr(self.database, collection_name)
+        self._add(collection, 'put', collection._with_search_attributes(to_dynamodb_value(document)))
+    
+    def update(self, collection_name: str, filter_dict: Dict, update_dict: Dict):
+        """Update a document (same arguments as DynamoDBCollection.update_one)"""
+        collection = getattr(self.database, collection_name)
+        self._add(collection, 'update', DynamoDBCollection._key_from_filter(filter_dict),
+                  DynamoDBCollection._update_kwargs(update_dict, collection.search_fields))
+    
+    def delete(self, collection_name: str, filter_dict: Dict):
+        """Delete a document by key"""
+        self._add(getattr(self.database, collection_name), 'delete', DynamoDBCollection._key_from_filter(filter_dict))
+    
+    async def __aenter__(self):
+        return self
+    
+    async def __aexit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            await self.commit()
+        return False
+    
+    async def commit(self) -> BulkWriteResult:
+        """Write every queued operation (called on exit of the async with block)"""
+        if self.result is not None:
+            return self.result
+        try:
+            if not self._operations:
+                result = BulkWriteResult()
+            elif self.atomic:
+                result = await self._transact()
+            else:
+                result = await self._batch()
+        finally:
+            for collection, _, item_or_key, _ in self._operations:
+                await collection._invalidate(item_or_key)
+        self.result = result
+        return result
     
     @staticmethod
-    def _convert_to_dynamodb(item: Dict) -> Dict:
-        """Convert Python dict to DynamoDB format (handle floats)"""
-        return json.loads(json.dumps(item), parse_float=Decimal)
+    def _action(collection: 'DynamoDBCollection', kind: str, item_or_key: Dict, update_kwargs: Optional[Dict]) -> Dict:
+        """TransactWriteItems action of one operation"""
+        if kind == 'put':
+            return {'Put': {'TableName': collection.table_name, 'Item': encode_item(item_or_key)}}
+        if kind == 'update':
+            action = {
+                'TableName': collection.table_name,
+                'Key': encode_item(item_or_key),
+                'UpdateExpression': update_kwargs['UpdateExpression'],
+                'ExpressionAttributeNames': update_kwargs['ExpressionAttributeNames'],
+            }
+            if 'ExpressionAttributeValues' in update_kwargs:
+                action['ExpressionAttributeValues'] = encode_item(update_kwargs['ExpressionAttributeValues'])
+            return {'Update': action}
+        return {'Delete': {'TableName': collection.table_name, 'Key': encode_item(item_or_key)}}
     
     @staticmethod
-    def _convert_from_dynamodb(item: Dict) -> Dict:
-        """Convert DynamoDB format to Python dict"""
-        return json.loads(json.dumps(item, default=str))
+    def _add_unchanged_condition(action: Dict, schema: TableSchema, fields: List[str], old: Optional[Dict]):
+        """
+        Condition an action on its item still being `old` (absent if None) as far
+        as the aggregates can tell: same existence and aggregated field values
+        """
+        names = {'#_c0': schema.hash_key}
+        values = {}
+        if old is None:
+            clauses = ['attribute_not_exists(#_c0)']
+        else:
+            clauses = ['attribute_exists(#_c0)']
+            for i, field in enumerate(fields, 1):
+                names[f"#_c{i}"] = field
+                if field not in old:
+                    clauses.append(f"attribute_not_exists(#_c{i})")
+                elif old[field] is None:
+                    clauses.append(f"attribute_type(#_c{i}, :_c{i})")
+                    values[f":_c{i}"] = 'NULL'
+                else:
+                    clauses.append(f"#_c{i} = :_c{i}")
+                    values[f":_c{i}"] = old[field]
+        body = next(iter(action.values()))
+        body['ConditionExpression'] = ' AND '.join(clauses)
+        body['ExpressionAttributeNames'] = {**body.get('ExpressionAttributeNames', {}), **names}
+        if values:
+            body['ExpressionAttributeValues'] = {**body.get('ExpressionAttributeValues', {}), **encode_item(values)}
     
-    async def find_one(self, filter_dict: Dict, projection: Optional[Dict] = None) -> Optional[Dict]:
+    async def _read_current(self) -> Dict[int, Optional[Dict]]:
         """
-        Find a single document
-        Args:
-            filter_dict: Query filter (e.g., {"id": "123"} or {"mobile": "1234567890"})
-            projection: Fields to include/exclude (e.g., {"_id": 0})
+        Current items of the operations on collections with aggregates (of
+        every operation, in full, while the change feed is active), by operation index
         """
-        async with self.session.resource('dynamodb', region_name=self.region) as dynamodb:
-            table = await dynamodb.Table(self.table_name)
-            
-            # Determine which key to use
-            key_name = list(filter_dict.keys())[0]
-            key_value = filter_dict[key_name]
-            
+        publish = self.database.changes.active
+        keys = {}  # collection -> [(operation index, key)]
+        for index, (collection, kind, item_or_key, _) in enumerate(self._operations):
+            if collection.aggregates or publish:
+                keys.setdefault(collection, []).append((index, item_or_key))
+        old_images = {}
+        for collection, indexed_keys in keys.items():
+            schema = await collection.get_schema()
+            current = await collection._current_items(schema, [key for _, key in indexed_keys], full=publish)
+            for index, key in indexed_keys:
+                old_images[index] = current.get(schema.key_of(key))
+        return old_images
+    
+    async def _actions(self) -> tuple:
+        """(actions, tables): every operation, conditioned and counted where it has aggregates"""
+        self.old_images = await self._read_current()
+        actions = []
+        deltas = {}
+        for index, (collection, kind, item_or_key, update_kwargs) in enumerate(self._operations):
+            action = self._action(collection, kind, item_or_key, update_kwargs)
+            if collection.aggregates:
+                schema = await collection.get_schema()
+                old = self.old_images[index]
+                new = collection._new_item(kind, old, item_or_key, update_kwargs)
+                self.database.aggregates.deltas(collection, old, new, deltas)
+                self._add_unchanged_condition(action, schema, collection.aggregate_fields, old)
+            actions.append(action)
+        actions.extend(self.database.aggregates.transact_actions(deltas))
+        tables = {collection.table_name for collection, _, _, _ in self._operations}
+        if len(actions) > len(self._operations):
+            tables.add(self.database.aggregates.table_name)
+        return actions, sorted(tables)
+    
+    async def _send(self, actions: List[Dict], tables: List[str]):
+        client = await self.database.get_client()
+        if len(actions) == 1:
+            # One item: a conditional write is just as atomic, at half the write cost
+            (kind, params), = actions[0].items()
+            method = {'Put': client.put_item, 'Update': client.update_item, 'Delete': client.delete_item}[kind]
+            await self.database.call(tables, method, **params)
+        else:
+            await self.database.call(tables, client.transact_write_items, TransactItems=actions)
+    
+    async def _transact(self) -> BulkWriteResult:
+        """All operations (and their aggregate counters) as one TransactWriteItems request"""
+        counted = any(collection.aggregates for collection, _, _, _ in self._operations)
+        for attempt in range(AGGREGATE_MAX_ATTEMPTS):
+            actions, tables = await self._actions()
             try:
-                # Try as primary key first
-                response = await table.get_item(Key={key_name: key_value})
-                if 'Item' in response:
-                    item = self._convert_from_dynamodb(response['Item'])
-                    # Remove _id if requested
-                    if projection and projection.get('_id') == 0:
-                        item.pop('_id', None)
-                    return item
-            except:
-                # If not primary key, try querying index
-                index_name = f"{key_name}-index"
-                try:
-                    response = await table.query(
-                        IndexName=index_name,
-                        KeyConditionExpression=Key(key_name).eq(key_value),
-                        Limit=1
-                    )
-                    if response['Items']:
-                        item = self._convert_from_dynamodb(response['Items'][0])
-                        if projection and projection.get('_id') == 0:
-                            item.pop('_id', None)
-                        return item
-                except:
-                    # Fallback to scan (slow, but works)
-                    response = await table.scan(
-                        FilterExpression=Attr(key_name).eq(key_value),
-                        Limit=1
-                    )
-                    if response['Items']:
-                        item = self._convert_from_dynamodb(response['Items'][0])
-                        if projection and projection.get('_id') == 0:
-                            item.pop('_id', None)
-                        return item
-            
-            return None
+                await self._send(actions, tables)
+                break
+            except ClientError as e:
+                code = e.response.get('Error', {}).get('Code')
+                reasons = e.response.get('CancellationReasons') or []
+                changed = code == 'ConditionalCheckFailedException' or any(
+                    reason.get('Code') == 'ConditionalCheckFailed' for reason in reasons)
+                if counted and changed and attempt + 1 < AGGREGATE_MAX_ATTEMPTS:
+                    # A counted item changed after it was read: read it again and recount
+                    await _backoff(attempt)
+                    continue
+                if reasons:
+                    logger.warning(f"TransactWriteItems cancelled: {[reason.get('Code') for reason in reasons]}")
+                raise
+        if self.database.changes.active:
+            await self._publish_changes()
+        result = BulkWriteResult()
+        result.succeeded = list(range(len(self._operations)))
+        return result
     
-    def find(self, filter_dict: Dict = None, projection: Optional[Dict] = None):
+    async def _publish_changes(self):
+        """Publish the committed operations, per collection, from the items read before them"""
+        writes = {}  # collection -> [(item or key, old item, new item)]
+        for index, (collection, kind, item_or_key, update_kwargs) in enumerate(self._operations):
+            old = self.old_images.get(index)
+            writes.setdefault(collection, []).append(
+                (item_or_key, old, collection._new_item(kind, old, item_or_key, update_kwargs)))
+        for collection, collection_writes in writes.items():
+            await collection._publish_changes(collection_writes)
+    
+    async def _batch(self) -> BulkWriteResult:
         """
-        Find multiple documents
-        Returns a cursor-like object with to_list() method
+        Puts/deletes as BatchWriteItem per table, updates as concurrent UpdateItem
+        calls, operations on collections with aggregates as counted single writes
         """
-        return DynamoDBCursor(self.session, self.table_name, filter_dict, projection, self.region)
+        result = BulkWriteResult()
+        groups = {}  # table name -> (collection, operation indexes, requests)
+        updates = []
+        counted = []
+        for index, (collection, kind, item_or_key, update_kwargs) in enumerate(self._operations):
+            if collection.aggregates:
+                counted.append((index, collection, kind, item_or_key, update_kwargs))
+                continue
+            if kind == 'update':
+                updates.append((index, collection, item_or_key, update_kwargs))
+                continue
+            request = {'PutRequest': {'Item': item_or_key}} if kind == 'put' else {'DeleteRequest': {'Key': item_or_key}}
+            _, indexes, requests = groups.setdefault(collection.table_name, (collection, [], []))
+            indexes.append(index)
+            requests.append(request)
+        
+        async def write_group(collection, indexes, requests):
+            group_result = await collection._batch_write(requests)
+            result.succeeded.extend(indexes[i] for i in group_result.succeeded)
+            result.failed.update({indexes[i]: error for i, error in group_result.failed.items()})
+        
+        async def write_update(index, collection, key, update_kwargs):
+            try:
+                await collection._write_one('update', key, update_kwargs)
+                result.succeeded.append(index)
+            except ClientError as e:
+                result.failed[index] = str(e)
+        
+        async def write_counted(index, collection, kind, item_or_key, update_kwargs):
+            try:
+                self.old_images[index] = await collection._write_counted(kind, item_or_key, update_kwargs)
+                result.succeeded.append(index)
+            except ClientError as e:
+                result.failed[index] = str(e)
+        
+        await asyncio.gather(
+            *(write_group(*group) for group in groups.values()),
+            *(write_update(*update) for update in updates),
+            *(write_counted(*operation) for operation in counted)
+        )
+        result.succeeded.sort()
+        return result
+
+
+class DynamoDBCounters:
+    """
+    Atomic sequence counters, one item per counter in a counters table
+    (DYNAMODB_COUNTERS_TABLE, default arbrit-counters, hash key 'id')
     
-    async def insert_one(self, document: Dict):
-        """Insert a single document"""
-        async with self.session.resource('dynamodb', region_name=self.region) as dynamodb:
-            table = await dynamodb.Table(self.table_name)
-            item = self._convert_to_dynamodb(document)
-            await table.put_item(Item=item)
+    reserve() hands out a contiguous block of numbers with a single
+    UpdateItem ADD ... ReturnValues=UPDATED_NEW, so concurrent callers (in any
+    process) never receive the same number.
+    """
     
-    async def update_one(self, filter_dict: Dict, update_dict: Dict):
+    def __init__(self, database: 'DynamoDBDatabase', table_name: Optional[str] = None):
+        self.database = database
+        self.table_name = table_name or os.environ.get('DYNAMODB_COUNTERS_TABLE', 'arbrit-counters')
+    
+    async def reserve(self, name: str, count: int = 1) -> range:
         """
-        Update a single document
-        Args:
-            filter_dict: Query filter (e.g., {"id": "123"})
-            update_dict: Update operations (e.g., {"$set": {"name": "John"}})
+        Reserve `count` consecutive numbers of counter `name` (starting at 1)
+        Returns:
+            range of the reserved numbers, e.g. range(41, 44) for three numbers
         """
-        async with self.session.resource('dynamodb', region_name=self.region) as dynamodb:
-            table = await dynamodb.Table(self.table_name)
-            
-            # Extract key
-            key_name = list(filter_dict.keys())[0]
-            key_value = filter_dict[key_name]
-            
-            # Extract update values
-            if "$set" in update_dict:
-                update_values = update_dict["$set"]
-            else:
-                update_values = update_dict
-            
-            # Build update expression
-            update_expr = "SET " + ", ".join([f"#{k} = :{k}" for k in update_values.keys()])
-            expr_attr_names = {f"#{k}": k for k in update_values.keys()}
-            expr_attr_values = {f":{k}": self._convert_to_dynamodb(v) if isinstance(v, dict) else v 
-                               for k, v in update_values.items()}
-            
-            await table.update_item(
-                Key={key_name: key_value},
-                UpdateExpression=update_expr,
-                ExpressionAttributeNames=expr_attr_names,
-                ExpressionAttributeValues=expr_attr_values
+        if count < 1:
+            raise ValueError(f"Cannot reserve {count} numbers from counter {name}")
+        table = await self.database.get_table(self.table_name)
+        response = await self.database.call(
+            self.table_name, table.update_item,
+            Key={'id': name},
+            UpdateExpression='ADD #value :count',
+            ExpressionAttributeNames={'#value': 'value'},
+            ExpressionAttributeValues={':count': count},
+            ReturnValues='UPDATED_NEW'
+        )
+        last = int(response['Attributes']['value'])
+        return range(last - count + 1, last + 1)
+    
+    async def next(self, name: str) -> int:
+        """Reserve a single number"""
+        return (await self.reserve(name, 1))[0]
+    
+    async def current(self, name: str) -> int:
+        """Last number handed out (0 if the counter was never used)"""
+        table = await self.database.get_table(self.table_name)
+        response = await self.database.call(self.table_name, table.get_item, Key={'id': name}, ConsistentRead=True)
+        return int(response.get('Item', {}).get('value', 0))
+    
+    async def seed(self, name: str, value: int) -> bool:
+        """
+        Raise a counter to at least `value` (e.g. numbers issued before the
+        counter existed); never lowers it. Returns True if it was raised.
+        """
+        table = await self.database.get_table(self.table_name)
+        try:
+            await self.database.call(
+                self.table_name, table.update_item,
+                Key={'id': name},
+                UpdateExpression='SET #value = :value',
+                ConditionExpression='attribute_not_exists(#value) OR #value < :value',
+                ExpressionAttributeNames={'#value': 'value'},
+                ExpressionAttributeValues={':value': value}
             )
+        except ClientError as e:
+            if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+                return False
+            raise
+        return True
+
+
+AGGREGATE_ID_PREFIX = 'aggregate#'
+# Attempts of a counted write whose items changed between reading and writing them
+AGGREGATE_MAX_ATTEMPTS = 5
+
+
+def _aggregate_label(item: Optional[Dict], fields: tuple) -> Optional[str]:
+    """
+    Attribute name an item is counted under in an aggregate: the JSON of its
+    field value (a list of values for several fields; missing fields count as
+    null), or None for no item
+    """
+    if item is None:
+        return None
+    values = [from_dynamodb_value(to_dynamodb_value(item.get(field))) for field in fields]
+    return json.dumps(values[0] if len(values) == 1 else values, sort_keys=True, default=str)
+
+
+def _aggregate_group(label: str, fields: tuple) -> Any:
+    """Group value of a label: the field value, or a tuple of values for several fields"""
+    value = json.loads(label)
+    return value if len(fields) == 1 else tuple(value)
+
+
+class DynamoDBAggregates:
+    """
+    Document counts per group value, e.g. delivery_tasks by status or leads by
+    (status, assigned_to), kept in the counters table (see DynamoDBCounters)
     
-    async def delete_one(self, filter_dict: Dict):
-        """Delete a single document"""
-        async with self.session.resource('dynamodb', region_name=self.region) as dynamodb:
-            table = await dynamodb.Table(self.table_name)
-            
-            key_name = list(filter_dict.keys())[0]
-            key_value = filter_dict[key_name]
-            
-            response = await table.delete_item(Key={key_name: key_value})
-            return response
+    Aggregates are declared per collection (DynamoDBDatabase aggregates /
+    DYNAMODB_AGGREGATES, see _parse_aggregates). Each one is a single item,
+    id 'aggregate#<table>#<field>[+<field>...]', with one numeric attribute per
+    group (named by _aggregate_label) and 'built_at'; read(), read_many() and
+    count() answer status breakdowns with one GetItem/BatchGetItem instead of
+    a scan.
+    
+    insert_one/update_one/delete_one (and transactions) on a collection with
+    aggregates read the written item's current group values, then write it
+    together with the counter deltas in one transaction, conditioned on those
+    values being unchanged (retried if they changed). insert_many/delete_many
+    apply their deltas after the batch. Writes made outside this layer are
+    not counted: rebuild() recomputes the counters from a scan.
+    """
+    
+    def __init__(self, database: 'DynamoDBDatabase'):
+        self.database = database
+    
+    @property
+    def table_name(self) -> str:
+        return self.database.counters.table_name
+    
+    @staticmethod
+    def aggregate_id(table_name: str, fields: tuple) -> str:
+        return f"{AGGREGATE_ID_PREFIX}{table_name}#{'+'.join(fields)}"
+    
+    def deltas(self, collection: 'DynamoDBCollection', old: Optional[Dict], new: Optional[Dict],
+               into: Optional[Dict] = None) -> Dict[str, Dict[str, int]]:
+        """Counter changes of replacing item old by new ({aggregate id: {label: delta}}), added to into"""
+        deltas = {} if into is None else into
+        for fields in collection.aggregates:
+            old_label, new_label = _aggregate_label(old, fields), _aggregate_label(new, fields)
+            if old_label == new_label:
+                continue
+            changes = deltas.setdefault(self.aggregate_id(collection.table_name, fields), {})
+            for label, delta in ((old_label, -1), (new_label, 1)):
+                if label is not None:
+                    changes[label] = changes.get(label, 0) + delta
+        return deltas
+    
+    @staticmethod
+    def _add_kwargs(changes: Dict[str, int]) -> Dict:
+        """UpdateExpression ADDing the non-zero deltas of one aggregate, or {} if there are none"""
+        changes = [(label, delta) for label, delta in changes.items() if delta]
+        if not changes:
+            return {}
+        return {
+            'UpdateExpression': 'ADD ' + ', '.join(f"#g{i} :g{i}" for i in range(len(changes))),
+            'ExpressionAttributeNames': {f"#g{i}": label for i, (label, _) in enumerate(changes)},
+            'ExpressionAttributeValues': {f":g{i}": delta for i, (_, delta) in enumerate(changes)},
+        }
+    
+    def transact_actions(self, deltas: Dict[str, Dict[str, int]]) -> List[Dict]:
+        """TransactWriteItems Update actions applying deltas"""
+        actions = []
+        for aggregate_id, changes in deltas.items():
+            kwargs = self._add_kwargs(changes)
+            if kwargs:
+                kwargs['ExpressionAttributeValues'] = encode_item(kwargs['ExpressionAttributeValues'])
+                actions.append({'Update': {'TableName': self.table_name, 'Key': encode_item({'id': aggregate_id}),
+                                           **kwargs}})
+        return actions
+    
+    async def apply(self, deltas: Dict[str, Dict[str, int]]):
+        """Apply deltas with one UpdateItem ADD per aggregate (bulk writes)"""
+        table = await self.database.get_table(self.table_name)
+        for aggregate_id, changes in deltas.items():
+            kwargs = self._add_kwargs(changes)
+            if kwargs:
+                await self.database.call(self.table_name, table.update_item, Key={'id': aggregate_id}, **kwargs)
+    
+    def _aggregate(self, collection_name: str, group: Any) -> tuple:
+        """(collection, fields) of a declared aggregate"""
+        collection = getattr(self.database, collection_name)
+        fields = _aggregate_fields(group)
+        if fields not in collection.aggregates:
+            raise ValueError(f"No aggregate of {collection_name} by {'+'.join(fields)} is declared")
+        return collection, fields
+    
+    @staticmethod
+    def _counts(item: Optional[Dict], fields: tuple) -> Optional[Dict[Any, int]]:
+        if item is None or 'built_at' not in item:
+            return None
+        return {
+            _aggregate_group(label, fields): int(count)
+            for label, count in item.items()
+            if label not in ('id', 'built_at') and count
+        }
+    
+    async def read(self, collection_name: str, group: Any) -> Optional[Dict[Any, int]]:
+        """
+        {group value: count} of one aggregate with a single GetItem (groups of
+        several fields are keyed by tuples), or None if it was never built
+        """
+        collection, fields = self._aggregate(collection_name, group)
+        table = await self.database.get_table(self.table_name)
+        response = await self.database.call(
+            self.table_name, table.get_item, Key={'id': self.aggregate_id(collection.table_name, fields)})
+        return self._counts(response.get('Item'), fields)
+    
+    async def read_many(self, aggregates: List[tuple]) -> Dict[tuple, Optional[Dict[Any, int]]]:
+        """read() of several (collection, group) pairs with BatchGetItem, keyed like the input"""
+        ids = {}
+        for collection_name, group in aggregates:
+            collection, fields = self._aggregate(collection_name, group)
+            ids[self.aggregate_id(collection.table_name, fields)] = ((collection_name, group), fields)
+        resource = await self.database.connect()
+        items = {}
+        id_list = list(ids)
+        for i in range(0, len(id_list), BATCH_GET_SIZE):
+            pending = {self.table_name: {'Keys': [{'id': aggregate_id} for aggregate_id in id_list[i:i + BATCH_GET_SIZE]]}}
+            for attempt in range(BATCH_MAX_ATTEMPTS):
+                response = await self.database.call(self.table_name, resource.batch_get_item, RequestItems=pending)
+                for item in response.get('Responses', {}).get(self.table_name, []):
+                    items[item['id']] = item
+                pending = response.get('UnprocessedKeys') or {}
+                if not pending:
+                    break
+                await _backoff(attempt)
+        return {request: self._counts(items.get(aggregate_id), fields) for aggregate_id, (request, fields) in ids.items()}
+    
+    async def count(self, collection_name: str, filter_dict: Dict = None) -> int:
+        """
+        count_documents() answered from an aggregate when the filter is empty or
+        exactly an equality on an aggregate's fields (and it was built);
+        otherwise counted by DynamoDB
+        """
+        filter_dict = filter_dict or {}
+        collection = getattr(self.database, collection_name)
+        values = {field: _equality_value(value) for field, value in filter_dict.items()}
+        for fields in collection.aggregates:
+            if filter_dict and set(fields) != set(values):
+                continue
+            if any(values[field] is _NO_VALUE for field in values):
+                break
+            counts = await self.read(collection_name, fields)
+            if counts is None:
+                continue
+            if not filter_dict:
+                return sum(counts.values())
+            label = _aggregate_label(values, fields)
+            return counts.get(_aggregate_group(label, fields), 0)
+        return await collection.count(filter_dict)
+    
+    async def rebuild(self, collection_name: Optional[str] = None) -> Dict[str, Dict]:
+        """
+        Recompute the aggregates of one collection (default: every collection
+        with aggregates) from a scan and overwrite their items. Writes made while
+        the scan runs may be missed; run it when writes are quiet (or again).
+        Returns {collection: {fields: number of groups}}.
+        """
+        names = [collection_name] if collection_name else list(self.database.aggregate_groups)
+        table = await self.database.get_table(self.table_name)
+        report = {}
+        for name in names:
+            collection = getattr(self.database, name)
+            if not collection.aggregates:
+                continue
+            counts = {fields: {} for fields in collection.aggregates}
+            cursor = collection.find({}, {field: 1 for field in collection.aggregate_fields})
+            async for page in cursor._iter_raw_pages():
+                for item in page:
+                    for fields, groups in counts.items():
+                        label = _aggregate_label(item, fields)
+                        groups[label] = groups.get(label, 0) + 1
+            built_at = datetime.now(timezone.utc).isoformat()
+            for fields, groups in counts.items():
+                item = {'id': self.aggregate_id(collection.table_name, fields), 'built_at': built_at, **groups}
+                await self.database.call(self.table_name, table.put_item, Item=item)
+            report[name] = {'+'.join(fields): len(groups) for fields, groups in counts.items()}
+        return report
+
+
+# Shard of the events published in process (and journaled) by DynamoDBChangeFeed
+CHANGE_SHARD = 'local'
+# Change events carry both images, like a stream with this view type
+CHANGE_STREAM_VIEW_TYPE = 'NEW_AND_OLD_IMAGES'
+
+
+def _stream_arn(table_name: str, label: str = CHANGE_SHARD) -> str:
+    """DynamoDB Streams ARN of a table's (local) stream"""
+    return f"arn:aws:dynamodb:local:000000000000:table/{table_name}/stream/{label}"
+
+
+def _event_image(item: Optional[Dict]) -> Optional[Dict]:
+    """Plain Python copy of a stored item, without search shadow attributes"""
+    if item is None:
+        return None
+    return {k: from_dynamodb_value(v) for k, v in item.items() if not k.startswith(SEARCH_ATTRIBUTE_PREFIX)}
+
+
+def _json_binary(value: Any) -> str:
+    """json.dumps default for the binary values of AttributeValues (base64, as the Streams JSON API)"""
+    if isinstance(value, Binary):
+        value = value.value
+    if isinstance(value, (bytes, bytearray)):
+        return base64.b64encode(value).decode('ascii')
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def _binary_from_json(attribute_value: Dict) -> Dict:
+    """Undo _json_binary inside one AttributeValue"""
+    (value_type, value), = attribute_value.items()
+    if value_type == 'B':
+        return {'B': base64.b64decode(value)}
+    if value_type == 'BS':
+        return {'BS': [base64.b64decode(v) for v in value]}
+    if value_type == 'M':
+        return {'M': {k: _binary_from_json(v) for k, v in value.items()}}
+    if value_type == 'L':
+        return {'L': [_binary_from_json(v) for v in value]}
+    return attribute_value
+
+
+class ChangeEvent:
+    """
+    One write to a table, shaped like a DynamoDB Streams record with
+    NEW_AND_OLD_IMAGES: operation INSERT/MODIFY/REMOVE, the item's key and the
+    item before and after the write (plain Python values, None when absent,
+    without search shadow attributes)
+    """
+    
+    __slots__ = ('table', 'operation', 'keys', 'old_image', 'new_image', 'sequence_number', 'created_at', 'shard')
     
-    async def delete_many(self, filter_dict: Dict):
-        """Delete multiple documents"""
-        # First find all matching items
-        cursor = self.find(filter_dict)
-        items = await cursor.to_list(1000)
+    def __init__(self, table: str, operation: str, keys: Dict, old_image: Optional[Dict] = None,
+                 new_image: Optional[Dict] = None, sequence_number: Optional[str] = None,
+                 created_at: Optional[datetime] = None, shard: str = CHANGE_SHARD):
+        self.table = table
+        self.operation = operation
+        self.keys = keys
+        self.old_image = old_image
+        self.new_image = new_image
+        self.sequence_number = sequence_number
+        self.created_at = created_at
+        self.shard = shard
+    
+    @classmethod
+    def of_write(cls, table_name: str, keys: Dict, old: Optional[Dict], new: Optional[Dict]) -> Optional['ChangeEvent']:
+        """Event of replacing stored item old by new (None: absent); None if the write changed nothing"""
+        if old == new:
+            # DynamoDB Streams has no record for a write that changes nothing either
+            return None
+        operation = 'INSERT' if old is None else 'REMOVE' if new is None else 'MODIFY'
+        return cls(table_name, operation, _event_image(keys), _event_image(old), _event_image(new))
+    
+    def to_record(self) -> Dict:
+        """DynamoDB Streams record of the event (low-level AttributeValues)"""
+        stream = {
+            'Keys': encode_item(to_dynamodb_value(self.keys)),
+            'SequenceNumber': self.sequence_number,
+            'StreamViewType': CHANGE_STREAM_VIEW_TYPE,
+        }
+        if self.created_at is not None:
+            stream['ApproximateCreationDateTime'] = self.created_at.timestamp()
+        if self.old_image is not None:
+            stream['OldImage'] = encode_item(to_dynamodb_value(self.old_image))
+        if self.new_image is not None:
+            stream['NewImage'] = encode_item(to_dynamodb_value(self.new_image))
+        return {
+            'eventID': f"{self.shard}-{self.sequence_number}",
+            'eventName': self.operation,
+            'eventVersion': '1.1',
+            'eventSource': 'aws:dynamodb',
+            'awsRegion': 'local',
+            'dynamodb': stream,
+            'eventSourceARN': _stream_arn(self.table),
+        }
+    
+    @classmethod
+    def from_record(cls, record: Dict, shard: str = CHANGE_SHARD) -> 'ChangeEvent':
+        """Event of a DynamoDB Streams record (from GetRecords, a ChangeJournal or to_record())"""
+        stream = record['dynamodb']
         
-        async with self.session.resource('dynamodb', region_name=self.region) as dynamodb:
-            table = await dynamodb.Table(self.table_name)
-            
-            # Get primary key name
-            table_desc = await table.meta.client.describe_table(TableName=self.table_name)
-            key_schema = table_desc['Table']['KeySchema']
-            primary_key = next(k['AttributeName'] for k in key_schema if k['KeyType'] == 'HASH')
-            
-            # Delete each item
-            for item in items:
-                await table.delete_item(Key={primary_key: item[primary_key]})
+        def image(member):
+            if member not in stream:
+                return None
+            return {k: decode_attribute(v) for k, v in stream[member].items() if not k.startswith(SEARCH_ATTRIBUTE_PREFIX)}
+        
+        created_at = stream.get('ApproximateCreationDateTime')
+        if isinstance(created_at, (int, float, Decimal)):
+            created_at = datetime.fromtimestamp(float(created_at), timezone.utc)
+        return cls(record['eventSourceARN'].split('/')[1], record['eventName'], image('Keys'),
+                   image('OldImage'), image('NewImage'), stream.get('SequenceNumber'), created_at, shard)
     
-    async def count_documents(self, filter_dict: Dict = None) -> int:
-        """Count documents matching filter"""
-        cursor = self.find(filter_dict or {})
-        items = await cursor.to_list(10000)
-        return len(items)
+    def __repr__(self):
+        return f"ChangeEvent({self.operation} {self.table} {self.keys} #{self.sequence_number})"
+
+
+class ChangeJournal:
+    """
+    Append-only file of change events, one DynamoDB Streams record (JSON) per
+    line, so consumers can replay writes or catch up after a restart. Several
+    processes (e.g. uvicorn workers) may share one journal: each append holds
+    an exclusive file lock (POSIX) while it numbers its events after the
+    file's last record and writes them, so sequence numbers increase in file
+    order. Each append is flushed; fsync=True also forces it to disk before
+    the write returns. append() blocks, so DynamoDBChangeFeed runs it in a
+    worker thread.
     
-    async def distinct(self, field_name: str, filter_dict: Dict = None) -> List[Any]:
-        """Get distinct values for a field"""
-        cursor = self.find(filter_dict or {})
-        items = await cursor.to_list(10000)
-        values = set()
-        for item in items:
-            if field_name in item and item[field_name] is not None:
-                values.add(item[field_name])
-        return list(values)
+    Once the file reaches max_bytes (0: never) it is rotated like a
+    logging.handlers.RotatingFileHandler: path becomes path.1, path.1
+    becomes path.2 and so on, keeping `backups` files (at least one, which
+    carries the sequence numbers on to the new file). records() reads the
+    rotated files too, oldest first.
+    """
+    
+    def __init__(self, path: str, fsync: bool = False, max_bytes: int = 100 * 1024 * 1024, backups: int = 3):
+        self.path = path
+        self.fsync = fsync
+        self.max_bytes = max_bytes
+        self.backups = max(1, backups)
+        self._file = None
+        self._lock = threading.Lock()
+        # (file size, last sequence number) after this process's last append: unchanged size, no re-read
+        self._known_tail = (None, 0)
+    
+    def _rotated_path(self, generation: int) -> str:
+        return f"{self.path}.{generation}"
+    
+    def _locked_file(self):
+        """The journal file, open and exclusively locked (reopened if another process rotated it)"""
+        while True:
+            if self._file is None:
+                self._file = open(self.path, 'ab+')
+                self._known_tail = (None, 0)
+            if fcntl is None:
+                return self._file
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+            try:
+                current = os.stat(self.path)
+                opened = os.fstat(self._file.fileno())
+                if (current.st_dev, current.st_ino) == (opened.st_dev, opened.st_ino):
+                    return self._file
+            except FileNotFoundError:
+                pass
+            # Rotated away while we were not holding the lock
+            self._file.close()
+            self._file = None
+    
+    def append(self, events: List[ChangeEvent], after: int = 0) -> int:
+        """
+        Number events after the journal's last record (or after `after`, if
+        later) and append them; returns the last sequence number written
+        """
+        with self._lock:
+            f = self._locked_file()
+            rotated = False
+            try:
+                f.seek(0, os.SEEK_END)
+                size = f.tell()
+                known_size, last = self._known_tail
+                if size != known_size:
+                    last = int(self._tail_sequence_number(f) or self._rotated_tail() or 0)
+                last = max(last, after)
+                lines = []
+                for event in events:
+                    last += 1
+                    event.sequence_number = f"{last:021d}"
+                    lines.append(json.dumps(event.to_record(), default=_json_binary) + '\n')
+                data = ''.join(lines).encode('utf-8')
+                if size:
+                    f.seek(size - 1)
+                    if f.read(1) != b'\n':
+                        # A writer died mid-line: keep its fragment off our first record
+                        data = b'\n' + data
+                f.write(data)
+                f.flush()
+                if self.fsync:
+                    os.fsync(f.fileno())
+                self._known_tail = (size + len(data), last)
+                if self.max_bytes and size + len(data) >= self.max_bytes:
+                    self._rotate()
+                    rotated = True
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+                if rotated:
+                    f.close()
+                    self._file = None
+        return last
+    
+    def _rotate(self):
+        """Shift path -> path.1 -> path.2 ...; called holding the lock"""
+        for generation in range(self.backups - 1, 0, -1):
+            if os.path.exists(self._rotated_path(generation)):
+                os.replace(self._rotated_path(generation), self._rotated_path(generation + 1))
+        os.replace(self.path, self._rotated_path(1))
+    
+    def _rotated_tail(self) -> Optional[str]:
+        """Sequence number of the last complete record of the newest rotated file"""
+        try:
+            with open(self._rotated_path(1), 'rb') as f:
+                return self._tail_sequence_number(f)
+        except FileNotFoundError:
+            return None
+    
+    def records(self, after: Optional[str] = None):
+        """Records in write order, rotated files first (only those after sequence number `after`)"""
+        paths = [self._rotated_path(generation) for generation in range(self.backups, 0, -1)] + [self.path]
+        for path in paths:
+            try:
+                f = open(path, encoding='utf-8')
+            except FileNotFoundError:
+                continue
+            with f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        logger.warning(f"Skipping a torn record in change journal {path}")
+                        continue
+                    stream = record['dynamodb']
+                    if after is not None and int(stream['SequenceNumber']) <= int(after):
+                        continue
+                    for member in ('Keys', 'OldImage', 'NewImage'):
+                        if member in stream:
+                            stream[member] = {k: _binary_from_json(v) for k, v in stream[member].items()}
+                    yield record
+    
+    def last_sequence_number(self) -> Optional[str]:
+        """Sequence number of the last complete record (of a rotated file if path has none)"""
+        try:
+            with open(self.path, 'rb') as f:
+                last = self._tail_sequence_number(f)
+        except FileNotFoundError:
+            last = None
+        return last or self._rotated_tail()
+    
+    @staticmethod
+    def _tail_sequence_number(f) -> Optional[str]:
+        """Sequence number of the last complete record of a binary file, read from its end"""
+        f.seek(0, os.SEEK_END)
+        position = f.tell()
+        tail = b''
+        while position > 0:
+            step = min(65536, position)
+            position -= step
+            f.seek(position)
+            tail = f.read(step) + tail
+            lines = [line for line in tail.split(b'\n') if line.strip()]
+            # The first line of the chunk may be cut; a complete line needs a newline before it
+            if len(lines) > 1 or (lines and position == 0):
+                for line in reversed(lines):
+                    try:
+                        return json.loads(line)['dynamodb']['SequenceNumber']
+                    except ValueError:
+                        continue  # torn write at the end of the file
+        return None
+    
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
 
 
-class DynamoDBCursor:
-    """Simulates MongoDB cursor for DynamoDB scans/queries"""
+class _ChangeSubscriber:
+    """A subscribed handler and the queue its worker task drains"""
     
-    def __init__(self, session, table_name: str, filter_dict: Dict = None, 
-                 projection: Dict = None, region: str = 'us-east-1'):
-        self.session = session
-        self.table_name = table_name
-        self.filter_dict = filter_dict or {}
-        self.projection = projection
-        self.region = region
-        self._sort_key = None
-        self._sort_direction = 1
+    def __init__(self, handler, tables: Optional[frozenset], max_pending: int):
+        self.handler = handler
+        self.tables = tables
+        self.max_pending = max_pending
+        self.queue = None
+        self.task = None
+        self.delivered = 0
+        self.failed = 0
     
-    def sort(self, key: str, direction: int = 1):
-        """Sort results"""
-        self._sort_key = key
-        self._sort_direction = direction
-        return self
+    async def put(self, event: ChangeEvent):
+        if self.task is None or self.task.done():
+            if self.queue is None:
+                self.queue = asyncio.Queue(self.max_pending)
+            self.task = asyncio.create_task(self._run())
+        await self.queue.put(event)
     
-    async def to_list(self, limit: int = 1000) -> List[Dict]:
-        """Convert cursor to list"""
-        async with self.session.resource('dynamodb', region_name=self.region) as dynamodb:
-            table = await dynamodb.Table(self.table_name)
-            
-            items = []
-            
-            if not self.filter_dict:
-                # Scan entire table
-                response = await table.scan(Limit=limit)
-                items = response.get('Items', [])
-                
-                # Handle pagination
-                while 'LastEvaluatedKey' in response and len(items) < limit:
-                    response = await table.scan(
-                        Limit=limit - len(items),
-                        ExclusiveStartKey=response['LastEvaluatedKey']
-                    )
-                    items.extend(response.get('Items', []))
+    async def _run(self):
+        while True:
+            event = await self.queue.get()
+            try:
+                await self.handler(event)
+                self.delivered += 1
+            except Exception:
+                self.failed += 1
+                logger.exception(f"Change subscriber {self.handler!r} failed on {event!r}")
+            finally:
+                self.queue.task_done()
+
+
+class DynamoDBChangeFeed:
+    """
+    In-process change events (ChangeEvent) of the writes made through the
+    layer, so caches, counters and indexes derived from a table can be kept
+    up to date incrementally instead of rescanning it:
+        async def on_change(event):
+            ...
+        db.changes.subscribe(on_change, tables=['leads'])
+    
+    Every put/update/delete of a document (single, bulk and transactional) is
+    published once it succeeded. Each subscriber gets the events in publish
+    order from its own queue (max_pending deep; a full queue holds writes
+    back) and a worker task, so a slow or failing subscriber neither delays
+    nor fails the write; flush() waits until every queue is drained. Writes
+    to the counters table and search shadow rebuilds are not published.
+    
+    While anyone listens (a subscriber or the journal), writes ask DynamoDB
+    for the replaced item (ReturnValues ALL_OLD); bulk and transactional
+    writes read the items with a consistent read first, so their old images
+    may miss a concurrent write in between. With a ChangeJournal
+    (DYNAMODB_CHANGE_JOURNAL) every event is also appended to a local file,
+    which numbers it after its last record, from whichever process wrote it,
+    and rotates it by size (DYNAMODB_CHANGE_JOURNAL_MAX_BYTES, default 100 MB,
+    keeping DYNAMODB_CHANGE_JOURNAL_BACKUPS rotated files, default 3).
+    """
+    
+    def __init__(self, journal: Optional[ChangeJournal] = None, max_pending: int = 10000):
+        self.journal = journal
+        self.max_pending = max_pending
+        self.sequence_number = int(journal.last_sequence_number() or 0) if journal is not None else 0
+        self.published = 0
+        self._subscribers = {}  # handler -> _ChangeSubscriber
+        # Publishes are numbered and delivered one at a time, in order
+        self._publish_lock = asyncio.Lock()
+    
+    @property
+    def active(self) -> bool:
+        """Whether writes need to publish events at all"""
+        return bool(self._subscribers) or self.journal is not None
+    
+    def subscribe(self, handler, tables: Optional[List[str]] = None):
+        """
+        Call `await handler(event)` for every event (of the collections named
+        in tables only, if given); returns handler, for unsubscribe()
+        """
+        table_names = frozenset(collection_table_name(name) for name in tables) if tables else None
+        self._subscribers[handler] = _ChangeSubscriber(handler, table_names, self.max_pending)
+        return handler
+    
+    def unsubscribe(self, handler):
+        """Stop delivering to handler (events already queued are still delivered)"""
+        self._subscribers.pop(handler, None)
+    
+    async def publish(self, events: List[ChangeEvent]):
+        """Number, journal and deliver events of writes that succeeded"""
+        if not events:
+            return
+        created_at = datetime.now(timezone.utc)
+        for event in events:
+            event.created_at = created_at
+        async with self._publish_lock:
+            if self.journal is not None:
+                # Numbered by the journal, after every process's records; the file
+                # lock and writes (and fsync) block, so they run off the event loop
+                self.sequence_number = await asyncio.to_thread(self.journal.append, events, self.sequence_number)
             else:
-                # Scan with filter
-                filter_expressions = []
-                for key, value in self.filter_dict.items():
-                    if isinstance(value, dict):
-                        # Handle various MongoDB operators
-                        if "$in" in value:
-                            # Handle $in operator - create OR conditions
-                            in_exprs = [Attr(key).eq(v) for v in value["$in"]]
-                            if in_exprs:
-                                in_expr = in_exprs[0]
-                                for expr in in_exprs[1:]:
-                                    in_expr = in_expr | expr
-                                filter_expressions.append(in_expr)
-                        elif "$gte" in value and "$lte" in value:
-                            # Handle range queries (between)
-                            filter_expressions.append(Attr(key).between(value["$gte"], value["$lte"]))
-                        elif "$gte" in value:
-                            # Greater than or equal
-                            filter_expressions.append(Attr(key).gte(value["$gte"]))
-                        elif "$lte" in value:
-                            # Less than or equal
-                            filter_expressions.append(Attr(key).lte(value["$lte"]))
-                        elif "$gt" in value:
-                            # Greater than
-                            filter_expressions.append(Attr(key).gt(value["$gt"]))
-                        elif "$lt" in value:
-                            # Less than
-                            filter_expressions.append(Attr(key).lt(value["$lt"]))
-                        elif "$ne" in value:
-                            # Not equal
-                            filter_expressions.append(Attr(key).ne(value["$ne"]))
-                        else:
-                            # Default to equality if no recognized operator
-                            filter_expressions.append(Attr(key).eq(value))
-                    else:
-                        filter_expressions.append(Attr(key).eq(value))
-                
-                if filter_expressions:
-                    filter_expr = filter_expressions[0]
-                    for expr in filter_expressions[1:]:
-                        filter_expr = filter_expr & expr  # Use AND for multiple conditions
-                    
-                    response = await table.scan(
-                        FilterExpression=filter_expr,
-                        Limit=limit
-                    )
-                    items = response.get('Items', [])
-            
-            # Convert from DynamoDB format
-            items = [DynamoDBCollection._convert_from_dynamodb(item) for item in items]
-            
-            # Apply projection
-            if self.projection:
-                exclude_fields = [k for k, v in self.projection.items() if v == 0]
-                items = [{k: v for k, v in item.items() if k not in exclude_fields} for item in items]
-            
-            # Apply sorting
-            if self._sort_key:
-                items.sort(key=lambda x: x.get(self._sort_key, ''), reverse=(self._sort_direction == -1))
-            
-            return items[:limit]
+                for event in events:
+                    self.sequence_number += 1
+                    event.sequence_number = f"{self.sequence_number:021d}"
+            self.published += len(events)
+            for subscriber in list(self._subscribers.values()):
+                for event in events:
+                    if subscriber.tables is None or event.table in subscriber.tables:
+                        await subscriber.put(event)
+    
+    async def flush(self):
+        """Wait until every subscriber handled every event published so far"""
+        await asyncio.gather(*(
+            subscriber.queue.join() for subscriber in list(self._subscribers.values()) if subscriber.queue is not None
+        ))
+    
+    async def close(self):
+        """Drain the subscribers, stop their workers and close the journal (reopened on the next write)"""
+        await self.flush()
+        for subscriber in self._subscribers.values():
+            if subscriber.task is not None:
+                subscriber.task.cancel()
+                subscriber.task = None
+        if self.journal is not None:
+            self.journal.close()
+    
+    def stats(self) -> Dict:
+        """Events published, and per subscriber delivered/failed/pending"""
+        return {
+            'published': self.published,
+            'sequence_number': self.sequence_number,
+            'journal': self.journal.path if self.journal is not None else None,
+            'subscribers': [
+                {
+                    'handler': getattr(subscriber.handler, '__qualname__', repr(subscriber.handler)),
+                    'tables': sorted(subscriber.tables) if subscriber.tables else None,
+                    'delivered': subscriber.delivered,
+                    'failed': subscriber.failed,
+                    'pending': subscriber.queue.qsize() if subscriber.queue is not None else 0,
+                }
+                for subscriber in self._subscribers.values()
+            ],
+        }
+
+
+class ChangeStreamConsumer:
+    """
+    Hands change events to `await handler(event)` once each, in order, from
+    whichever source is available:
+        db.changes.subscribe(consumer)                    # live, in process
+        await consumer.replay(journal)                    # a ChangeJournal
+        await consumer.poll(streams_client, stream_arn)   # DynamoDB Streams
+    poll() takes an aioboto3 'dynamodbstreams' client or any stand-in with
+    the same DescribeStream/GetShardIterator/GetRecords calls (such as
+    InMemoryDynamoDB.streams_client()). checkpoints holds the last sequence
+    number handled per shard; events at or before it are skipped, so sources
+    can overlap (e.g. replay the journal, then subscribe).
+    """
+    
+    def __init__(self, handler, checkpoints: Optional[Dict[str, str]] = None):
+        self.handler = handler
+        self.checkpoints = dict(checkpoints or {})
+    
+    async def __call__(self, event: ChangeEvent):
+        await self.handle(event)
+    
+    async def handle(self, event: ChangeEvent) -> bool:
+        """Deliver one event unless its shard's checkpoint is past it; returns whether it was delivered"""
+        checkpoint = self.checkpoints.get(event.shard)
+        if checkpoint is not None and event.sequence_number is not None and int(event.sequence_number) <= int(checkpoint):
+            return False
+        await self.handler(event)
+        if event.sequence_number is not None:
+            self.checkpoints[event.shard] = event.sequence_number
+        return True
+    
+    async def consume(self, records, shard: str = CHANGE_SHARD) -> int:
+        """Deliver DynamoDB Streams records of one shard; returns how many were new"""
+        handled = 0
+        for record in records:
+            handled += await self.handle(ChangeEvent.from_record(record, shard))
+        return handled
+    
+    async def replay(self, journal: ChangeJournal) -> int:
+        """Deliver the journal's records after the local checkpoint"""
+        return await self.consume(journal.records(after=self.checkpoints.get(CHANGE_SHARD)))
+    
+    async def poll(self, client, stream_arn: str, iterator_type: str = 'TRIM_HORIZON', limit: int = 1000) -> int:
+        """
+        One pass over every shard of a stream, reading each (after its
+        checkpoint, else from iterator_type) until it has no more records;
+        returns how many records were new. Call it again to catch up.
+        """
+        shards = []
+        params = {'StreamArn': stream_arn}
+        while True:
+            description = (await client.describe_stream(**params))['StreamDescription']
+            shards.extend(description.get('Shards', []))
+            if not description.get('LastEvaluatedShardId'):
+                break
+            params['ExclusiveStartShardId'] = description['LastEvaluatedShardId']
+        
+        handled = 0
+        # Shards are listed parents first, so a key's records are delivered in order
+        for shard in shards:
+            shard_id = shard['ShardId']
+            position = {'ShardIteratorType': iterator_type}
+            if shard_id in self.checkpoints:
+                position = {'ShardIteratorType': 'AFTER_SEQUENCE_NUMBER', 'SequenceNumber': self.checkpoints[shard_id]}
+            response = await client.get_shard_iterator(StreamArn=stream_arn, ShardId=shard_id, **position)
+            iterator = response.get('ShardIterator')
+            while iterator:
+                response = await client.get_records(ShardIterator=iterator, Limit=limit)
+                records = response.get('Records', [])
+                handled += await self.consume(records, shard_id)
+                if not records:
+                    # Caught up (an open shard keeps returning a next iterator)
+                    break
+                iterator = response.get('NextShardIterator')
+        return handled
+
+
+def collection_table_name(collection_name: str) -> str:
+    """DynamoDB table behind a collection name (users -> arbrit-users)"""
+    return f"arbrit-{collection_name.replace('_', '-')}"
 
 
 class DynamoDBDatabase:
-    """Simulates MongoDB database interface"""
+    """
+    Simulates MongoDB database interface
+    
+    Owns one long-lived, connection-pooled DynamoDB resource that every
+    collection and cursor shares. Call connect() at application startup and
+    close() at shutdown; the first operation connects lazily if needed.
+    Pool settings default from the environment:
+        DYNAMODB_MAX_POOL_CONNECTIONS (default 50)
+        DYNAMODB_CONNECT_TIMEOUT      (seconds, default 5)
+        DYNAMODB_READ_TIMEOUT         (seconds, default 30)
+        DYNAMODB_TCP_KEEPALIVE        (true/false, default true)
+    Scans of tables larger than DYNAMODB_PARALLEL_SCAN_MIN_BYTES (default
+    8MB) run as DYNAMODB_PARALLEL_SCAN_SEGMENTS (default 4) parallel segments.
+    Key lookups on the collections named in cache_tables (or
+    DYNAMODB_CACHE_TABLES, see _parse_cache_tables) go through a per-collection
+    read-through ItemCache; no collection is cached by default. String fields
+    named in search_fields (or DYNAMODB_SEARCH_FIELDS, see _parse_search_fields)
+    keep lowercased shadow attributes for case-insensitive $regex. Query plans
+    are compiled once per filter shape and kept in a PlanCache
+    (DYNAMODB_PLAN_CACHE_SIZE shapes, default 512; 0 disables it). Identical
+    concurrent reads are coalesced (DYNAMODB_SINGLE_FLIGHT, default true).
+    Atomic sequence numbers are available as db.counters (DynamoDBCounters).
+    Collections named in aggregates (or DYNAMODB_AGGREGATES, see
+    _parse_aggregates) keep per-group document counts in db.aggregates
+    (DynamoDBAggregates); none by default. Every write is published as a
+    ChangeEvent to db.changes (DynamoDBChangeFeed) subscribers and, if
+    change_journal (or DYNAMODB_CHANGE_JOURNAL) names a file, appended to that
+    ChangeJournal (fsync'd with DYNAMODB_CHANGE_JOURNAL_FSYNC, default false;
+    rotated at DYNAMODB_CHANGE_JOURNAL_MAX_BYTES, see DynamoDBChangeFeed).
+    
+    Throttled requests are retried by botocore (DYNAMODB_RETRY_MODE, default
+    adaptive: jittered exponential backoff plus client-side rate limiting;
+    DYNAMODB_MAX_ATTEMPTS, default 10). Collections listed in rate_limits (or
+    DYNAMODB_RATE_LIMITS, see _parse_rate_limits) are additionally held to a
+    per-table TokenBucket. Requests, retries, throttles and unprocessed batch
+    items are counted per table (throttle_stats()).
+    
+    Every item request asks for ReturnConsumedCapacity (DYNAMODB_CONSUMED_CAPACITY,
+    default INDEXES; NONE disables it); latency, items and RCU/WCU are recorded
+    in db.metrics (DynamoDBMetrics).
+    
+    Every filter planned as a Scan is logged as a "slow plan" warning (at most
+    once per endpoint, table and filter shape every DYNAMODB_SLOW_PLAN_LOG_INTERVAL
+    seconds, default 60). Scans inside a scan_budget() block are held to a
+    ScanBudget (DYNAMODB_SCAN_BUDGET_ITEMS / DYNAMODB_SCAN_BUDGET_PAGES, unset
+    by default; DYNAMODB_SCAN_BUDGET_MODE raise or truncate, default truncate).
     
-    def __init__(self, region: str = 'us-east-1'):
+    Tables are planned from DescribeTable; while it fails, from their entry in
+    DYNAMODB_TABLE_DEFINITIONS (default dynamodb-tables.json next to backend/).
+    """
+    
+    def __init__(self, region: str = 'us-east-1', max_pool_connections: Optional[int] = None,
+                 connect_timeout: Optional[float] = None, read_timeout: Optional[float] = None,
+                 tcp_keepalive: Optional[bool] = None, cache_tables: Any = None,
+                 retry_mode: Optional[str] = None, max_attempts: Optional[int] = None,
+                 rate_limits: Any = None, search_fields: Any = None, aggregates: Any = None,
+                 change_journal: Optional[str] = None):
         self.region = region
         self.session = aioboto3.Session()
+        self.max_pool_connections = max_pool_connections or int(
+            os.environ.get('DYNAMODB_MAX_POOL_CONNECTIONS', '50'))
+        self.connect_timeout = connect_timeout or float(
+            os.environ.get('DYNAMODB_CONNECT_TIMEOUT', '5'))
+        self.read_timeout = read_timeout or float(
+            os.environ.get('DYNAMODB_READ_TIMEOUT', '30'))
+        if tcp_keepalive is None:
+            tcp_keepalive = os.environ.get('DYNAMODB_TCP_KEEPALIVE', 'true').lower() in ('1', 'true', 'yes')
+        self.tcp_keepalive = tcp_keepalive
+        self.parallel_scan_segments = int(os.environ.get('DYNAMODB_PARALLEL_SCAN_SEGMENTS', '4'))
+        self.parallel_scan_min_bytes = int(os.environ.get('DYNAMODB_PARALLEL_SCAN_MIN_BYTES', str(8 * 1024 * 1024)))
+        if cache_tables is None:
+            cache_tables = os.environ.get('DYNAMODB_CACHE_TABLES', '')
+        self.cache_tables = _parse_cache_tables(cache_tables)
+        if search_fields is None:
+            search_fields = os.environ.get('DYNAMODB_SEARCH_FIELDS', '')
+        self.search_fields = _parse_search_fields(search_fields)
+        if aggregates is None:
+            aggregates = os.environ.get('DYNAMODB_AGGREGATES', '')
+        self.aggregate_groups = _parse_aggregates(aggregates)
+        self.plan_cache = PlanCache(int(os.environ.get('DYNAMODB_PLAN_CACHE_SIZE', '512')))
+        self.single_flight = SingleFlight(
+            os.environ.get('DYNAMODB_SINGLE_FLIGHT', 'true').lower() in ('1', 'true', 'yes'))
+        self.retry_mode = retry_mode or os.environ.get('DYNAMODB_RETRY_MODE', 'adaptive')
+        self.max_attempts = max_attempts or int(os.environ.get('DYNAMODB_MAX_ATTEMPTS', '10'))
+        if rate_limits is None:
+            rate_limits = os.environ.get('DYNAMODB_RATE_LIMITS', '')
+        self.rate_limiters = {
+            collection_table_name(name): bucket for name, bucket in _parse_rate_limits(rate_limits).items()
+        }
+        self._table_stats = {}
+        self.consumed_capacity = os.environ.get('DYNAMODB_CONSUMED_CAPACITY', 'INDEXES').upper()
+        self.metrics = DynamoDBMetrics()
+        self.slow_plan_log_interval = float(os.environ.get('DYNAMODB_SLOW_PLAN_LOG_INTERVAL', '60'))
+        self._slow_plans = {}  # (endpoint, table, filter shape) -> [last logged at, scans since]
+        self.scan_budget_items = _optional_int(os.environ.get('DYNAMODB_SCAN_BUDGET_ITEMS'))
+        self.scan_budget_pages = _optional_int(os.environ.get('DYNAMODB_SCAN_BUDGET_PAGES'))
+        self.scan_budget_mode = os.environ.get('DYNAMODB_SCAN_BUDGET_MODE', 'truncate')
+        self.table_definitions_path = os.environ.get('DYNAMODB_TABLE_DEFINITIONS') or TABLE_DEFINITIONS_PATH
+        self._table_definitions = None
+        self.counters = DynamoDBCounters(self)
+        self.aggregates = DynamoDBAggregates(self)
+        change_journal = change_journal or os.environ.get('DYNAMODB_CHANGE_JOURNAL')
+        journal = None
+        if change_journal:
+            journal = ChangeJournal(
+                change_journal,
+                os.environ.get('DYNAMODB_CHANGE_JOURNAL_FSYNC', 'false').lower() in ('1', 'true', 'yes'),
+                int(os.environ.get('DYNAMODB_CHANGE_JOURNAL_MAX_BYTES', str(100 * 1024 * 1024))),
+                int(os.environ.get('DYNAMODB_CHANGE_JOURNAL_BACKUPS', '3')),
+            )
+        self.changes = DynamoDBChangeFeed(journal)
         self._collections = {}
+        self._tables = {}
+        self._resource = None
+        self._client = None
+        self._exit_stack = None
+        self._connect_lock = asyncio.Lock()
     
     def __getattr__(self, collection_name: str):
         """Get collection by attribute access (e.g., db.users)"""
+        if collection_name.startswith('_'):
+            raise AttributeError(collection_name)
         if collection_name not in self._collections:
-            table_name = f"arbrit-{collection_name.replace('_', '-')}"
-            self._collections[collection_name] = DynamoDBCollection(
-                self.session, table_name, self.region
-            )
+            collection = DynamoDBCollection(self, collection_table_name(collection_name))
+            if collection_name in self.cache_tables:
+                collection.enable_cache(*self.cache_tables[collection_name])
+            if collection_name in self.search_fields:
+                collection.enable_search_fields(self.search_fields[collection_name])
+            if collection_name in self.aggregate_groups:
+                collection.enable_aggregates(self.aggregate_groups[collection_name])
+            self._collections[collection_name] = collection
         return self._collections[collection_name]
     
+    def _client_config(self) -> AioConfig:
+        """Connection pool, keep-alive and timeout settings for the shared client"""
+        return AioConfig(
+            max_pool_connections=self.max_pool_connections,
+            connect_timeout=self.connect_timeout,
+            read_timeout=self.read_timeout,
+            tcp_keepalive=self.tcp_keepalive,
+            retries={'mode': self.retry_mode, 'total_max_attempts': self.max_attempts},
+        )
+    
+    async def connect(self):
+        """Open the shared DynamoDB resource and low-level client (idempotent)"""
+        if self._resource is not None:
+            return self._resource
+        async with self._connect_lock:
+            if self._resource is None:
+                exit_stack = AsyncExitStack()
+                self._client = await exit_stack.enter_async_context(
+                    self.session.client('dynamodb', region_name=self.region,
+                                        config=self._client_config())
+                )
+                self._resource = await exit_stack.enter_async_context(
+                    self.session.resource('dynamodb', region_name=self.region,
+                                          config=self._client_config())
+                )
+                for client in (self._client, self._resource.meta.client):
+                    client.meta.events.register('needs-retry.dynamodb', self._on_needs_retry)
+                self._exit_stack = exit_stack
+        return self._resource
+    
+    async def close(self):
+        """Close the shared DynamoDB resource/client and release pooled connections"""
+        await self.changes.close()
+        async with self._connect_lock:
+            exit_stack = self._exit_stack
+            self._resource = None
+            self._client = None
+            self._exit_stack = None
+            self._tables = {}
+            if exit_stack is not None:
+                await exit_stack.aclose()
+    
+    def table_stats(self, table_name: str) -> Dict:
+        """Request/retry/throttle counters of one table"""
+        stats = self._table_stats.get(table_name)
+        if stats is None:
+            stats = self._table_stats[table_name] = {
+                'requests': 0,
+                'retries': 0,
+                'throttles': 0,
+                'throttled_requests': 0,
+                'unprocessed': 0,
+            }
+        return stats
+    
+    def table_definition(self, table_name: str) -> Optional[Dict]:
+        """The table's entry in the table definitions file (loaded once), if any"""
+        if self._table_definitions is None:
+            try:
+                self._table_definitions = load_table_definitions(self.table_definitions_path)
+            except (OSError, ValueError) as e:
+                logger.warning(f"Could not load table definitions from {self.table_definitions_path}: {e}")
+                self._table_definitions = {}
+        return self._table_definitions.get(table_name)
+    
+    def throttle_stats(self) -> Dict[str, Dict]:
+        """Counters of every table used so far, with current rate limits"""
+        report = {}
+        for table_name, stats in self._table_stats.items():
+            report[table_name] = dict(stats)
+            limiter = self.rate_limiters.get(table_name)
+            if limiter is not None:
+                report[table_name].update(rate_limit=round(limiter.rate, 2),
+                                          rate_limit_wait=round(limiter.waited, 3))
+        return report
+    
+    async def call(self, tables: Any, method, **kwargs) -> Dict:
+        """
+        Issue one DynamoDB request on behalf of one table (or a list of tables
+        for a transaction): waits for their rate limits, then counts the request,
+        its retries and whether it finally failed throttled
+        """
+        tables = (tables,) if isinstance(tables, str) else tuple(tables)
+        operation = _operation_name(method)
+        if self.consumed_capacity != 'NONE' and operation in CAPACITY_OPERATIONS:
+            kwargs.setdefault('ReturnConsumedCapacity', self.consumed_capacity)
+        budget = _current_budget.get() if operation == 'Scan' else None
+        if budget is not None:
+            if budget.exhausted:
+                return self._over_budget(budget, tables[0])
+            remaining = budget.remaining_items()
+            if remaining is not None:
+                kwargs['Limit'] = min(kwargs.get('Limit', remaining), remaining)
+        for table_name in tables:
+            limiter = self.rate_limiters.get(table_name)
+            if limiter is not None:
+                await limiter.acquire()
+        token = _current_tables.set(tables)
+        started = time.perf_counter()
+        try:
+            response = await method(**kwargs)
+        except ClientError as e:
+            code = e.response.get('Error', {}).get('Code')
+            self._record_request(tables, e.response, code in THROTTLE_ERROR_CODES)
+            self.metrics.record(tables, operation, time.perf_counter() - started, e.response, code or 'Unknown')
+            raise
+        finally:
+            _current_tables.reset(token)
+        self._record_request(tables, response)
+        self.metrics.record(tables, operation, time.perf_counter() - started, response)
+        if budget is not None:
+            budget.charge(response)
+            if budget.exhausted and 'LastEvaluatedKey' in response:
+                self._over_budget(budget, tables[0])
+                del response['LastEvaluatedKey']
+        return response
+    
+    def _over_budget(self, budget: ScanBudget, table_name: str) -> Dict:
+        """Raise, or truncate: an empty final page in place of the Scan page the budget cannot pay for"""
+        if budget.mode == 'raise':
+            raise ScanBudgetExceeded(budget, table_name)
+        if not budget.truncated:
+            logger.warning(
+                f"Scan budget exhausted, truncating results: endpoint={_current_endpoint.get() or '-'} "
+                f"table={table_name} items={budget.items} pages={budget.pages}"
+            )
+        budget.truncated = True
+        return {'Items': [], 'Count': 0, 'ScannedCount': 0}
+    
+    @contextmanager
+    def scan_budget(self, max_items: Optional[int] = None, max_pages: Optional[int] = None,
+                    mode: Optional[str] = None):
+        """
+        Hold the Scans made inside this block to one ScanBudget (defaults from
+        DYNAMODB_SCAN_BUDGET_*); yields it so callers can check truncated
+        """
+        budget = ScanBudget(
+            max_items if max_items is not None else self.scan_budget_items,
+            max_pages if max_pages is not None else self.scan_budget_pages,
+            mode or self.scan_budget_mode,
+        )
+        token = _current_budget.set(budget)
+        try:
+            yield budget
+        finally:
+            _current_budget.reset(token)
+    
+    def report_scan(self, table_name: str, filter_dict: Dict):
+        """Log a structured "slow plan" warning for a filter that is served by a Scan"""
+        endpoint = _current_endpoint.get()
+        shape = json.dumps(filter_shape(filter_dict or {}), sort_keys=True)
+        now = time.monotonic()
+        entry = self._slow_plans.setdefault((endpoint, table_name, shape), [None, 0])
+        entry[1] += 1
+        if entry[0] is not None and now - entry[0] < self.slow_plan_log_interval:
+            return
+        logger.warning(
+            f"Slow plan: Scan endpoint={endpoint or '-'} table={table_name} filter={shape} "
+            f"scans_since_last_report={entry[1]}",
+            extra={'slow_plan': {'operation': 'Scan', 'endpoint': endpoint, 'table': table_name,
+                                 'filter': shape, 'count': entry[1]}}
+        )
+        entry[0] = now
+        entry[1] = 0
+    
+    def _record_request(self, tables: tuple, response: Dict, throttled: bool = False):
+        retries = response.get('ResponseMetadata', {}).get('RetryAttempts', 0)
+        for table_name in tables:
+            stats = self.table_stats(table_name)
+            stats['requests'] += 1
+            stats['retries'] += retries
+            limiter = self.rate_limiters.get(table_name)
+            if throttled:
+                stats['throttled_requests'] += 1
+            elif limiter is not None:
+                limiter.on_success()
+    
+    def _on_needs_retry(self, response=None, **kwargs):
+        """botocore needs-retry hook: count each throttled attempt against the request's tables"""
+        if response is None:
+            return None
+        if response[1].get('Error', {}).get('Code') in THROTTLE_ERROR_CODES:
+            for table_name in _current_tables.get():
+                self.table_stats(table_name)['throttles'] += 1
+                limiter = self.rate_limiters.get(table_name)
+                if limiter is not None:
+                    limiter.on_throttle()
+        return None
+    
+    def auto_scan_segments(self, schema: TableSchema) -> int:
+        """Parallel scan segments to use by default for a table of this size"""
+        if self.parallel_scan_segments > 1 and schema.size_bytes >= self.parallel_scan_min_bytes:
+            return self.parallel_scan_segments
+        return 1
+    
+    async def get_client(self):
+        """
+        Get the shared low-level DynamoDB client. Unlike resource.meta.client it
+        does not (de)serialize AttributeValues, so requests and responses are raw.
+        """
+        await self.connect()
+        return self._client
+    
+    async def get_table(self, table_name: str):
+        """Get a (cached) Table object bound to the shared resource"""
+        table = self._tables.get(table_name)
+        if table is None:
+            resource = await self.connect()
+            table = await resource.Table(table_name)
+            self._tables[table_name] = table
+        return table
+    
+    def single_flight_stats(self) -> Dict:
+        """How many read calls were served by another caller's in-flight request"""
+        return self.single_flight.stats()
+    
+    def plan_cache_stats(self) -> Dict:
+        """How many query plans were bound from a cached filter shape"""
+        return self.plan_cache.stats()
+    
+    def cache_stats(self) -> Dict[str, Dict]:
+        """ItemCache counters of every cached collection opened so far"""
+        return {
+            name: collection.cache.stats()
+            for name, collection in self._collections.items()
+            if collection.cache is not None
+        }
+    
+    def transaction(self, atomic: bool = True) -> DynamoDBTransaction:
+        """Group writes across tables into one request (see DynamoDBTransaction)"""
+        return DynamoDBTransaction(self, atomic)
+    
     async def get_item(self, collection_name: str, filter_dict: Dict, projection: Optional[Dict] = None):
         """Get a single item from collection"""
         collection = getattr(self, collection_name)
         return await collection.find_one(filter_dict, projection)
     
-    async def scan_items(self, collection_name: str, filter_dict: Dict = None, projection: Optional[Dict] = None):
-        """Scan items from collection"""
+    async def get_items_batch(self, collection_name: str, keys: List[Any],
+                              projection: Optional[Dict] = None) -> Dict[Any, Dict]:
+        """Get many items by primary key (see DynamoDBCollection.find_many_by_keys)"""
+        collection = getattr(self, collection_name)
+        return await collection.find_many_by_keys(keys, projection)
+    
+    async def scan_items(self, collection_name: str, filter_dict: Dict = None, projection: Optional[Dict] = None,
+                         segments: Optional[int] = None, order_by_key: bool = False):
+        """
+        Scan items from collection
+        segments: parallel scan segments (None picks automatically from table size, 1 is sequential)
+        order_by_key: return items in primary key order after a parallel scan
+        """
         collection = getattr(self, collection_name)
         cursor = collection.find(filter_dict or {}, projection)
+        if segments is not None or order_by_key:
+            cursor.parallel(segments, order_by_key)
         return await cursor.to_list(10000)
     
+    async def count_items(self, collection_name: str, filter_dict: Dict = None, approximate: bool = False,
+                          segments: Optional[int] = None) -> int:
+        """Count items in collection server-side (see DynamoDBCollection.count)"""
+        collection = getattr(self, collection_name)
+        return await collection.count(filter_dict, approximate, segments)
+    
     async def insert_item(self, collection_name: str, item: Dict):
         """Insert item into collection"""
         collection = getattr(self, collection_name)
         return await collection.insert_one(item)
     
+    async def put_item(self, collection_name: str, item: Dict):
+        """Put (insert or replace) item into collection"""
+        return await self.insert_item(collection_name, item)
+    
+    async def put_items(self, collection_name: str, items: List[Dict], concurrency: int = 4) -> BulkWriteResult:
+        """Put many items into collection with BatchWriteItem (see DynamoDBCollection.insert_many)"""
+        collection = getattr(self, collection_name)
+        return await collection.insert_many(items, concurrency)
+    
     async def update_item(self, collection_name: str, filter_dict: Dict, update_dict: Dict):
         """Update item in collection"""
         collection = getattr(self, collection_name)
@@ -326,8 +3969,8 @@ class DynamoDBDatabase:
         """Execute database command (e.g., 'ping')"""
         if command == 'ping':
             # Test DynamoDB connection
-            async with self.session.client('dynamodb', region_name=self.region) as client:
-                await client.list_tables(Limit=1)
+            client = await self.get_client()
+            await client.list_tables(Limit=1)
             return {"ok": 1}
         return {"ok": 0}
 
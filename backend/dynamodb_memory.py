@@ -0,0 +1,1716 @@
+"""
+In-memory DynamoDB engine
+A deterministic, in-process stand-in for DynamoDB that DynamoDBDatabase runs on
+unchanged, for benchmarking and regression-testing query plans offline:
+
+    engine = InMemoryDynamoDB.from_table_definitions()    # dynamodb-tables.json
+    engine.load_json_fixtures()                            # Json/arbrit-workdesk.*.json
+    db = InMemoryDynamoDBDatabase(engine)
+    await db.leads.find({"status": "new"}).to_list(100)
+    engine.consumed_capacity()                             # RCU/WCU per table and index
+
+Implements the part of the DynamoDB API the layer uses (GetItem, PutItem,
+UpdateItem, DeleteItem, Query, Scan, BatchGetItem, BatchWriteItem,
+TransactWriteItems, DescribeTable, ListTables) behind both a resource (Table
+objects, Python values, boto3 conditions) and a low-level client
+(AttributeValues). With streams=True it also records a NEW_AND_OLD_IMAGES
+DynamoDB Streams record of every write, read through streams_client()
+(DescribeStream, GetShardIterator, GetRecords; one shard per table, records
+kept forever). Emulated: key schemas and sparse GSIs, hash-ordered scans
+and parallel scan segments, range key ordering, Limit and the 1MB page size
+(configurable), LastEvaluatedKey, condition/filter/update/projection
+expressions, unused/undefined expression placeholders, consumed capacity, and
+injected latency and throttling (retried like botocore, firing its needs-retry
+event). Not emulated: reserved word checks, LSIs, TTL, eventual consistency.
+"""
+
+import asyncio
+import bisect
+import copy
+import hashlib
+import json
+import math
+import random
+import re
+import struct
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from boto3.dynamodb.conditions import ConditionBase, ConditionExpressionBuilder
+from boto3.dynamodb.types import Binary, TypeDeserializer, TypeSerializer
+from botocore.exceptions import ClientError
+
+from dynamodb_layer import (
+    BATCH_GET_SIZE, BATCH_WRITE_SIZE, CHANGE_STREAM_VIEW_TYPE, TRANSACT_WRITE_SIZE, DynamoDBDatabase,
+    _backoff, _stream_arn, collection_table_name, load_table_definitions, to_dynamodb_value,
+)
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+
+# Query/Scan pages stop once this much item data has been read
+PAGE_SIZE_BYTES = 1024 * 1024
+MAX_ITEM_BYTES = 400 * 1024
+READ_UNIT_BYTES = 4 * 1024
+WRITE_UNIT_BYTES = 1024
+
+# Label and only shard of every in-memory table stream
+STREAM_LABEL = 'memory'
+STREAM_SHARD_ID = 'shardId-00000000000000000001'
+
+# Errors the simulated client retries, as botocore does
+_RETRYABLE_ERRORS = frozenset({
+    'ProvisionedThroughputExceededException',
+    'ThrottlingException',
+    'RequestLimitExceeded',
+    'InternalServerError',
+    'TransactionConflictException',
+})
+
+_MISSING = object()
+
+_serializer = TypeSerializer()
+_deserializer = TypeDeserializer()
+
+
+class _DynamoError(Exception):
+    """A DynamoDB service error (turned into botocore's ClientError by the facades)"""
+
+    def __init__(self, code: str, message: str, **extra):
+        super().__init__(message)
+        self.code = code
+        self.message = message
+        self.extra = extra
+
+
+def _validation(message: str) -> _DynamoError:
+    return _DynamoError('ValidationException', message)
+
+
+# ==================== VALUES ====================
+
+def _type_of(value: Any) -> str:
+    """DynamoDB type descriptor of a (deserialized) value"""
+    if isinstance(value, bool):
+        return 'BOOL'
+    if value is None:
+        return 'NULL'
+    if isinstance(value, str):
+        return 'S'
+    if isinstance(value, (int, Decimal)):
+        return 'N'
+    if isinstance(value, (Binary, bytes, bytearray)):
+        return 'B'
+    if isinstance(value, dict):
+        return 'M'
+    if isinstance(value, list):
+        return 'L'
+    if isinstance(value, (set, frozenset)) and value:
+        return {'S': 'SS', 'N': 'NS', 'B': 'BS'}[_type_of(next(iter(value)))]
+    raise _validation(f"Unsupported attribute value type: {type(value).__name__}")
+
+
+def _normalize(item: Dict) -> Dict:
+    """Python values exactly as DynamoDB would store and return them (Decimal, Binary, sets)"""
+    return {k: _deserializer.deserialize(_serializer.serialize(v)) for k, v in item.items()}
+
+
+def _scalar(value: Any) -> Any:
+    return value.value if isinstance(value, Binary) else value
+
+
+def _equal(a: Any, b: Any) -> bool:
+    """DynamoDB equality: same type and same value (deeply for lists and maps)"""
+    type_a = _type_of(a)
+    if type_a != _type_of(b):
+        return False
+    if type_a == 'M':
+        return a.keys() == b.keys() and all(_equal(a[k], b[k]) for k in a)
+    if type_a == 'L':
+        return len(a) == len(b) and all(_equal(x, y) for x, y in zip(a, b))
+    return a == b
+
+
+def _ordered_pair(a: Any, b: Any) -> Optional[tuple]:
+    """Both values as comparable scalars if they are the same orderable type"""
+    if a is _MISSING or b is _MISSING:
+        return None
+    type_a = _type_of(a)
+    if type_a != _type_of(b) or type_a not in ('S', 'N', 'B'):
+        return None
+    return _scalar(a), _scalar(b)
+
+
+def _value_size(value: Any) -> int:
+    """Approximate stored size of a value, following DynamoDB's item size rules"""
+    value_type = _type_of(value)
+    if value_type == 'S':
+        return len(value.encode('utf-8'))
+    if value_type == 'N':
+        return len(value.normalize().as_tuple().digits) // 2 + 2
+    if value_type == 'B':
+        return len(_scalar(value))
+    if value_type in ('BOOL', 'NULL'):
+        return 1
+    if value_type == 'M':
+        return 3 + sum(len(k.encode('utf-8')) + _value_size(v) + 1 for k, v in value.items())
+    if value_type == 'L':
+        return 3 + sum(_value_size(v) + 1 for v in value)
+    return sum(_value_size(v) for v in value)
+
+
+def _item_size(item: Dict) -> int:
+    return sum(len(k.encode('utf-8')) + _value_size(v) for k, v in item.items())
+
+
+def _partition_token(value: Any) -> str:
+    """Stable stand-in for DynamoDB's partition key hash (decides scan order and segments)"""
+    if isinstance(value, Decimal):
+        canonical = f"N:{value.normalize()}"
+    elif isinstance(value, Binary):
+        canonical = f"B:{value.value.hex()}"
+    else:
+        canonical = f"S:{value}"
+    return hashlib.md5(canonical.encode('utf-8')).hexdigest()
+
+
+def _sort_component(value: Any) -> Any:
+    return _scalar(value) if value is not None else ''
+
+
+# ==================== EXPRESSIONS ====================
+
+_TOKEN_RE = re.compile(
+    r"\s*(?:(?P<name>#[A-Za-z0-9_]+)|(?P<value>:[A-Za-z0-9_]+)|(?P<ident>[A-Za-z_][A-Za-z0-9_]*)"
+    r"|(?P<number>\d+)|(?P<op><>|<=|>=|[=<>(),.\[\]+\-]))"
+)
+_KEYWORDS = {'AND', 'OR', 'NOT', 'BETWEEN', 'IN'}
+_COMPARATORS = {'=', '<>', '<', '<=', '>', '>='}
+_CONDITION_FUNCTIONS = {'attribute_exists', 'attribute_not_exists', 'attribute_type', 'begins_with', 'contains'}
+_UPDATE_CLAUSES = {'SET', 'REMOVE', 'ADD', 'DELETE'}
+
+
+class _Expressions:
+    """
+    Parser for the condition, key condition, update and projection expressions
+    of one request. Placeholders are resolved while parsing and tracked, so
+    unused or undefined ones can be rejected as DynamoDB does.
+    """
+
+    def __init__(self, names: Optional[Dict] = None, values: Optional[Dict] = None):
+        self.names = names or {}
+        self.values = values or {}
+        self.used_names = set()
+        self.used_values = set()
+        self._tokens = []
+        self._pos = 0
+
+    def check_unused(self):
+        unused_names = set(self.names) - self.used_names
+        if unused_names:
+            raise _validation(f"Value provided in ExpressionAttributeNames unused in expressions: keys: {{{', '.join(sorted(unused_names))}}}")
+        unused_values = set(self.values) - self.used_values
+        if unused_values:
+            raise _validation(f"Value provided in ExpressionAttributeValues unused in expressions: keys: {{{', '.join(sorted(unused_values))}}}")
+
+    # Tokens
+
+    def _start(self, text: str):
+        tokens = []
+        pos = 0
+        text = text.rstrip()
+        while pos < len(text):
+            match = _TOKEN_RE.match(text, pos)
+            if match is None or match.end() == pos:
+                raise _validation(f"Invalid expression: Syntax error; token: \"{text[pos:pos + 10]}\"")
+            tokens.append((match.lastgroup, match.group(match.lastgroup)))
+            pos = match.end()
+        self._tokens = tokens + [('end', '')]
+        self._pos = 0
+
+    def _peek(self, offset: int = 0) -> tuple:
+        return self._tokens[min(self._pos + offset, len(self._tokens) - 1)]
+
+    def _next(self) -> tuple:
+        token = self._tokens[self._pos]
+        self._pos += 1
+        return token
+
+    def _is(self, text: str, offset: int = 0) -> bool:
+        kind, token = self._peek(offset)
+        if kind == 'ident':
+            return token.upper() == text.upper()
+        return kind == 'op' and token == text
+
+    def _expect(self, text: str):
+        if not self._is(text):
+            raise _validation(f"Invalid expression: Syntax error; token: \"{self._peek()[1]}\", expected \"{text}\"")
+        self._next()
+
+    def _end(self):
+        if self._peek()[0] != 'end':
+            raise _validation(f"Invalid expression: Syntax error; token: \"{self._peek()[1]}\"")
+
+    # Operands
+
+    def _name(self) -> str:
+        kind, token = self._next()
+        if kind == 'name':
+            if token not in self.names:
+                raise _validation(f"An expression attribute name used in the document path is not defined; attribute name: {token}")
+            self.used_names.add(token)
+            return self.names[token]
+        if kind == 'ident' and token.upper() not in _KEYWORDS:
+            return token
+        raise _validation(f"Invalid expression: Syntax error; token: \"{token}\"")
+
+    def _path(self) -> tuple:
+        elements = [self._name()]
+        while self._is('.') or self._is('['):
+            if self._next()[1] == '.':
+                elements.append(self._name())
+            else:
+                kind, token = self._next()
+                if kind != 'number':
+                    raise _validation(f"Invalid expression: list index must be a number; token: \"{token}\"")
+                elements.append(int(token))
+                self._expect(']')
+        return 'path', tuple(elements)
+
+    def _operand(self) -> tuple:
+        kind, token = self._peek()
+        if kind == 'value':
+            self._next()
+            if token not in self.values:
+                raise _validation(f"An expression attribute value used in expression is not defined; attribute value: {token}")
+            self.used_values.add(token)
+            return 'value', self.values[token]
+        if kind == 'ident' and token.lower() == 'size' and self._is('(', 1):
+            self._next()
+            self._expect('(')
+            path = self._path()
+            self._expect(')')
+            return 'size', path
+        return self._path()
+
+    # Conditions
+
+    def condition(self, text: str) -> tuple:
+        self._start(text)
+        node = self._or()
+        self._end()
+        return node
+
+    def _or(self) -> tuple:
+        node = self._and()
+        while self._is('OR'):
+            self._next()
+            node = ('or', node, self._and())
+        return node
+
+    def _and(self) -> tuple:
+        node = self._not()
+        while self._is('AND'):
+            self._next()
+            node = ('and', node, self._not())
+        return node
+
+    def _not(self) -> tuple:
+        if self._is('NOT'):
+            self._next()
+            return 'not', self._not()
+        return self._primary()
+
+    def _primary(self) -> tuple:
+        if self._is('('):
+            self._next()
+            node = self._or()
+            self._expect(')')
+            return node
+        kind, token = self._peek()
+        if kind == 'ident' and token.lower() in _CONDITION_FUNCTIONS and self._is('(', 1):
+            self._next()
+            self._expect('(')
+            args = [self._path()]
+            while self._is(','):
+                self._next()
+                args.append(self._operand())
+            self._expect(')')
+            return 'function', token.lower(), tuple(args)
+        left = self._operand()
+        kind, token = self._peek()
+        if kind == 'op' and token in _COMPARATORS:
+            self._next()
+            return 'compare', token, left, self._operand()
+        if self._is('BETWEEN'):
+            self._next()
+            low = self._operand()
+            self._expect('AND')
+            return 'between', left, low, self._operand()
+        if self._is('IN'):
+            self._next()
+            self._expect('(')
+            options = [self._operand()]
+            while self._is(','):
+                self._next()
+                options.append(self._operand())
+            self._expect(')')
+            return 'in', left, tuple(options)
+        raise _validation(f"Invalid expression: Syntax error; token: \"{token}\"")
+
+    # Updates
+
+    def update(self, text: str) -> List[tuple]:
+        """Update actions: ('SET', path, value), ('REMOVE', path), ('ADD'/'DELETE', path, value)"""
+        self._start(text)
+        actions = []
+        seen = set()
+        while self._peek()[0] != 'end':
+            kind, token = self._next()
+            clause = token.upper()
+            if kind != 'ident' or clause not in _UPDATE_CLAUSES:
+                raise _validation(f"Invalid UpdateExpression: Syntax error; token: \"{token}\"")
+            if clause in seen:
+                raise _validation(f"Invalid UpdateExpression: The \"{clause}\" section can only be used once in an update expression")
+            seen.add(clause)
+            while True:
+                path = self._path()
+                if clause == 'SET':
+                    self._expect('=')
+                    actions.append((clause, path, self._set_value()))
+                elif clause == 'REMOVE':
+                    actions.append((clause, path))
+                else:
+                    actions.append((clause, path, self._operand()))
+                if not self._is(','):
+                    break
+                self._next()
+        if not actions:
+            raise _validation("Invalid UpdateExpression: The expression can not be empty")
+        paths = [action[1][1] for action in actions]
+        for position, path in enumerate(paths):
+            for other in paths[position + 1:]:
+                if path[:len(other)] == other[:len(path)]:
+                    raise _validation("Invalid UpdateExpression: Two document paths overlap with each other; "
+                                      "must remove or rewrite one of these paths")
+        return actions
+
+    def _set_value(self) -> tuple:
+        left = self._set_operand()
+        if self._is('+') or self._is('-'):
+            operator = self._next()[1]
+            return 'arithmetic', operator, left, self._set_operand()
+        return left
+
+    def _set_operand(self) -> tuple:
+        kind, token = self._peek()
+        if kind == 'ident' and token.lower() in ('if_not_exists', 'list_append') and self._is('(', 1):
+            self._next()
+            self._expect('(')
+            first = self._path() if token.lower() == 'if_not_exists' else self._set_operand()
+            self._expect(',')
+            second = self._set_operand()
+            self._expect(')')
+            return token.lower(), first, second
+        return self._operand()
+
+    # Projections
+
+    def projection(self, text: str) -> List[tuple]:
+        self._start(text)
+        paths = [self._path()]
+        while self._is(','):
+            self._next()
+            paths.append(self._path())
+        self._end()
+        return paths
+
+
+def _resolve(item: Dict, elements: tuple) -> Any:
+    value = item
+    for element in elements:
+        if isinstance(element, int):
+            if not isinstance(value, list) or element >= len(value):
+                return _MISSING
+        elif not isinstance(value, dict) or element not in value:
+            return _MISSING
+        value = value[element]
+    return value
+
+
+def _operand_value(node: tuple, item: Dict) -> Any:
+    if node[0] == 'value':
+        return node[1]
+    if node[0] == 'size':
+        value = _resolve(item, node[1][1])
+        if value is _MISSING or _type_of(value) in ('N', 'BOOL', 'NULL'):
+            return _MISSING
+        if isinstance(value, str):
+            return Decimal(len(value.encode('utf-8')))
+        return Decimal(len(_scalar(value)))
+    return _resolve(item, node[1])
+
+
+def _evaluate(node: tuple, item: Dict) -> bool:
+    """Evaluate a parsed condition against an item"""
+    kind = node[0]
+    if kind == 'or':
+        return _evaluate(node[1], item) or _evaluate(node[2], item)
+    if kind == 'and':
+        return _evaluate(node[1], item) and _evaluate(node[2], item)
+    if kind == 'not':
+        return not _evaluate(node[1], item)
+    if kind == 'compare':
+        operator = node[1]
+        left, right = _operand_value(node[2], item), _operand_value(node[3], item)
+        if operator in ('=', '<>'):
+            equal = left is not _MISSING and right is not _MISSING and _equal(left, right)
+            return equal if operator == '=' else not equal
+        pair = _ordered_pair(left, right)
+        if pair is None:
+            return False
+        a, b = pair
+        return {'<': a < b, '<=': a <= b, '>': a > b, '>=': a >= b}[operator]
+    if kind == 'between':
+        value = _operand_value(node[1], item)
+        low = _ordered_pair(value, _operand_value(node[2], item))
+        high = _ordered_pair(value, _operand_value(node[3], item))
+        return low is not None and high is not None and low[1] <= low[0] <= high[1]
+    if kind == 'in':
+        value = _operand_value(node[1], item)
+        return value is not _MISSING and any(
+            _equal(value, option) for option in (_operand_value(o, item) for o in node[2]) if option is not _MISSING
+        )
+
+    # Functions
+    name, args = node[1], node[2]
+    value = _resolve(item, args[0][1])
+    if name == 'attribute_exists':
+        return value is not _MISSING
+    if name == 'attribute_not_exists':
+        return value is _MISSING
+    argument = _operand_value(args[1], item)
+    if value is _MISSING or argument is _MISSING:
+        return False
+    if name == 'attribute_type':
+        return _type_of(value) == argument
+    if name == 'begins_with':
+        pair = _ordered_pair(value, argument)
+        return pair is not None and isinstance(pair[0], (str, bytes)) and pair[0].startswith(pair[1])
+    # contains
+    value_type = _type_of(value)
+    if value_type == 'S':
+        return isinstance(argument, str) and argument in value
+    if value_type in ('SS', 'NS', 'BS'):
+        return argument in value
+    if value_type == 'L':
+        return any(_equal(element, argument) for element in value)
+    return False
+
+
+def _condition_attributes(node: tuple) -> set:
+    """Top-level attribute names a condition refers to"""
+    kind = node[0]
+    if kind in ('path', 'size'):
+        path = node if kind == 'path' else node[1]
+        return {path[1][0]}
+    if kind == 'value':
+        return set()
+    if kind == 'function':
+        return set().union(*(_condition_attributes(arg) for arg in node[2]))
+    if kind == 'in':
+        return _condition_attributes(node[1]).union(*(_condition_attributes(o) for o in node[2]))
+    children = [child for child in node[1:] if isinstance(child, tuple)]
+    return set().union(*(_condition_attributes(child) for child in children))
+
+
+def _update_operand(node: tuple, item: Dict) -> Any:
+    kind = node[0]
+    if kind == 'if_not_exists':
+        value = _resolve(item, node[1][1])
+        return _update_operand(node[2], item) if value is _MISSING else value
+    if kind == 'list_append':
+        first, second = _update_operand(node[1], item), _update_operand(node[2], item)
+        if not isinstance(first, list) or not isinstance(second, list):
+            raise _validation("Invalid UpdateExpression: Incorrect operand type for operator or function; operator or function: list_append")
+        return first + second
+    if kind == 'arithmetic':
+        left, right = _update_operand(node[2], item), _update_operand(node[3], item)
+        if _type_of(left) != 'N' or _type_of(right) != 'N':
+            raise _validation(f"An operand in the update expression has an incorrect data type")
+        return left + right if node[1] == '+' else left - right
+    value = _operand_value(node, item)
+    if value is _MISSING:
+        raise _validation("The provided expression refers to an attribute that does not exist in the item")
+    return copy.deepcopy(value)
+
+
+def _assign(item: Dict, elements: tuple, value: Any):
+    parent = _resolve(item, elements[:-1]) if len(elements) > 1 else item
+    last = elements[-1]
+    if isinstance(last, int) and isinstance(parent, list):
+        if last < len(parent):
+            parent[last] = value
+        else:
+            parent.append(value)
+    elif isinstance(last, str) and isinstance(parent, dict):
+        parent[last] = value
+    else:
+        raise _validation("The document path provided in the update expression is invalid for update")
+
+
+def _remove(item: Dict, elements: tuple):
+    parent = _resolve(item, elements[:-1]) if len(elements) > 1 else item
+    last = elements[-1]
+    if isinstance(last, int) and isinstance(parent, list) and last < len(parent):
+        del parent[last]
+    elif isinstance(last, str) and isinstance(parent, dict):
+        parent.pop(last, None)
+
+
+def _apply_update(item: Dict, actions: List[tuple]) -> Dict:
+    """New item after an update; operands are evaluated against the item before the update"""
+    new_item = copy.deepcopy(item)
+    for action in actions:
+        clause, path = action[0], action[1][1]
+        if clause == 'SET':
+            _assign(new_item, path, _update_operand(action[2], item))
+        elif clause == 'REMOVE':
+            _remove(new_item, path)
+        else:
+            operand = action[2][1]
+            current = _resolve(item, path)
+            operand_type = _type_of(operand)
+            if clause == 'ADD':
+                if current is _MISSING:
+                    _assign(new_item, path, copy.deepcopy(operand))
+                elif operand_type == 'N' and _type_of(current) == 'N':
+                    _assign(new_item, path, current + operand)
+                elif operand_type in ('SS', 'NS', 'BS') and _type_of(current) == operand_type:
+                    _assign(new_item, path, current | operand)
+                else:
+                    raise _validation("An operand in the update expression has an incorrect data type")
+            else:
+                if operand_type not in ('SS', 'NS', 'BS') or (current is not _MISSING and _type_of(current) != operand_type):
+                    raise _validation("An operand in the update expression has an incorrect data type")
+                if current is not _MISSING:
+                    remaining = current - operand
+                    if remaining:
+                        _assign(new_item, path, remaining)
+                    else:
+                        _remove(new_item, path)
+    return new_item
+
+
+def _project(item: Dict, paths: Optional[List[tuple]]) -> Dict:
+    if paths is None:
+        return copy.deepcopy(item)
+    projected = {}
+    for _, elements in paths:
+        value = _resolve(item, elements)
+        if value is _MISSING:
+            continue
+        target = projected
+        for position, element in enumerate(elements[:-1]):
+            container = [] if isinstance(elements[position + 1], int) else {}
+            if isinstance(target, list):
+                target.append(container)
+                target = container
+            else:
+                target = target.setdefault(element, container)
+        if isinstance(target, list):
+            target.append(copy.deepcopy(value))
+        else:
+            target[elements[-1]] = copy.deepcopy(value)
+    return projected
+
+
+# ==================== TABLES ====================
+
+class MemoryTable:
+    """Items, key schema and global secondary indexes of one in-memory table"""
+
+    def __init__(self, name: str, key_schema: List[Dict], attribute_definitions: List[Dict],
+                 global_secondary_indexes: Optional[List[Dict]] = None):
+        self.name = name
+        self.key_schema = key_schema
+        self.attribute_definitions = attribute_definitions
+        self.global_secondary_indexes = global_secondary_indexes or []
+        self.attribute_types = {a['AttributeName']: a['AttributeType'] for a in attribute_definitions}
+        self.hash_key, self.range_key = self._parse(key_schema)
+        self.indexes = {index['IndexName']: self._parse(index['KeySchema']) for index in self.global_secondary_indexes}
+        self.items = {}  # primary key tuple -> item
+        self._ordered = {}  # index name (None for the table) -> (order keys, items), rebuilt after writes
+
+    @staticmethod
+    def _parse(key_schema: List[Dict]) -> tuple:
+        hash_key = next(k['AttributeName'] for k in key_schema if k['KeyType'] == 'HASH')
+        range_key = next((k['AttributeName'] for k in key_schema if k['KeyType'] == 'RANGE'), None)
+        return hash_key, range_key
+
+    def key_attributes(self, index_name: Optional[str] = None) -> List[str]:
+        hash_key, range_key = self.indexes[index_name] if index_name else (self.hash_key, self.range_key)
+        return [k for k in (hash_key, range_key) if k]
+
+    def describe(self) -> Dict:
+        size = sum(_item_size(item) for item in self.items.values())
+        description = {
+            'TableName': self.name,
+            'TableStatus': 'ACTIVE',
+            'KeySchema': self.key_schema,
+            'AttributeDefinitions': self.attribute_definitions,
+            'ItemCount': len(self.items),
+            'TableSizeBytes': size,
+            'BillingModeSummary': {'BillingMode': 'PAY_PER_REQUEST'},
+        }
+        if self.global_secondary_indexes:
+            description['GlobalSecondaryIndexes'] = [
+                dict(index, IndexStatus='ACTIVE', Projection=index.get('Projection', {'ProjectionType': 'ALL'}),
+                     ItemCount=sum(1 for item in self.items.values() if self.in_index(item, index['IndexName'])))
+                for index in self.global_secondary_indexes
+            ]
+        return description
+
+    def _check_key_value(self, attribute: str, value: Any, role: str):
+        expected = self.attribute_types.get(attribute, 'S')
+        if _type_of(value) != expected:
+            raise _validation(f"One or more parameter values were invalid: Type mismatch for {role} key {attribute} expected: {expected} actual: {_type_of(value)}")
+        if expected in ('S', 'B') and len(_scalar(value)) == 0:
+            raise _validation(f"One or more parameter values are not valid. The AttributeValue for a key attribute cannot contain an empty string value. Key: {attribute}")
+
+    def key_tuple(self, key: Dict, exact: bool = True) -> tuple:
+        """Primary key of a Key dict (exact=True rejects extra attributes) or of an item"""
+        attributes = self.key_attributes()
+        if exact and set(key) != set(attributes):
+            raise _validation("The provided key element does not match the schema")
+        for attribute in attributes:
+            if attribute not in key:
+                raise _validation(f"One or more parameter values were invalid: Missing the key {attribute} in the item")
+            self._check_key_value(attribute, key[attribute], 'primary')
+        return tuple(key[attribute] for attribute in attributes)
+
+    def validate_item(self, item: Dict) -> tuple:
+        key = self.key_tuple(item, exact=False)
+        for index_name, (hash_key, range_key) in self.indexes.items():
+            for attribute in (hash_key, range_key):
+                if attribute and attribute in item:
+                    self._check_key_value(attribute, item[attribute], 'index')
+        if _item_size(item) > MAX_ITEM_BYTES:
+            raise _validation("Item size has exceeded the maximum allowed size")
+        return key
+
+    def key_of(self, item: Dict, index_name: Optional[str] = None) -> Dict:
+        """Key attributes of an item as returned in LastEvaluatedKey"""
+        attributes = self.key_attributes()
+        if index_name:
+            attributes = self.key_attributes(index_name) + [a for a in attributes if a not in self.key_attributes(index_name)]
+        return {attribute: copy.deepcopy(item[attribute]) for attribute in attributes}
+
+    def in_index(self, item: Dict, index_name: str) -> bool:
+        return all(attribute in item for attribute in self.key_attributes(index_name))
+
+    def put(self, item: Dict) -> Optional[Dict]:
+        key = self.validate_item(item)
+        old = self.items.get(key)
+        self.items[key] = item
+        self._ordered.clear()
+        return old
+
+    def delete(self, key: tuple) -> Optional[Dict]:
+        old = self.items.pop(key, None)
+        if old is not None:
+            self._ordered.clear()
+        return old
+
+    def order_key(self, item: Dict, index_name: Optional[str] = None) -> tuple:
+        """Position of an item (or LastEvaluatedKey) in scan/query order"""
+        parts = []
+        if index_name:
+            hash_key, range_key = self.indexes[index_name]
+            parts += [_partition_token(item[hash_key]), _sort_component(item.get(range_key) if range_key else None)]
+        parts += [_partition_token(item[self.hash_key]),
+                  _sort_component(item.get(self.range_key) if self.range_key else None)]
+        return tuple(parts)
+
+    def ordered(self, index_name: Optional[str] = None) -> tuple:
+        """(order keys, items) of the table or index in DynamoDB read order"""
+        if index_name not in self._ordered:
+            if index_name and index_name not in self.indexes:
+                raise _validation(f"The table does not have the specified index: {index_name}")
+            entries = sorted(
+                ((self.order_key(item, index_name), item) for item in self.items.values()
+                 if index_name is None or self.in_index(item, index_name)),
+                key=lambda entry: entry[0]
+            )
+            self._ordered[index_name] = ([entry[0] for entry in entries], [entry[1] for entry in entries])
+        return self._ordered[index_name]
+
+
+# ==================== ENGINE ====================
+
+class InMemoryDynamoDB:
+    """
+    The simulated service: tables, request execution, capacity accounting and
+    fault injection.
+
+    page_size_bytes: data read per Query/Scan page (DynamoDB: 1MB); lower it to
+                     exercise pagination with small fixtures
+    latency:         seconds added to every request attempt (a float, or a
+                     callable(operation) -> seconds)
+    throttle_rate:   probability that a request attempt (or an item of a batch)
+                     is throttled, decided by a Random seeded with `seed`
+    throttle_tables: table names subject to throttling (None for all)
+    streams:         record a DynamoDB Streams record of every write (see
+                     streams_client())
+    """
+
+    def __init__(self, page_size_bytes: int = PAGE_SIZE_BYTES, latency: Any = 0.0,
+                 throttle_rate: float = 0.0, throttle_tables: Optional[List[str]] = None, seed: int = 0,
+                 streams: bool = False):
+        self.tables = {}
+        self.page_size_bytes = page_size_bytes
+        self.latency = latency
+        self.throttle_rate = throttle_rate
+        self.throttle_tables = set(throttle_tables) if throttle_tables else None
+        self.random = random.Random(seed)
+        self.request_counts = Counter()
+        self.throttled_counts = Counter()
+        self._consumed = {}
+        self.streams = streams
+        self.stream_records = {}  # table name -> Streams records in write order
+        self._stream_sequence = 0
+
+    @classmethod
+    def from_table_definitions(cls, path: Optional[Any] = None, **options) -> 'InMemoryDynamoDB':
+        """Engine with the tables of dynamodb-tables.json (simple tables keyed by 'id')"""
+        engine = cls(**options)
+        engine.load_table_definitions(path)
+        return engine
+
+    def load_table_definitions(self, path: Optional[Any] = None):
+        for definition in load_table_definitions(path or ROOT_DIR / 'dynamodb-tables.json').values():
+            self.create_table(**definition)
+
+    def create_table(self, TableName: str, KeySchema: List[Dict], AttributeDefinitions: List[Dict],
+                     GlobalSecondaryIndexes: Optional[List[Dict]] = None, **_) -> MemoryTable:
+        table = MemoryTable(TableName, KeySchema, AttributeDefinitions, GlobalSecondaryIndexes)
+        self.tables[TableName] = table
+        return table
+
+    def table(self, table_name: str) -> MemoryTable:
+        table = self.tables.get(table_name)
+        if table is None:
+            raise _DynamoError('ResourceNotFoundException', f"Requested resource not found: Table: {table_name} not found")
+        return table
+
+    # Fixtures
+
+    def load_documents(self, collection_name: str, documents: List[Dict]) -> int:
+        """
+        Put exported MongoDB documents (extended JSON or BSON-decoded) into the
+        collection's table; _id becomes the hash key when the document lacks one.
+        Null or empty index key attributes, which DynamoDB rejects, are left out
+        so the item is simply absent from that (sparse) index.
+        """
+        table = self.table(collection_table_name(collection_name))
+        index_attributes = {a for name in table.indexes for a in table.key_attributes(name)}
+        for document in documents:
+            item = to_dynamodb_value(_from_extended_json(document))
+            object_id = item.pop('_id', None)
+            if table.hash_key not in item and object_id is not None:
+                item[table.hash_key] = str(object_id)
+            for attribute in index_attributes:
+                if item.get(attribute, _MISSING) in (None, ''):
+                    del item[attribute]
+            table.put(_normalize(item))
+        return len(documents)
+
+    def load_json_fixtures(self, directory: Optional[Any] = None, database: str = 'arbrit-workdesk') -> Dict[str, int]:
+        """Load mongoexport files <database>.<collection>.json (default: Json/)"""
+        loaded = {}
+        for path in sorted(Path(directory or ROOT_DIR / 'Json').glob(f'{database}.*.json')):
+            with open(path) as f:
+                documents = json.load(f)
+            collection_name = path.stem.split('.', 1)[1]
+            loaded[collection_name] = self.load_documents(collection_name, documents)
+        return loaded
+
+    def load_dump(self, directory: Optional[Any] = None, database: str = 'arbrit_training') -> Dict[str, int]:
+        """Load mongodump BSON files <directory>/<database>/<collection>.bson (default: dump/)"""
+        loaded = {}
+        for path in sorted((Path(directory or ROOT_DIR / 'dump') / database).glob('*.bson')):
+            if collection_table_name(path.stem) not in self.tables:
+                continue
+            loaded[path.stem] = self.load_documents(path.stem, _read_bson(path.read_bytes()))
+        return loaded
+
+    # Metrics
+
+    def consumed_capacity(self) -> Dict[str, Dict]:
+        """Read/write capacity units consumed so far, per table and per GSI"""
+        return copy.deepcopy(self._consumed)
+
+    def reset_metrics(self):
+        self._consumed = {}
+        self.request_counts.clear()
+        self.throttled_counts.clear()
+
+    def _charge(self, table_name: str, kind: str, units: float, index_name: Optional[str] = None,
+                consumed: Optional[Dict] = None):
+        totals = self._consumed.setdefault(table_name, {'read': 0.0, 'write': 0.0, 'indexes': {}})
+        target = totals if index_name is None else totals['indexes'].setdefault(index_name, {'read': 0.0, 'write': 0.0})
+        target[kind] += units
+        if consumed is not None:
+            entry = consumed.setdefault(table_name, {'TableName': table_name, 'CapacityUnits': 0.0,
+                                                     'Table': {'CapacityUnits': 0.0}})
+            entry['CapacityUnits'] += units
+            entry[f"{'Read' if kind == 'read' else 'Write'}CapacityUnits"] = entry.get(
+                f"{'Read' if kind == 'read' else 'Write'}CapacityUnits", 0.0) + units
+            if index_name is None:
+                entry['Table']['CapacityUnits'] += units
+            else:
+                indexes = entry.setdefault('GlobalSecondaryIndexes', {})
+                indexes.setdefault(index_name, {'CapacityUnits': 0.0})['CapacityUnits'] += units
+
+    def _charge_write(self, table: MemoryTable, old: Optional[Dict], new: Optional[Dict],
+                      consumed: Optional[Dict], multiplier: float = 1.0):
+        size = max(_item_size(old) if old else 0, _item_size(new) if new else 0)
+        units = max(1, math.ceil(size / WRITE_UNIT_BYTES)) * multiplier
+        self._charge(table.name, 'write', units, consumed=consumed)
+        for index_name in table.indexes:
+            if (old and table.in_index(old, index_name)) or (new and table.in_index(new, index_name)):
+                self._charge(table.name, 'write', units, index_name, consumed)
+
+    @staticmethod
+    def _read_units(size: int, consistent: bool) -> float:
+        return max(1, math.ceil(size / READ_UNIT_BYTES)) * (1.0 if consistent else 0.5)
+
+    @staticmethod
+    def _capacity_response(params: Dict, consumed: Dict) -> Dict:
+        mode = params.get('ReturnConsumedCapacity', 'NONE')
+        if mode not in ('TOTAL', 'INDEXES') or not consumed:
+            return {}
+        entries = []
+        for entry in consumed.values():
+            if mode == 'TOTAL':
+                entry = {k: v for k, v in entry.items() if k not in ('Table', 'GlobalSecondaryIndexes')}
+            entries.append(entry)
+        return {'ConsumedCapacity': entries}
+
+    # Fault injection
+
+    async def delay(self, operation: str):
+        latency = self.latency(operation) if callable(self.latency) else self.latency
+        if latency:
+            await asyncio.sleep(latency)
+        else:
+            # Still yield, like any network call would
+            await asyncio.sleep(0)
+
+    def _throttled(self, table_name: str) -> bool:
+        if not self.throttle_rate or (self.throttle_tables is not None and table_name not in self.throttle_tables):
+            return False
+        if self.random.random() < self.throttle_rate:
+            self.throttled_counts[table_name] += 1
+            return True
+        return False
+
+    def _check_throttle(self, table_name: str):
+        if self._throttled(table_name):
+            raise _DynamoError('ProvisionedThroughputExceededException',
+                               "The level of configured provisioned throughput for the table was exceeded. "
+                               "Consider increasing your provisioning level with the UpdateTable API.")
+
+    # Requests
+
+    def execute(self, operation: str, params: Dict) -> Dict:
+        """Run one request (Python values, expressions as strings) and return its response"""
+        self.request_counts[operation] += 1
+        handler = {
+            'GetItem': self._get_item,
+            'PutItem': self._put_item,
+            'UpdateItem': self._update_item,
+            'DeleteItem': self._delete_item,
+            'Query': self._query,
+            'Scan': self._scan,
+            'BatchGetItem': self._batch_get_item,
+            'BatchWriteItem': self._batch_write_item,
+            'TransactWriteItems': self._transact_write_items,
+            'DescribeTable': self._describe_table,
+            'ListTables': self._list_tables,
+        }.get(operation)
+        if handler is None:
+            raise _validation(f"Operation {operation} is not supported by the in-memory engine")
+        response = handler(params)
+        consumed = response.get('ConsumedCapacity')
+        if consumed and operation not in ('BatchGetItem', 'BatchWriteItem', 'TransactWriteItems'):
+            # Single-table operations return one ConsumedCapacity, not a list
+            response['ConsumedCapacity'] = consumed[0]
+        return response
+
+    def _describe_table(self, params: Dict) -> Dict:
+        description = self.table(params['TableName']).describe()
+        if self.streams:
+            description['StreamSpecification'] = {'StreamEnabled': True, 'StreamViewType': CHANGE_STREAM_VIEW_TYPE}
+            description['LatestStreamLabel'] = STREAM_LABEL
+            description['LatestStreamArn'] = _stream_arn(description['TableName'], STREAM_LABEL)
+        return {'Table': description}
+
+    def _list_tables(self, params: Dict) -> Dict:
+        names = sorted(self.tables)
+        start = params.get('ExclusiveStartTableName')
+        if start:
+            names = [name for name in names if name > start]
+        limit = params.get('Limit', 100)
+        response = {'TableNames': names[:limit]}
+        if len(names) > limit:
+            response['LastEvaluatedTableName'] = names[limit - 1]
+        return response
+
+    @staticmethod
+    def _projection(params: Dict, expressions: _Expressions) -> Optional[List[tuple]]:
+        if params.get('ProjectionExpression'):
+            return expressions.projection(params['ProjectionExpression'])
+        return None
+
+    def _check_condition(self, params: Dict, expressions: _Expressions, existing: Optional[Dict], node=None):
+        if node is None and params.get('ConditionExpression'):
+            node = expressions.condition(params['ConditionExpression'])
+        if node is not None and not _evaluate(node, existing or {}):
+            extra = {}
+            if params.get('ReturnValuesOnConditionCheckFailure') == 'ALL_OLD' and existing:
+                extra['Item'] = copy.deepcopy(existing)
+            raise _DynamoError('ConditionalCheckFailedException', "The conditional request failed", **extra)
+
+    def _get_item(self, params: Dict) -> Dict:
+        table = self.table(params['TableName'])
+        self._check_throttle(table.name)
+        expressions = _Expressions(params.get('ExpressionAttributeNames'))
+        projection = self._projection(params, expressions)
+        expressions.check_unused()
+        item = table.items.get(table.key_tuple(params['Key']))
+        consumed = {}
+        consistent = params.get('ConsistentRead', False)
+        self._charge(table.name, 'read', self._read_units(_item_size(item) if item else 0, consistent), consumed=consumed)
+        response = self._capacity_response(params, consumed)
+        if item is not None:
+            response['Item'] = _project(item, projection)
+        return response
+
+    def _put_item(self, params: Dict, consumed: Optional[Dict] = None, multiplier: float = 1.0) -> Dict:
+        table = self.table(params['TableName'])
+        if consumed is None:
+            self._check_throttle(table.name)
+        consumed = {} if consumed is None else consumed
+        item = copy.deepcopy(params['Item'])
+        key = table.validate_item(item)
+        expressions = _Expressions(params.get('ExpressionAttributeNames'), params.get('ExpressionAttributeValues'))
+        existing = table.items.get(key)
+        self._check_condition(params, expressions, existing)
+        expressions.check_unused()
+        table.put(item)
+        self._record_change(table, existing, item)
+        self._charge_write(table, existing, item, consumed, multiplier)
+        response = self._capacity_response(params, consumed)
+        if params.get('ReturnValues') == 'ALL_OLD' and existing is not None:
+            response['Attributes'] = copy.deepcopy(existing)
+        return response
+
+    def _update_item(self, params: Dict, consumed: Optional[Dict] = None, multiplier: float = 1.0) -> Dict:
+        table = self.table(params['TableName'])
+        if consumed is None:
+            self._check_throttle(table.name)
+        consumed = {} if consumed is None else consumed
+        key = table.key_tuple(params['Key'])
+        expressions = _Expressions(params.get('ExpressionAttributeNames'), params.get('ExpressionAttributeValues'))
+        actions = expressions.update(params['UpdateExpression']) if params.get('UpdateExpression') else []
+        existing = table.items.get(key)
+        self._check_condition(params, expressions, existing)
+        expressions.check_unused()
+
+        updated = self._check_updated_attributes(table, actions)
+        base = copy.deepcopy(existing) if existing is not None else copy.deepcopy(params['Key'])
+        item = _apply_update(base, actions)
+        table.put(item)
+        self._record_change(table, existing, item)
+        self._charge_write(table, existing, item, consumed, multiplier)
+
+        response = self._capacity_response(params, consumed)
+        return_values = params.get('ReturnValues', 'NONE')
+        if return_values == 'ALL_NEW':
+            response['Attributes'] = copy.deepcopy(item)
+        elif return_values == 'ALL_OLD' and existing is not None:
+            response['Attributes'] = copy.deepcopy(existing)
+        elif return_values in ('UPDATED_NEW', 'UPDATED_OLD'):
+            source = item if return_values == 'UPDATED_NEW' else (existing or {})
+            attributes = {k: copy.deepcopy(source[k]) for k in updated if k in source}
+            if attributes:
+                response['Attributes'] = attributes
+        return response
+
+    @staticmethod
+    def _check_updated_attributes(table: MemoryTable, actions: List[tuple]) -> set:
+        """Top-level attributes an update writes; key attributes cannot be updated"""
+        updated = {action[1][1][0] for action in actions}
+        for attribute in updated & set(table.key_attributes()):
+            raise _validation(f"One or more parameter values were invalid: Cannot update attribute {attribute}. "
+                              f"This attribute is part of the key")
+        return updated
+
+    def _delete_item(self, params: Dict, consumed: Optional[Dict] = None, multiplier: float = 1.0) -> Dict:
+        table = self.table(params['TableName'])
+        if consumed is None:
+            self._check_throttle(table.name)
+        consumed = {} if consumed is None else consumed
+        key = table.key_tuple(params['Key'])
+        expressions = _Expressions(params.get('ExpressionAttributeNames'), params.get('ExpressionAttributeValues'))
+        existing = table.items.get(key)
+        self._check_condition(params, expressions, existing)
+        expressions.check_unused()
+        table.delete(key)
+        self._record_change(table, existing, None)
+        self._charge_write(table, existing, None, consumed, multiplier)
+        response = self._capacity_response(params, consumed)
+        if params.get('ReturnValues') == 'ALL_OLD' and existing is not None:
+            response['Attributes'] = copy.deepcopy(existing)
+        return response
+
+    def _query(self, params: Dict) -> Dict:
+        table = self.table(params['TableName'])
+        self._check_throttle(table.name)
+        index_name = params.get('IndexName')
+        expressions = _Expressions(params.get('ExpressionAttributeNames'), params.get('ExpressionAttributeValues'))
+        if not params.get('KeyConditionExpression'):
+            raise _validation("Either the KeyConditions or KeyConditionExpression parameter must be specified in the request.")
+        key_condition = expressions.condition(params['KeyConditionExpression'])
+        hash_key, range_key = table.indexes[index_name] if index_name else (table.hash_key, table.range_key)
+        if index_name and index_name not in table.indexes:
+            raise _validation(f"The table does not have the specified index: {index_name}")
+        hash_value = self._key_condition_hash(key_condition, hash_key, range_key)
+
+        order_keys, items = table.ordered(index_name)
+        token = _partition_token(hash_value)
+        start = bisect.bisect_left(order_keys, (token,))
+        end = start
+        while end < len(order_keys) and order_keys[end][0] == token:
+            end += 1
+        candidates = [(order_keys[i], items[i]) for i in range(start, end)
+                      if _equal(items[i][hash_key], hash_value) and _evaluate(key_condition, items[i])]
+        forward = params.get('ScanIndexForward', True)
+        if not forward:
+            candidates.reverse()
+        exclusive_start = params.get('ExclusiveStartKey')
+        if exclusive_start:
+            position = table.order_key(exclusive_start, index_name)
+            candidates = [entry for entry in candidates if (entry[0] > position if forward else entry[0] < position)]
+        return self._read_page(table, index_name, params, expressions, [item for _, item in candidates])
+
+    @staticmethod
+    def _key_condition_hash(node: tuple, hash_key: str, range_key: Optional[str]) -> Any:
+        """Validate a key condition and return the hash key value it pins"""
+        conditions = []
+
+        def flatten(current):
+            if current[0] == 'and':
+                flatten(current[1])
+                flatten(current[2])
+            else:
+                conditions.append(current)
+
+        flatten(node)
+        hash_value = _MISSING
+        for condition in conditions:
+            attributes = _condition_attributes(condition)
+            if (condition[0] == 'compare' and condition[1] == '=' and condition[2][0] == 'path'
+                    and condition[2][1] == (hash_key,) and condition[3][0] == 'value'):
+                hash_value = condition[3][1]
+            elif attributes != {range_key} or condition[0] in ('or', 'not', 'in') or (
+                    condition[0] == 'compare' and condition[1] == '<>') or (
+                    condition[0] == 'function' and condition[1] != 'begins_with'):
+                raise _validation("Query key condition not supported")
+        if hash_value is _MISSING:
+            raise _validation(f"Query condition missed key schema element: {hash_key}")
+        return hash_value
+
+    def _scan(self, params: Dict) -> Dict:
+        table = self.table(params['TableName'])
+        self._check_throttle(table.name)
+        index_name = params.get('IndexName')
+        expressions = _Expressions(params.get('ExpressionAttributeNames'), params.get('ExpressionAttributeValues'))
+        order_keys, items = table.ordered(index_name)
+
+        start, end = 0, len(items)
+        if 'TotalSegments' in params:
+            # Segments are contiguous ranges of the partition key hash space, as in DynamoDB
+            segment, total = params['Segment'], params['TotalSegments']
+            if not 0 <= segment < total:
+                raise _validation("The Segment parameter is zero-based and must be less than parameter TotalSegments")
+            low, high = (format(int(16 ** 32 * n / total), '032x') for n in (segment, segment + 1))
+            start = bisect.bisect_left(order_keys, (low,))
+            end = bisect.bisect_left(order_keys, (high,)) if segment + 1 < total else len(items)
+        if params.get('ExclusiveStartKey'):
+            start = max(start, bisect.bisect_right(order_keys, table.order_key(params['ExclusiveStartKey'], index_name)))
+        return self._read_page(table, index_name, params, expressions, items[start:end])
+
+    def _read_page(self, table: MemoryTable, index_name: Optional[str], params: Dict,
+                   expressions: _Expressions, candidates: List[Dict]) -> Dict:
+        """Apply Limit, the page size, the filter, Select and projection to candidate items"""
+        filter_node = expressions.condition(params['FilterExpression']) if params.get('FilterExpression') else None
+        projection = self._projection(params, expressions)
+        expressions.check_unused()
+        select = params.get('Select', 'ALL_ATTRIBUTES')
+        if select == 'COUNT' and projection is not None:
+            raise _validation("Cannot specify the ProjectionExpression when choosing to get only the Count")
+        limit = params.get('Limit')
+        if limit is not None and limit < 1:
+            raise _validation("Limit must be greater than or equal to 1")
+
+        matched = []
+        scanned = 0
+        size = 0
+        last = None
+        for item in candidates:
+            scanned += 1
+            size += _item_size(item)
+            last = item
+            if filter_node is None or _evaluate(filter_node, item):
+                matched.append(item)
+            if (limit is not None and scanned >= limit) or size >= self.page_size_bytes:
+                break
+        else:
+            last = None
+
+        consumed = {}
+        units = self._read_units(size, params.get('ConsistentRead', False))
+        self._charge(table.name, 'read', units, index_name, consumed)
+        response = {'Count': len(matched), 'ScannedCount': scanned}
+        if select != 'COUNT':
+            response['Items'] = [_project(item, projection) for item in matched]
+        if last is not None:
+            response['LastEvaluatedKey'] = table.key_of(last, index_name)
+        response.update(self._capacity_response(params, consumed))
+        return response
+
+    def _batch_get_item(self, params: Dict) -> Dict:
+        request_items = params['RequestItems']
+        total = sum(len(request['Keys']) for request in request_items.values())
+        if total > BATCH_GET_SIZE:
+            raise _validation(f"Too many items requested for the BatchGetItem call")
+        responses = {}
+        unprocessed = {}
+        consumed = {}
+        processed = 0
+        for table_name, request in request_items.items():
+            table = self.table(table_name)
+            expressions = _Expressions(request.get('ExpressionAttributeNames'))
+            projection = self._projection(request, expressions)
+            expressions.check_unused()
+            seen = set()
+            responses[table_name] = []
+            for key in request['Keys']:
+                key_tuple = table.key_tuple(key)
+                if key_tuple in seen:
+                    raise _validation("Provided list of item keys contains duplicates")
+                seen.add(key_tuple)
+                if self._throttled(table_name):
+                    unprocessed.setdefault(table_name, dict(request, Keys=[]))['Keys'].append(copy.deepcopy(key))
+                    continue
+                processed += 1
+                item = table.items.get(key_tuple)
+                units = self._read_units(_item_size(item) if item else 0, request.get('ConsistentRead', False))
+                self._charge(table_name, 'read', units, consumed=consumed)
+                if item is not None:
+                    responses[table_name].append(_project(item, projection))
+        if total and not processed:
+            self._check_throttle_all()
+        response = {'Responses': responses, 'UnprocessedKeys': unprocessed}
+        response.update(self._capacity_response(params, consumed))
+        return response
+
+    @staticmethod
+    def _check_throttle_all():
+        raise _DynamoError('ProvisionedThroughputExceededException',
+                           "Too many requests for the table; every item of the batch was throttled")
+
+    def _batch_write_item(self, params: Dict) -> Dict:
+        request_items = params['RequestItems']
+        total = sum(len(requests) for requests in request_items.values())
+        if total > BATCH_WRITE_SIZE:
+            raise _validation("Too many items requested for the BatchWriteItem call")
+
+        # Validate the whole batch before writing anything
+        for table_name, requests in request_items.items():
+            table = self.table(table_name)
+            seen = set()
+            for request in requests:
+                if 'PutRequest' in request:
+                    key = table.validate_item(request['PutRequest']['Item'])
+                else:
+                    key = table.key_tuple(request['DeleteRequest']['Key'])
+                if key in seen:
+                    raise _validation("Provided list of item keys contains duplicates")
+                seen.add(key)
+
+        unprocessed = {}
+        consumed = {}
+        processed = 0
+        for table_name, requests in request_items.items():
+            for request in requests:
+                if self._throttled(table_name):
+                    unprocessed.setdefault(table_name, []).append(copy.deepcopy(request))
+                    continue
+                processed += 1
+                if 'PutRequest' in request:
+                    self._put_item({'TableName': table_name, 'Item': request['PutRequest']['Item']}, consumed)
+                else:
+                    self._delete_item({'TableName': table_name, 'Key': request['DeleteRequest']['Key']}, consumed)
+        if total and not processed:
+            self._check_throttle_all()
+        response = {'UnprocessedItems': unprocessed}
+        response.update(self._capacity_response(params, consumed))
+        return response
+
+    def _transact_write_items(self, params: Dict) -> Dict:
+        actions = params['TransactItems']
+        if not actions or len(actions) > TRANSACT_WRITE_SIZE:
+            raise _validation(f"Member must have length less than or equal to {TRANSACT_WRITE_SIZE}")
+
+        # Check every target and condition first: all actions apply, or none
+        targets = set()
+        reasons = []
+        for action in actions:
+            (kind, request), = action.items()
+            table = self.table(request['TableName'])
+            self._check_throttle(table.name)
+            key = table.validate_item(request['Item']) if kind == 'Put' else table.key_tuple(request['Key'])
+            if (table.name, key) in targets:
+                raise _validation("Transaction request cannot include multiple operations on one item")
+            targets.add((table.name, key))
+            expressions = _Expressions(request.get('ExpressionAttributeNames'), request.get('ExpressionAttributeValues'))
+            if kind == 'Update':
+                self._check_updated_attributes(table, expressions.update(request['UpdateExpression']))
+            try:
+                self._check_condition(request, expressions, table.items.get(key))
+                if kind != 'ConditionCheck':
+                    expressions.check_unused()
+                reasons.append({'Code': 'None'})
+            except _DynamoError as e:
+                if e.code != 'ConditionalCheckFailedException':
+                    raise
+                reasons.append({'Code': 'ConditionalCheckFailed', 'Message': e.message})
+        if any(reason['Code'] != 'None' for reason in reasons):
+            codes = ', '.join(reason['Code'] for reason in reasons)
+            raise _DynamoError('TransactionCanceledException',
+                               f"Transaction cancelled, please refer cancellation reasons for specific reasons [{codes}]",
+                               CancellationReasons=reasons)
+
+        consumed = {}
+        for action in actions:
+            (kind, request), = action.items()
+            # Conditions were checked above (and still hold); a transactional write costs twice a standard one
+            if kind == 'Put':
+                self._put_item(request, consumed, 2.0)
+            elif kind == 'Update':
+                self._update_item(request, consumed, 2.0)
+            elif kind == 'Delete':
+                self._delete_item(request, consumed, 2.0)
+        return self._capacity_response(params, consumed)
+
+    # Streams
+
+    def _record_change(self, table: MemoryTable, old: Optional[Dict], new: Optional[Dict]):
+        """Append the Streams record of a write (none if it changed nothing, as DynamoDB)"""
+        if not self.streams or old == new:
+            return
+        self._stream_sequence += 1
+        stream = {
+            'ApproximateCreationDateTime': datetime.now(timezone.utc),
+            'Keys': {k: _serializer.serialize(v) for k, v in table.key_of(new if new is not None else old).items()},
+            'SequenceNumber': f"{self._stream_sequence:021d}",
+            'SizeBytes': _item_size(new or {}) + _item_size(old or {}),
+            'StreamViewType': CHANGE_STREAM_VIEW_TYPE,
+        }
+        if old is not None:
+            stream['OldImage'] = {k: _serializer.serialize(v) for k, v in old.items()}
+        if new is not None:
+            stream['NewImage'] = {k: _serializer.serialize(v) for k, v in new.items()}
+        self.stream_records.setdefault(table.name, []).append({
+            'eventID': f"{table.name}-{self._stream_sequence}",
+            'eventName': 'INSERT' if old is None else 'REMOVE' if new is None else 'MODIFY',
+            'eventVersion': '1.1',
+            'eventSource': 'aws:dynamodb',
+            'awsRegion': 'local',
+            'dynamodb': stream,
+            'eventSourceARN': _stream_arn(table.name, STREAM_LABEL),
+        })
+
+    def _stream_table(self, stream_arn: str) -> MemoryTable:
+        if not self.streams or stream_arn != _stream_arn(stream_arn.split('/')[1], STREAM_LABEL):
+            raise _DynamoError('ResourceNotFoundException', f"Requested resource not found: Stream: {stream_arn} not found")
+        return self.table(stream_arn.split('/')[1])
+
+    def _describe_stream(self, params: Dict) -> Dict:
+        table = self._stream_table(params['StreamArn'])
+        records = self.stream_records.get(table.name, [])
+        start = records[0]['dynamodb']['SequenceNumber'] if records else f"{self._stream_sequence + 1:021d}"
+        return {'StreamDescription': {
+            'StreamArn': params['StreamArn'],
+            'StreamLabel': STREAM_LABEL,
+            'StreamStatus': 'ENABLED',
+            'StreamViewType': CHANGE_STREAM_VIEW_TYPE,
+            'TableName': table.name,
+            'KeySchema': table.key_schema,
+            'Shards': [{'ShardId': STREAM_SHARD_ID, 'SequenceNumberRange': {'StartingSequenceNumber': start}}],
+        }}
+
+    def _get_shard_iterator(self, params: Dict) -> Dict:
+        table = self._stream_table(params['StreamArn'])
+        if params['ShardId'] != STREAM_SHARD_ID:
+            raise _DynamoError('ResourceNotFoundException', f"Requested resource not found: Shard: {params['ShardId']} not found")
+        records = self.stream_records.get(table.name, [])
+        iterator_type = params['ShardIteratorType']
+        if iterator_type == 'TRIM_HORIZON':
+            position = 0
+        elif iterator_type == 'LATEST':
+            position = len(records)
+        elif iterator_type in ('AT_SEQUENCE_NUMBER', 'AFTER_SEQUENCE_NUMBER'):
+            sequence_numbers = [int(record['dynamodb']['SequenceNumber']) for record in records]
+            find = bisect.bisect_left if iterator_type == 'AT_SEQUENCE_NUMBER' else bisect.bisect_right
+            position = find(sequence_numbers, int(params['SequenceNumber']))
+        else:
+            raise _validation(f"Invalid ShardIteratorType: {iterator_type}")
+        return {'ShardIterator': f"{params['StreamArn']}|{position}"}
+
+    def _get_records(self, params: Dict) -> Dict:
+        stream_arn, _, position = params['ShardIterator'].rpartition('|')
+        table = self._stream_table(stream_arn)
+        records = self.stream_records.get(table.name, [])
+        start = int(position)
+        end = min(len(records), start + params.get('Limit', 1000))
+        return {'Records': copy.deepcopy(records[start:end]), 'NextShardIterator': f"{stream_arn}|{end}"}
+
+    # Facades
+
+    def streams_client(self) -> 'InMemoryStreamsClient':
+        """Stand-in for session.client('dynamodbstreams') over the recorded stream records"""
+        return InMemoryStreamsClient(self)
+
+    def client(self, max_attempts: int = 10) -> 'InMemoryClient':
+        """Low-level client facade (AttributeValue requests and responses)"""
+        return InMemoryClient(self, max_attempts)
+
+    def resource(self, max_attempts: int = 10) -> 'InMemoryResource':
+        """Resource facade (Table objects, Python values, boto3 conditions)"""
+        return InMemoryResource(self, max_attempts)
+
+
+# ==================== FACADES ====================
+
+# Request/response members holding attribute maps, and lists or tables of them
+_MAP_MEMBERS = {'Key', 'Item', 'ExclusiveStartKey', 'LastEvaluatedKey', 'Attributes', 'ExpressionAttributeValues'}
+_LIST_MEMBERS = {'Items', 'Keys'}
+
+
+def _convert_maps(value: Any, convert, member: Optional[str] = None) -> Any:
+    """Apply convert to every attribute value inside a request or response"""
+    if member in _MAP_MEMBERS and isinstance(value, dict):
+        return {k: convert(v) for k, v in value.items()}
+    if member in _LIST_MEMBERS and isinstance(value, list):
+        return [{k: convert(v) for k, v in item.items()} for item in value]
+    if member == 'Responses' and isinstance(value, dict):
+        return {table: [{k: convert(v) for k, v in item.items()} for item in items] for table, items in value.items()}
+    if isinstance(value, dict):
+        return {k: _convert_maps(v, convert, k) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_convert_maps(v, convert) for v in value]
+    return value
+
+
+class _Events:
+    """Minimal stand-in for botocore's event emitter (register/emit by event name prefix)"""
+
+    def __init__(self):
+        self._handlers = []
+
+    def register(self, event_name: str, handler, **kwargs):
+        self._handlers.append((event_name, handler))
+
+    def emit(self, event_name: str, **kwargs):
+        for name, handler in self._handlers:
+            if event_name == name or event_name.startswith(name + '.'):
+                handler(event_name=event_name, **kwargs)
+
+
+class _Meta:
+    def __init__(self, events: Optional[_Events] = None, client: Any = None):
+        self.events = events
+        self.client = client
+
+
+class InMemoryClient:
+    """
+    Client facade over an InMemoryDynamoDB engine. raw=True speaks AttributeValues
+    like session.client('dynamodb'); raw=False takes and returns Python values
+    and boto3 conditions like resource.meta.client. Throttled attempts are
+    retried with jittered backoff up to max_attempts, emitting needs-retry.
+    """
+
+    def __init__(self, engine: InMemoryDynamoDB, max_attempts: int = 10, raw: bool = True):
+        self.engine = engine
+        self.max_attempts = max_attempts
+        self.raw = raw
+        self.meta = _Meta(_Events())
+
+    def _decode(self, params: Dict) -> Dict:
+        if self.raw:
+            return _convert_maps(params, _deserializer.deserialize)
+        params = _convert_maps(params, lambda value: _normalize({'v': value})['v'])
+        builder = ConditionExpressionBuilder()
+        for member in ('KeyConditionExpression', 'FilterExpression', 'ConditionExpression'):
+            condition = params.get(member)
+            if isinstance(condition, ConditionBase):
+                built = builder.build_expression(condition, is_key_condition=member == 'KeyConditionExpression')
+                params[member] = built.condition_expression
+                params['ExpressionAttributeNames'] = dict(params.get('ExpressionAttributeNames', {}),
+                                                          **built.attribute_name_placeholders)
+                values = _normalize(built.attribute_value_placeholders)
+                params['ExpressionAttributeValues'] = dict(params.get('ExpressionAttributeValues', {}), **values)
+        return params
+
+    def _encode(self, response: Dict) -> Dict:
+        if self.raw:
+            return _convert_maps(response, _serializer.serialize)
+        return response
+
+    async def _call(self, operation: str, params: Dict) -> Dict:
+        params = self._decode(params)
+        attempts = 0
+        while True:
+            await self.engine.delay(operation)
+            try:
+                response = self.engine.execute(operation, copy.deepcopy(params))
+            except _DynamoError as e:
+                error = {'Error': {'Code': e.code, 'Message': e.message},
+                         'ResponseMetadata': {'HTTPStatusCode': 400, 'RetryAttempts': attempts}}
+                error.update(self._encode(e.extra))
+                self.meta.events.emit(f'needs-retry.dynamodb.{operation}', response=(None, error),
+                                      attempts=attempts + 1, operation=operation)
+                if e.code in _RETRYABLE_ERRORS and attempts + 1 < self.max_attempts:
+                    await _backoff(attempts)
+                    attempts += 1
+                    continue
+                raise ClientError(error, operation)
+            response['ResponseMetadata'] = {'HTTPStatusCode': 200, 'RetryAttempts': attempts}
+            self.meta.events.emit(f'needs-retry.dynamodb.{operation}', response=(None, response),
+                                  attempts=attempts + 1, operation=operation)
+            return self._encode(response)
+
+    async def get_item(self, **params):
+        return await self._call('GetItem', params)
+
+    async def put_item(self, **params):
+        return await self._call('PutItem', params)
+
+    async def update_item(self, **params):
+        return await self._call('UpdateItem', params)
+
+    async def delete_item(self, **params):
+        return await self._call('DeleteItem', params)
+
+    async def query(self, **params):
+        return await self._call('Query', params)
+
+    async def scan(self, **params):
+        return await self._call('Scan', params)
+
+    async def batch_get_item(self, **params):
+        return await self._call('BatchGetItem', params)
+
+    async def batch_write_item(self, **params):
+        return await self._call('BatchWriteItem', params)
+
+    async def transact_write_items(self, **params):
+        return await self._call('TransactWriteItems', params)
+
+    async def describe_table(self, **params):
+        return await self._call('DescribeTable', params)
+
+    async def list_tables(self, **params):
+        return await self._call('ListTables', params)
+
+
+class InMemoryStreamsClient:
+    """DynamoDB Streams client facade (AttributeValue records) over an InMemoryDynamoDB engine with streams=True"""
+
+    def __init__(self, engine: InMemoryDynamoDB):
+        self.engine = engine
+
+    def _call(self, operation: str, handler, params: Dict) -> Dict:
+        try:
+            response = handler(params)
+        except _DynamoError as e:
+            raise ClientError({'Error': {'Code': e.code, 'Message': e.message},
+                               'ResponseMetadata': {'HTTPStatusCode': 400}}, operation)
+        response['ResponseMetadata'] = {'HTTPStatusCode': 200}
+        return response
+
+    async def describe_stream(self, **params):
+        return self._call('DescribeStream', self.engine._describe_stream, params)
+
+    async def get_shard_iterator(self, **params):
+        return self._call('GetShardIterator', self.engine._get_shard_iterator, params)
+
+    async def get_records(self, **params):
+        return self._call('GetRecords', self.engine._get_records, params)
+
+
+class InMemoryTable:
+    """Table resource facade: the item operations of one table, with Python values"""
+
+    def __init__(self, client: InMemoryClient, name: str):
+        self.meta = _Meta(client=client)
+        self.name = name
+        self.table_name = name
+
+    async def get_item(self, **params):
+        return await self.meta.client.get_item(TableName=self.name, **params)
+
+    async def put_item(self, **params):
+        return await self.meta.client.put_item(TableName=self.name, **params)
+
+    async def update_item(self, **params):
+        return await self.meta.client.update_item(TableName=self.name, **params)
+
+    async def delete_item(self, **params):
+        return await self.meta.client.delete_item(TableName=self.name, **params)
+
+    async def query(self, **params):
+        return await self.meta.client.query(TableName=self.name, **params)
+
+    async def scan(self, **params):
+        return await self.meta.client.scan(TableName=self.name, **params)
+
+
+class InMemoryResource:
+    """Resource facade, like session.resource('dynamodb')"""
+
+    def __init__(self, engine: InMemoryDynamoDB, max_attempts: int = 10):
+        self.meta = _Meta(client=InMemoryClient(engine, max_attempts, raw=False))
+
+    async def Table(self, name: str) -> InMemoryTable:
+        return InMemoryTable(self.meta.client, name)
+
+    async def batch_get_item(self, **params):
+        return await self.meta.client.batch_get_item(**params)
+
+    async def batch_write_item(self, **params):
+        return await self.meta.client.batch_write_item(**params)
+
+
+class InMemoryDynamoDBDatabase(DynamoDBDatabase):
+    """
+    DynamoDBDatabase backed by an InMemoryDynamoDB engine instead of AWS.
+    Every collection, cursor, cache, counter and metric of the layer works
+    unchanged; the engine defaults to the tables of dynamodb-tables.json.
+    """
+
+    def __init__(self, engine: Optional[InMemoryDynamoDB] = None, **kwargs):
+        super().__init__(**kwargs)
+        self.engine = engine or InMemoryDynamoDB.from_table_definitions()
+
+    async def connect(self):
+        """Attach the engine's client and resource facades (idempotent)"""
+        if self._resource is None:
+            self._client = self.engine.client(self.max_attempts)
+            self._resource = self.engine.resource(self.max_attempts)
+            for client in (self._client, self._resource.meta.client):
+                client.meta.events.register('needs-retry.dynamodb', self._on_needs_retry)
+        return self._resource
+
+    async def close(self):
+        """Detach from the engine (its data is kept)"""
+        await self.changes.close()
+        self._resource = None
+        self._client = None
+        self._tables = {}
+
+
+# ==================== FIXTURES ====================
+
+def _from_extended_json(value: Any) -> Any:
+    """MongoDB extended JSON ($oid, $date, $numberLong, ...) to plain Python values"""
+    if isinstance(value, dict):
+        if len(value) == 1:
+            (tag, inner), = value.items()
+            if tag == '$oid':
+                return inner
+            if tag == '$date':
+                if isinstance(inner, dict):
+                    milliseconds = int(_from_extended_json(inner))
+                    return datetime(1970, 1, 1, tzinfo=timezone.utc) + timedelta(milliseconds=milliseconds)
+                return inner
+            if tag in ('$numberInt', '$numberLong'):
+                return int(inner)
+            if tag in ('$numberDouble', '$numberDecimal'):
+                return Decimal(inner)
+        return {k: _from_extended_json(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_from_extended_json(v) for v in value]
+    return value
+
+
+def _read_bson(data: bytes) -> List[Dict]:
+    """Decode a mongodump .bson file (concatenated BSON documents)"""
+    documents = []
+    offset = 0
+    while offset < len(data):
+        length, = struct.unpack_from('<i', data, offset)
+        documents.append(_bson_document(data, offset + 4, offset + length - 1))
+        offset += length
+    return documents
+
+
+def _bson_document(data: bytes, start: int, end: int, as_list: bool = False) -> Any:
+    document = {}
+    position = start
+    while position < end:
+        element_type = data[position]
+        name_end = data.index(b'\x00', position + 1)
+        name = data[position + 1:name_end].decode('utf-8')
+        document[name], position = _bson_value(data, element_type, name_end + 1)
+    return list(document.values()) if as_list else document
+
+
+def _bson_value(data: bytes, element_type: int, position: int) -> tuple:
+    """(value, next position) of one BSON element"""
+    if element_type == 0x01:
+        return Decimal(repr(struct.unpack_from('<d', data, position)[0])), position + 8
+    if element_type in (0x02, 0x0D, 0x0E):
+        length, = struct.unpack_from('<i', data, position)
+        return data[position + 4:position + 3 + length].decode('utf-8'), position + 4 + length
+    if element_type in (0x03, 0x04):
+        length, = struct.unpack_from('<i', data, position)
+        return _bson_document(data, position + 4, position + length - 1, element_type == 0x04), position + length
+    if element_type == 0x05:
+        length, = struct.unpack_from('<i', data, position)
+        return bytes(data[position + 5:position + 5 + length]), position + 5 + length
+    if element_type == 0x07:
+        return data[position:position + 12].hex(), position + 12
+    if element_type == 0x08:
+        return data[position] != 0, position + 1
+    if element_type == 0x09:
+        milliseconds, = struct.unpack_from('<q', data, position)
+        return datetime(1970, 1, 1, tzinfo=timezone.utc) + timedelta(milliseconds=milliseconds), position + 8
+    if element_type in (0x06, 0x0A, 0x7F, 0xFF):
+        return None, position
+    if element_type == 0x0B:
+        pattern_end = data.index(b'\x00', position)
+        options_end = data.index(b'\x00', pattern_end + 1)
+        return data[position:pattern_end].decode('utf-8'), options_end + 1
+    if element_type == 0x10:
+        return struct.unpack_from('<i', data, position)[0], position + 4
+    if element_type in (0x11, 0x12):
+        return struct.unpack_from('<q' if element_type == 0x12 else '<Q', data, position)[0], position + 8
+    raise ValueError(f"Unsupported BSON element type 0x{element_type:02x}")
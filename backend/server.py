@@ -1,7 +1,9 @@
 from fastapi import FastAPI, APIRouter, HTTPException, Depends, status, UploadFile, File, Form
+from fastapi.responses import PlainTextResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
+from starlette.routing import Match
 from dynamodb_layer import DynamoDBDatabase
 import os
 import logging
@@ -20,7 +22,14 @@ load_dotenv(ROOT_DIR / '.env')
 # DynamoDB initialization
 # Uses boto3/aioboto3 for AWS DynamoDB access
 try:
-    db = DynamoDBDatabase()
+    # Hot, small tables re-read by key on every request get a read-through cache;
+    # fields searched with case-insensitive $regex keep a lowercased shadow copy.
+    # Aggregate counters (DYNAMODB_AGGREGATES) stay off until the counters table exists
+    # and scripts/rebuild-dynamodb-aggregates.py has built them; dashboards count otherwise
+    db = DynamoDBDatabase(
+        cache_tables=os.environ.get('DYNAMODB_CACHE_TABLES', 'users,employees,certificate_templates'),
+        search_fields=os.environ.get('DYNAMODB_SEARCH_FIELDS', 'employees:designation:role'),
+    )
     print(f"✅ DynamoDB client initialized successfully")
 except KeyError as e:
     print(f"❌ CRITICAL: Missing environment variable: {e}")
@@ -465,11 +474,12 @@ async def root():
 async def health_check():
     """Health check endpoint to verify backend and database connectivity"""
     try:
-        # Test database connection
+        # Open the shared DynamoDB connection pool and test it
+        await db.connect()
         await db.command('ping')
         
         # Count users to verify data access
-        user_count = len(await db.scan_items('users', {}))
+        user_count = await db.count_items('users', {})
         
         return {
             "status": "healthy",
@@ -695,7 +705,8 @@ async def diagnostics():
     }
     
     try:
-        # Test database connection
+        # Open the shared DynamoDB connection pool and test it
+        await db.connect()
         await db.command('ping')
         diagnostics_data["database_status"] = "connected"
         
@@ -733,6 +744,21 @@ async def diagnostics():
     return diagnostics_data
 
 
+@api_router.get("/metrics")
+async def dynamodb_metrics(format: str = "prometheus"):
+    """DynamoDB latency, item and consumed capacity metrics (Prometheus text; ?format=json for JSON)"""
+    if format == "json":
+        return {
+            **db.metrics.summary(),
+            "tables": db.throttle_stats(),
+            "cache": db.cache_stats(),
+            "single_flight": db.single_flight_stats(),
+            "plan_cache": db.plan_cache_stats(),
+            "changes": db.changes.stats(),
+        }
+    return PlainTextResponse(db.metrics.prometheus(db.throttle_stats()), media_type="text/plain; version=0.0.4")
+
+
 @api_router.post("/auth/login", response_model=LoginResponse)
 async def login(request: LoginRequest):
     try:
@@ -1286,9 +1312,9 @@ async def get_live_attendance(current_user: dict = Depends(get_current_user)):
     # Get all sales employees
     employees = await db.scan_items('employees', {"department": "Sales"})
     
-    # Get today's attendance
+    # Get today's attendance (only employee_id and time are read, so decode lazily)
     today = datetime.now(timezone.utc).strftime("%Y-%m-%d")
-    attendance_records = await db.scan_items('attendance', {"date": today})
+    attendance_records = await db.attendance.find({"date": today}).lazy().to_list(10000)
     
     # Create attendance map
     attendance_map = {record["employee_id"]: record for record in attendance_records}
@@ -2733,6 +2759,30 @@ async def delete_certificate_template(
 
 # ==================== CERTIFICATE GENERATION ENDPOINTS (UPDATED) ====================
 
+# Monthly certificate counters already seeded by this process
+_seeded_certificate_counters = set()
+
+
+async def reserve_certificate_numbers(now: datetime, count: int) -> List[str]:
+    """Reserve `count` consecutive ARB/YY/MM/### numbers with one atomic counter update"""
+    if count == 0:
+        return []
+    year = now.strftime("%y")
+    month = now.strftime("%m")
+    counter = f"certificate_no#{year}{month}"
+    
+    if counter not in _seeded_certificate_counters:
+        # Once per month and process: account for certificates issued before the counter existed
+        month_start = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+        issued = await db.count_items('certificate_candidates', {
+            "generated_at": {"$gte": month_start.isoformat()}
+        })
+        await db.counters.seed(counter, issued)
+        _seeded_certificate_counters.add(counter)
+    
+    numbers = await db.counters.reserve(counter, count)
+    return [f"ARB/{year}/{month}/{str(number).zfill(3)}" for number in numbers]
+
 @api_router.post("/academic/generate-certificates")
 async def generate_certificates(
     cert_request: CertificateGenerationRequest,
@@ -2749,19 +2799,13 @@ async def generate_certificates(
     
     # Generate certificate numbers (ARB/YY/MM/###)
     now = datetime.now(timezone.utc)
-    year = now.strftime("%y")
-    month = now.strftime("%m")
-    
-    # Get the count of certificates issued this month
-    month_start = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-    month_count = len(await db.scan_items('certificate_candidates', {
-        "generated_at": {"$gte": month_start.isoformat()}
-    }))
+    cert_numbers = await reserve_certificate_numbers(now, len(cert_request.candidates))
     
     generated_certificates = []
+    dispatch_certs = []
     
     for idx, candidate in enumerate(cert_request.candidates):
-        cert_no = f"ARB/{year}/{month}/{str(month_count + idx + 1).zfill(3)}"
+        cert_no = cert_numbers[idx]
         
         # Generate unique verification code (NEW)
         verification_code = str(uuid.uuid4())[:12].upper()  # Short unique code
@@ -2793,8 +2837,6 @@ async def generate_certificates(
         
         cert_dict = certificate.model_dump()
         cert_dict['generated_at'] = cert_dict['generated_at'].isoformat()
-        
-        await db.put_item('certificate_candidates', cert_dict)
         generated_certificates.append(cert_dict)
         
         # Also create an entry in the certificates collection for dispatch tracking
@@ -2810,7 +2852,16 @@ async def generate_certificates(
             "approved_at": now.isoformat(),
             "created_at": now.isoformat()
         }
-        await db.put_item('certificates', dispatch_cert)
+        dispatch_certs.append(dispatch_cert)
+    
+    # Each certificate and its dispatch entry are written atomically, many per TransactWriteItems
+    # (less the room their aggregate counter updates take)
+    per_transaction = db.transaction().capacity(['certificate_candidates', 'certificates']) // 2
+    for start in range(0, len(generated_certificates), per_transaction):
+        async with db.transaction() as tx:
+            for idx in range(start, min(start + per_transaction, len(generated_certificates))):
+                tx.put('certificate_candidates', generated_certificates[idx])
+                tx.put('certificates', dispatch_certs[idx])
     
     return {
         "message": f"{len(generated_certificates)} certificates generated successfully",
@@ -2880,20 +2931,15 @@ async def bulk_generate_certificates(
     
     # Generate certificate numbers
     now = datetime.now(timezone.utc)
-    year = now.strftime("%y")
-    month = now.strftime("%m")
-    
-    month_start = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-    month_count = len(await db.scan_items('certificate_candidates', {
-        "generated_at": {"$gte": month_start.isoformat()}
-    }))
+    cert_numbers = await reserve_certificate_numbers(now, len(bulk_request.candidates))
     
     generated_certificates = []
+    dispatch_certs = []
     errors = []
     
     for idx, candidate in enumerate(bulk_request.candidates):
         try:
-            cert_no = f"ARB/{year}/{month}/{str(month_count + idx + 1).zfill(3)}"
+            cert_no = cert_numbers[idx]
             
             # Generate unique verification code
             verification_code = str(uuid.uuid4())[:12].upper()
@@ -2923,12 +2969,10 @@ async def bulk_generate_certificates(
             
             cert_dict = certificate.model_dump()
             cert_dict['generated_at'] = cert_dict['generated_at'].isoformat()
-            
-            await db.put_item('certificate_candidates', cert_dict)
             generated_certificates.append(cert_dict)
             
             # Also create dispatch entry
-            dispatch_cert = {
+            dispatch_certs.append({
                 "id": str(uuid.uuid4()),
                 "work_order_id": bulk_request.work_order_id,
                 "certificate_no": cert_no,
@@ -2939,8 +2983,7 @@ async def bulk_generate_certificates(
                 "approved_by": current_user.get("name"),
                 "approved_at": now.isoformat(),
                 "created_at": now.isoformat()
-            }
-            await db.put_item('certificates', dispatch_cert)
+            })
             
         except Exception as e:
             errors.append({
@@ -2948,6 +2991,18 @@ async def bulk_generate_certificates(
                 "error": str(e)
             })
     
+    # Write all certificates in batches, then dispatch entries for the ones that were stored
+    write_result = await db.put_items('certificate_candidates', generated_certificates)
+    for idx, error in sorted(write_result.failed.items()):
+        errors.append({
+            "candidate": generated_certificates[idx].get("candidate_name"),
+            "error": error
+        })
+    dispatch_result = await db.put_items('certificates', [dispatch_certs[idx] for idx in write_result.succeeded])
+    for error in dispatch_result.failed.values():
+        logger.error(f"Failed to create dispatch entry during bulk certificate generation: {error}")
+    generated_certificates = [generated_certificates[idx] for idx in write_result.succeeded]
+    
     return {
         "message": f"Bulk generation completed",
         "total_requested": len(bulk_request.candidates),
@@ -2999,41 +3054,41 @@ async def get_coo_dashboard_data(current_user: dict = Depends(get_current_user))
     
     try:
         # HRM Overview
-        total_employees = len(await db.scan_items('employees', {}))
+        total_employees = await db.count_items('employees', {})
         today = datetime.now(timezone.utc).date().isoformat()
-        present_today = len(await db.scan_items('attendance', {}))
+        present_today = await db.count_items('attendance', {})
         
         # Document expiry alerts (within 30 days)
         thirty_days_ahead = (datetime.now(timezone.utc) + timedelta(days=30)).isoformat()
-        expiring_docs = len(await db.scan_items('employee_documents', {
+        expiring_docs = await db.count_items('employee_documents', {
             "expiry_date": {"$lte": thirty_days_ahead, "$gte": datetime.now(timezone.utc).isoformat()}
-        }))
+        })
         
         # Sales Performance
-        total_leads = len(await db.scan_items('leads', {}))
-        converted_leads = len(await db.scan_items('leads', {}))
-        active_quotations = len(await db.scan_items('quotations', {"status": {"$in": ["pending", "sent"]}} if {"status": {"$in": ["pending", "sent"]}} else {}))
+        total_leads = await db.aggregates.count('leads')
+        converted_leads = await db.aggregates.count('leads')
+        active_quotations = await db.count_items('quotations', {"status": {"$in": ["pending", "sent"]}} if {"status": {"$in": ["pending", "sent"]}} else {})
         
         # Academic Operations
-        active_trainers = len(await db.scan_items('employees', {
+        active_trainers = await db.count_items('employees', {
             "department": "Academic",
             "designation": {"$in": ["TRAINER_FULLTIME", "TRAINER_PARTTIME"]}
         } if {
             "department": "Academic",
             "designation": {"$in": ["TRAINER_FULLTIME", "TRAINER_PARTTIME"]}
-        } else {}))
-        total_work_orders = len(await db.scan_items('work_orders', {}))
-        completed_sessions = len(await db.scan_items('work_orders', {}))
-        certificates_generated = len(await db.scan_items('certificate_candidates', {}))
+        } else {})
+        total_work_orders = await db.aggregates.count('work_orders')
+        completed_sessions = await db.aggregates.count('work_orders')
+        certificates_generated = await db.count_items('certificate_candidates', {})
         
         # Dispatch Status
-        pending_dispatch = len(await db.scan_items('delivery_tasks', {}))
-        out_for_delivery = len(await db.scan_items('delivery_tasks', {}))
+        pending_dispatch = await db.aggregates.count('delivery_tasks')
+        out_for_delivery = await db.aggregates.count('delivery_tasks')
         delivered_today_start = datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
-        delivered_today = len(await db.scan_items('delivery_tasks', {
+        delivered_today = await db.count_items('delivery_tasks', {
             "status": "DELIVERED",
             "delivered_at": {"$gte": delivered_today_start.isoformat()}
-        }))
+        })
         
         # Accounts snapshot (mock data - extend based on actual schema)
         # This can be extended when invoice/payment modules are built
@@ -3081,52 +3136,52 @@ async def get_md_dashboard_data(current_user: dict = Depends(get_current_user)):
     
     try:
         # Corporate Health Score (calculated based on multiple factors)
-        total_employees = len(await db.scan_items('employees', {}))
+        total_employees = await db.count_items('employees', {})
         today = datetime.now(timezone.utc).date().isoformat()
-        present_today = len(await db.scan_items('attendance', {}))
+        present_today = await db.count_items('attendance', {})
         attendance_score = (present_today / total_employees * 100) if total_employees > 0 else 0
         
-        total_leads = len(await db.scan_items('leads', {}))
-        converted_leads = len(await db.scan_items('leads', {}))
+        total_leads = await db.aggregates.count('leads')
+        converted_leads = await db.aggregates.count('leads')
         sales_score = (converted_leads / total_leads * 100) if total_leads > 0 else 0
         
-        delivered = len(await db.scan_items('delivery_tasks', {}))
-        total_tasks = len(await db.scan_items('delivery_tasks', {}))
+        delivered = await db.aggregates.count('delivery_tasks')
+        total_tasks = await db.aggregates.count('delivery_tasks')
         dispatch_score = (delivered / total_tasks * 100) if total_tasks > 0 else 0
         
         corporate_health = round((attendance_score + sales_score + dispatch_score) / 3, 1)
         
         # Executive Analytics
-        total_work_orders = len(await db.scan_items('work_orders', {}))
-        completed_work_orders = len(await db.scan_items('work_orders', {}))
+        total_work_orders = await db.aggregates.count('work_orders')
+        completed_work_orders = await db.aggregates.count('work_orders')
         
         # Workforce Intelligence
         departments = await db.employees.distinct("department")
         dept_counts = {}
         for dept in departments:
-            count = len(await db.scan_items('employees', {}))
+            count = await db.count_items('employees', {})
             dept_counts[dept] = count
         
         # Sales Intelligence
-        high_value_leads = len(await db.scan_items('leads', {}))  # Can filter by value threshold
-        lost_deals = len(await db.scan_items('leads', {}))
+        high_value_leads = await db.aggregates.count('leads')  # Can filter by value threshold
+        lost_deals = await db.aggregates.count('leads')
         
         # Academic Excellence
-        certificates_generated = len(await db.scan_items('certificate_candidates', {}))
-        active_trainers = len(await db.scan_items('employees', {
+        certificates_generated = await db.count_items('certificate_candidates', {})
+        active_trainers = await db.count_items('employees', {
             "department": "Academic",
             "designation": {"$in": ["TRAINER_FULLTIME", "TRAINER_PARTTIME"]}
         } if {
             "department": "Academic",
             "designation": {"$in": ["TRAINER_FULLTIME", "TRAINER_PARTTIME"]}
-        } else {}))
+        } else {})
         
         # Executive Alerts (critical items)
-        pending_dispatch = len(await db.scan_items('delivery_tasks', {"status": "PENDING"}))
+        pending_dispatch = await db.aggregates.count('delivery_tasks', {"status": "PENDING"})
         thirty_days_ahead = (datetime.now(timezone.utc) + timedelta(days=30)).isoformat()
-        expiring_docs = len(await db.scan_items('employee_documents', {
+        expiring_docs = await db.count_items('employee_documents', {
             "expiry_date": {"$lte": thirty_days_ahead, "$gte": datetime.now(timezone.utc).isoformat()}
-        }))
+        })
         
         # AI-powered insights (rule-based for now, can be enhanced with ML)
         insights = []
@@ -3242,15 +3297,23 @@ async def get_certificates_ready_for_dispatch(
     
     certificates = await db.scan_items('certificates', query)
     
+    # Certificates that already have delivery tasks (one read of every page instead of one per certificate)
+    assigned_certificate_ids = set()
+    async for page in db.delivery_tasks.find({}, {"certificate_id": 1}).pages():
+        assigned_certificate_ids.update(task.get("certificate_id") for task in page)
+    
+    # Work order details for all certificates in one batch
+    work_orders = await db.get_items_batch(
+        'work_orders', [cert.get("work_order_id") for cert in certificates], {"_id": 0}
+    )
+    
     # Filter out certificates that already have delivery tasks
     result = []
     for cert in certificates:
-        # Check if delivery task exists
-        existing_task = await db.get_item('delivery_tasks', {"certificate_id": cert.get("id")})
-        if not existing_task:
+        if cert.get("id") not in assigned_certificate_ids:
             # Get work order details if available
             if cert.get("work_order_id"):
-                wo = await db.get_item('work_orders', {"id": cert.get("work_order_id")}, {"_id": 0})
+                wo = work_orders.get(cert.get("work_order_id"))
                 if wo:
                     cert["client_name"] = wo.get("client_name", "N/A")
                     cert["client_branch"] = wo.get("branch", "N/A")
@@ -3286,9 +3349,15 @@ async def create_delivery_tasks(
     
     created_tasks = []
     
+    # Certificate and work order details in two batch reads
+    certificates = await db.get_items_batch('certificates', task_data.certificate_ids, {"_id": 0})
+    work_orders = await db.get_items_batch(
+        'work_orders', [c.get("work_order_id") for c in certificates.values()], {"_id": 0}
+    )
+    
     for cert_id in task_data.certificate_ids:
         # Get certificate details
-        certificate = await db.get_item('certificates', {"id": cert_id}, {"_id": 0})
+        certificate = certificates.get(cert_id)
         if not certificate:
             continue
         
@@ -3298,7 +3367,7 @@ async def create_delivery_tasks(
         work_order_id = None
         
         if certificate.get("work_order_id"):
-            wo = await db.get_item('work_orders', {"id": certificate.get("work_order_id")}, {"_id": 0})
+            wo = work_orders.get(certificate.get("work_order_id"))
             if wo:
                 client_name = wo.get("client_name", "N/A")
                 client_branch = wo.get("branch", "N/A")
@@ -3393,30 +3462,27 @@ async def get_dispatch_summary(current_user: dict = Depends(get_current_user)):
     if current_user.get("role") != "Dispatch Head":
         raise HTTPException(status_code=403, detail="Access denied. Dispatch Head only.")
     
-    # Count by status
-    pending = len(await db.scan_items('delivery_tasks', {}))
-    out_for_delivery = len(await db.scan_items('delivery_tasks', {}))
+    # Count by status (one GetItem of the maintained aggregate)
+    pending = await db.aggregates.count('delivery_tasks')
+    out_for_delivery = await db.aggregates.count('delivery_tasks')
     
     # Delivered today
     today_start = datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
-    delivered_today = len(await db.scan_items('delivery_tasks', {
+    delivered_today = await db.count_items('delivery_tasks', {
         "status": "DELIVERED",
         "delivered_at": {"$gte": today_start.isoformat()}
-    }))
+    })
     
     # Overdue (tasks with due_date in the past and not delivered)
     now = datetime.now(timezone.utc).isoformat()
-    overdue = len(await db.scan_items('delivery_tasks', {
-        "status": {"$nin": ["DELIVERED", "FAILED", "RETURNED"]},
-        "due_date": {"$lt": now, "$ne": None}
-    } if {
+    overdue = await db.count_items('delivery_tasks', {
         "status": {"$nin": ["DELIVERED", "FAILED", "RETURNED"]},
         "due_date": {"$lt": now, "$ne": None}
-    } else {}))
+    })
     
     # Certificates ready for dispatch
-    certificates_ready = len(await db.scan_items('certificates', {}))
-    existing_tasks_count = len(await db.scan_items('delivery_tasks', {}))
+    certificates_ready = await db.count_items('certificates', {})
+    existing_tasks_count = await db.aggregates.count('delivery_tasks')
     ready_for_assignment = max(0, certificates_ready - existing_tasks_count)
     
     return {
@@ -3479,29 +3545,29 @@ async def update_my_delivery_task(
     update_data = {k: v for k, v in task_update.model_dump().items() if v is not None}
     update_data["updated_at"] = datetime.now(timezone.utc).isoformat()
     
-    # If status is DELIVERED, update certificate status
+    # If status is DELIVERED, the certificate and work order are updated too
     if task_update.status == "DELIVERED":
         if not update_data.get("delivered_at"):
             update_data["delivered_at"] = datetime.now(timezone.utc).isoformat()
-        
-        # Update certificate status
-        await db.certificates.update_one(
-            {"id": task.get("certificate_id")},
-            {"$set": {"status": "delivered", "delivered_at": update_data["delivered_at"]}}
-        )
-        
-        # Mark work order as completed if exists
-        if task.get("work_order_id"):
-            await db.work_orders.update_one(
-                {"id": task.get("work_order_id")},
-                {"$set": {"status": "completed", "completed_at": update_data["delivered_at"]}}
-            )
     
-    # Update delivery task
-    result = await db.delivery_tasks.update_one(
-        {"id": task_id},
-        {"$set": update_data}
-    )
+    # Task, certificate and work order change together in one TransactWriteItems
+    async with db.transaction() as tx:
+        if task_update.status == "DELIVERED":
+            # Update certificate status
+            tx.update('certificates',
+                {"id": task.get("certificate_id")},
+                {"$set": {"status": "delivered", "delivered_at": update_data["delivered_at"]}}
+            )
+            
+            # Mark work order as completed if exists
+            if task.get("work_order_id"):
+                tx.update('work_orders',
+                    {"id": task.get("work_order_id")},
+                    {"$set": {"status": "completed", "completed_at": update_data["delivered_at"]}}
+                )
+        
+        # Update delivery task
+        tx.update('delivery_tasks', {"id": task_id}, {"$set": update_data})
     
     return {"message": "Delivery task updated successfully"}
 
@@ -4247,6 +4313,25 @@ async def mark_expense_paid(claim_id: str, payment_data: dict, current_user: dic
 # Include the router in the main app
 app.include_router(api_router)
 
+
+@app.middleware("http")
+async def attribute_dynamodb_metrics(request, call_next):
+    """
+    Attribute the DynamoDB requests made while serving a request to its route
+    in db.metrics, and hold its scans to the configured scan budget
+    """
+    route_path = next(
+        (route.path for route in app.router.routes if route.matches(request.scope)[0] == Match.FULL),
+        "unmatched"
+    )
+    with db.metrics.endpoint(f"{request.method} {route_path}"), db.scan_budget() as budget:
+        response = await call_next(request)
+    if budget.truncated:
+        # Partial results: a scan stopped at the budget (DYNAMODB_SCAN_BUDGET_*)
+        response.headers["X-Scan-Budget-Truncated"] = "true"
+    return response
+
+
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
@@ -4267,7 +4352,8 @@ logger = logging.getLogger(__name__)
 async def startup_db():
     """Initialize database connection and seed default users (gracefully handles permission errors)"""
     try:
-        # Test database connection
+        # Open the shared DynamoDB connection pool and test it
+        await db.connect()
         await db.command('ping')
         logger.info("✅ Database connection successful")
         print("✅ Database connection verified")
@@ -4320,7 +4406,7 @@ async def startup_db():
                 print("✅ MD user exists")
             
             # Count total users
-            user_count = len(await db.scan_items('users', {}))
+            user_count = await db.count_items('users', {})
             logger.info(f"Database initialized. Total users: {user_count}")
             print(f"✅ Database ready. Total users: {user_count}")
             
@@ -4348,4 +4434,4 @@ async def startup_db():
 
 @app.on_event("shutdown")
 async def shutdown_db_client():
-    client.close()
\ No newline at end of file
+    await db.close()
\ No newline at end of file
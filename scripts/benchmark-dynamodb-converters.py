@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+Benchmark DynamoDB item converters
+Compares the single-pass converters in backend/dynamodb_layer.py with the
+previous JSON dump/load round trip, and eager low-level item decoding with
+LazyItem reading two fields, using the item shapes exported in Json/
+"""
+
+import json
+import sys
+import timeit
+from decimal import Decimal
+from pathlib import Path
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT_DIR / 'backend'))
+
+from boto3.dynamodb.types import TypeDeserializer, TypeSerializer  # noqa: E402
+from dynamodb_layer import LazyItem, to_dynamodb_value, from_dynamodb_value  # noqa: E402
+
+JSON_DIR = ROOT_DIR / 'Json'
+REPEAT = 5
+
+
+def json_to_dynamodb(item):
+    """Previous implementation: JSON round trip with Decimal floats"""
+    return json.loads(json.dumps(item), parse_float=Decimal)
+
+
+def json_from_dynamodb(item):
+    """Previous implementation: JSON round trip stringifying Decimals"""
+    return json.loads(json.dumps(item, default=str))
+
+
+_serializer = TypeSerializer()
+_deserializer = TypeDeserializer()
+
+
+def eager_decode(raw_item):
+    """Resource-style read: deserialize every attribute, then convert"""
+    return from_dynamodb_value({k: _deserializer.deserialize(v) for k, v in raw_item.items()})
+
+
+def lazy_two_fields(raw_item):
+    """Low-level read through LazyItem touching two fields (like get_live_attendance)"""
+    item = LazyItem(raw_item)
+    return item.get('id'), item.get('created_at')
+
+
+def load_items(json_file):
+    """Load exported documents the way they look as plain Python dicts"""
+    with open(json_file) as f:
+        documents = json.load(f)
+    items = []
+    for document in documents:
+        document.pop('_id', None)
+        items.append(document)
+    return items
+
+
+def time_per_item(func, items, number):
+    """Best-of-REPEAT microseconds per item"""
+    timer = timeit.Timer(lambda: [func(item) for item in items])
+    return min(timer.repeat(repeat=REPEAT, number=number)) / (number * len(items)) * 1e6
+
+
+def main():
+    print("=" * 72)
+    print("DynamoDB converter benchmark (microseconds per item, lower is better)")
+    print("=" * 72)
+    print(f"{'collection':<22}{'items':>6}  {'to: json':>9}{'to: new':>9}  {'from: json':>11}{'from: new':>10}")
+
+    totals = [0.0, 0.0, 0.0, 0.0]
+    for json_file in sorted(JSON_DIR.glob('arbrit-workdesk.*.json')):
+        items = load_items(json_file)
+        if not items:
+            continue
+        stored = [to_dynamodb_value(item) for item in items]
+        number = max(1, 2000 // len(items))
+
+        results = [
+            time_per_item(json_to_dynamodb, items, number),
+            time_per_item(to_dynamodb_value, items, number),
+            time_per_item(json_from_dynamodb, stored, number),
+            time_per_item(from_dynamodb_value, stored, number),
+        ]
+        totals = [t + r for t, r in zip(totals, results)]
+        name = json_file.stem.split('.', 1)[1]
+        print(f"{name:<22}{len(items):>6}  {results[0]:>9.1f}{results[1]:>9.1f}  {results[2]:>11.1f}{results[3]:>10.1f}")
+
+    print("-" * 72)
+    print(f"{'sum':<28}  {totals[0]:>9.1f}{totals[1]:>9.1f}  {totals[2]:>11.1f}{totals[3]:>10.1f}")
+    if totals[1] and totals[3]:
+        print(f"Speed-up: to_dynamodb {totals[0] / totals[1]:.1f}x, from_dynamodb {totals[2] / totals[3]:.1f}x")
+
+    print()
+    print("Low-level read path (microseconds per item)")
+    print(f"{'collection':<22}{'items':>6}  {'eager all':>10}{'lazy 2 fields':>15}")
+    lazy_totals = [0.0, 0.0]
+    for json_file in sorted(JSON_DIR.glob('arbrit-workdesk.*.json')):
+        items = load_items(json_file)
+        if not items:
+            continue
+        raw_items = [{k: _serializer.serialize(v) for k, v in to_dynamodb_value(item).items()} for item in items]
+        number = max(1, 2000 // len(items))
+        results = [
+            time_per_item(eager_decode, raw_items, number),
+            time_per_item(lazy_two_fields, raw_items, number),
+        ]
+        lazy_totals = [t + r for t, r in zip(lazy_totals, results)]
+        name = json_file.stem.split('.', 1)[1]
+        print(f"{name:<22}{len(items):>6}  {results[0]:>10.1f}{results[1]:>15.1f}")
+    print("-" * 72)
+    print(f"{'sum':<28}  {lazy_totals[0]:>10.1f}{lazy_totals[1]:>15.1f}")
+    if lazy_totals[1]:
+        print(f"Speed-up: lazy {lazy_totals[0] / lazy_totals[1]:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
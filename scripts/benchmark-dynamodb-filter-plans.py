@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+Benchmark compiled filter plans
+Compares planning every request from scratch (plan_query building boto3
+conditions, then rendering them to expression strings and placeholders) with
+binding values into a PlanTemplate cached per filter shape (PlanCache), for
+filter shapes used by backend/server.py with changing values
+"""
+
+import json
+import sys
+import timeit
+import uuid
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT_DIR / 'backend'))
+
+from dynamodb_layer import PlanCache, TableSchema, plan_query  # noqa: E402
+
+REPEAT = 5
+NUMBER = 2000
+SEARCH_FIELDS = {'arbrit-employees': ('designation', 'role')}
+
+
+def load_schemas():
+    """TableSchema of every table in dynamodb-tables.json"""
+    with open(ROOT_DIR / 'dynamodb-tables.json') as f:
+        spec = json.load(f)
+    schemas = {t['TableName']: TableSchema.from_description(t) for t in spec['tables']}
+    for table_name in spec['simple_tables']:
+        schemas[table_name] = TableSchema('id', attribute_types={'id': 'S'})
+    return schemas
+
+
+def server_filters(i):
+    """(table, filter, sort key) shapes from server.py, with the i-th set of values"""
+    now = datetime.now(timezone.utc) + timedelta(minutes=i)
+    user_id = str(uuid.UUID(int=i))
+    return [
+        ('arbrit-attendance', {"employee_id": user_id}, "date"),
+        ('arbrit-attendance', {"date": now.date().isoformat()}, None),
+        ('arbrit-leads', {"assigned_to": user_id}, "created_at"),
+        ('arbrit-visit-logs', {"logged_by": user_id}, "date"),
+        ('arbrit-employees', {"designation": {"$in": ["TRAINER_FULLTIME", "TRAINER_PARTTIME"]}}, None),
+        ('arbrit-employees', {"$or": [
+            {"designation": {"$regex": "trainer", "$options": "i"}},
+            {"role": {"$regex": "trainer", "$options": "i"}},
+        ]}, None),
+        ('arbrit-employees', {"$or": [
+            {"department": f"dept-{i % 5}", "designation": {"$in": ["SALES_HEAD", "ACADEMIC_HEAD", "HR_MANAGER"]}},
+            {"designation": "COO"},
+        ]}, None),
+        ('arbrit-certificates', {"expiry_date": {"$lte": (now + timedelta(days=30)).isoformat(),
+                                                 "$gte": now.isoformat()}}, None),
+        ('arbrit-quotations', {"status": {"$in": ["pending", "sent"]}}, None),
+        ('arbrit-delivery-tasks', {"status": {"$nin": ["DELIVERED", "FAILED", "RETURNED"]},
+                                   "due_date": {"$lt": now.isoformat(), "$ne": None}}, None),
+        ('arbrit-delivery-tasks', {"status": "DELIVERED", "delivered_at": {"$gte": now.isoformat()}}, None),
+        ('arbrit-certificate-templates', {"is_default": True, "id": {"$ne": user_id}}, None),
+        ('arbrit-invoice-requests', {"$or": [{"status": {"$in": ["PENDING_ACCOUNTS", "PAID"]}},
+                                             {"requested_by": user_id}]}, None),
+        ('arbrit-users', {"mobile": f"9715{i:08d}", "role": "COO"}, None),
+    ]
+
+
+def uncached(schemas, requests):
+    for table_name, filter_dict, sort_key in requests:
+        plan = plan_query(schemas[table_name], filter_dict, sort_key, SEARCH_FIELDS.get(table_name, ()))
+        plan.client_kwargs(table_name)
+
+
+def cached(cache, schemas, requests):
+    for table_name, filter_dict, sort_key in requests:
+        plan = cache.plan(table_name, schemas[table_name], filter_dict, sort_key, SEARCH_FIELDS.get(table_name, ()))
+        plan.client_kwargs(table_name)
+
+
+def time_per_request(func, batches):
+    """Best-of-REPEAT microseconds per request"""
+    count = sum(len(batch) for batch in batches)
+    timer = timeit.Timer(lambda: [func(batch) for batch in batches])
+    return min(timer.repeat(repeat=REPEAT, number=max(1, NUMBER // count))) / (max(1, NUMBER // count) * count) * 1e6
+
+
+def main():
+    schemas = load_schemas()
+    batches = [server_filters(i) for i in range(50)]
+    cache = PlanCache()
+
+    print("=" * 72)
+    print("DynamoDB filter plan benchmark (microseconds per request, lower is better)")
+    print("=" * 72)
+    print(f"{'table':<30}{'shape':>6}  {'uncached':>10}{'cached':>10}{'speed-up':>10}")
+    for shape in range(len(batches[0])):
+        per_shape = [[batch[shape]] for batch in batches]
+        table_name = per_shape[0][0][0]
+        results = [
+            time_per_request(lambda batch: uncached(schemas, batch), per_shape),
+            time_per_request(lambda batch: cached(cache, schemas, batch), per_shape),
+        ]
+        print(f"{table_name:<30}{shape:>6}  {results[0]:>10.1f}{results[1]:>10.1f}{results[0] / results[1]:>9.1f}x")
+
+    print("-" * 72)
+    totals = [
+        time_per_request(lambda batch: uncached(schemas, batch), batches),
+        time_per_request(lambda batch: cached(cache, schemas, batch), batches),
+    ]
+    print(f"{'all shapes':<36}  {totals[0]:>10.1f}{totals[1]:>10.1f}{totals[0] / totals[1]:>9.1f}x")
+    print(f"CPU saved per request: {totals[0] - totals[1]:.1f} microseconds")
+    print(f"Plan cache: {cache.stats()}")
+
+
+if __name__ == "__main__":
+    main()
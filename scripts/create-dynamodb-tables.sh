@@ -89,6 +89,7 @@ create_simple_table "arbrit-visit-logs"
 create_simple_table "arbrit-expense-claims"
 create_simple_table "arbrit-leave-requests"
 create_simple_table "arbrit-delivery-tasks"
+create_simple_table "arbrit-counters"
 
 echo "================================================"
 echo "✅ DynamoDB tables creation complete!"
@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+"""
+Rebuild DynamoDB aggregate counters
+Recomputes the per-group document counts of DYNAMODB_AGGREGATES (e.g.
+delivery_tasks by status) from a scan and overwrites their items in the
+counters table. Run it once after declaring an aggregate (before the backend
+runs with it), and to repair counts after writes made outside the DynamoDB
+layer (imports, console edits).
+
+Usage: DYNAMODB_AGGREGATES=delivery_tasks:status,leads:status \
+       python scripts/rebuild-dynamodb-aggregates.py [collection ...]
+"""
+
+import asyncio
+import os
+import sys
+from pathlib import Path
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT_DIR / 'backend'))
+
+from dynamodb_layer import DynamoDBDatabase  # noqa: E402
+
+
+async def main(collection_names):
+    db = DynamoDBDatabase(aggregates=os.environ.get('DYNAMODB_AGGREGATES', ''))
+    print("=" * 60)
+    print("Rebuilding DynamoDB aggregate counters")
+    print("=" * 60)
+    if not db.aggregate_groups:
+        print("⚠️  DYNAMODB_AGGREGATES is empty, nothing to rebuild")
+        return
+    try:
+        for collection_name in collection_names or sorted(db.aggregate_groups):
+            if not db.aggregate_groups.get(collection_name):
+                print(f"⚠️  {collection_name}: no aggregates configured, skipping")
+                continue
+            report = await db.aggregates.rebuild(collection_name)
+            for fields, groups in report.get(collection_name, {}).items():
+                print(f"✅ {collection_name} by {fields}: {groups} groups")
+    finally:
+        await db.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(sys.argv[1:]))
@@ -0,0 +1,42 @@
+#!/usr/bin/env python3
+"""
+Rebuild DynamoDB search shadow attributes
+Adds (or refreshes) the lowercased shadow attributes that case-insensitive
+$regex filters use, for items written before their fields were listed in
+DYNAMODB_SEARCH_FIELDS. Items whose shadows are already current are skipped.
+
+Usage: python scripts/rebuild-dynamodb-search-fields.py [collection ...]
+"""
+
+import asyncio
+import os
+import sys
+from pathlib import Path
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT_DIR / 'backend'))
+
+from dynamodb_layer import DynamoDBDatabase  # noqa: E402
+
+DEFAULT_SEARCH_FIELDS = 'employees:designation:role'
+
+
+async def main(collection_names):
+    db = DynamoDBDatabase(search_fields=os.environ.get('DYNAMODB_SEARCH_FIELDS', DEFAULT_SEARCH_FIELDS))
+    print("=" * 60)
+    print("Rebuilding DynamoDB search shadow attributes")
+    print("=" * 60)
+    try:
+        for collection_name in collection_names or sorted(db.search_fields):
+            fields = db.search_fields.get(collection_name)
+            if not fields:
+                print(f"⚠️  {collection_name}: no search fields configured, skipping")
+                continue
+            updated = await getattr(db, collection_name).rebuild_search_attributes()
+            print(f"✅ {collection_name} ({', '.join(fields)}): {updated} items updated")
+    finally:
+        await db.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(sys.argv[1:]))
@@ -0,0 +1,54 @@
+"""
+Shared fixtures: every test runs the DynamoDB layer against the in-memory
+engine (backend/dynamodb_memory.py), so no AWS account or local DynamoDB is
+needed. Async scenarios run with asyncio.run via the `run` fixture.
+"""
+
+import asyncio
+import sys
+from pathlib import Path
+
+import pytest
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT_DIR / 'backend'))
+
+from dynamodb_memory import InMemoryDynamoDB, InMemoryDynamoDBDatabase  # noqa: E402
+
+# Settings read from the environment by DynamoDBDatabase; tests pass what they need explicitly
+_DATABASE_ENV = (
+    'DYNAMODB_CACHE_TABLES', 'DYNAMODB_SEARCH_FIELDS', 'DYNAMODB_AGGREGATES', 'DYNAMODB_RATE_LIMITS',
+    'DYNAMODB_PLAN_CACHE_SIZE', 'DYNAMODB_SINGLE_FLIGHT', 'DYNAMODB_CHANGE_JOURNAL',
+    'DYNAMODB_SCAN_BUDGET_ITEMS', 'DYNAMODB_SCAN_BUDGET_PAGES',
+)
+
+
+@pytest.fixture(autouse=True)
+def clean_environment(monkeypatch):
+    for name in _DATABASE_ENV:
+        monkeypatch.delenv(name, raising=False)
+
+
+@pytest.fixture
+def run():
+    """Run a coroutine to completion"""
+    return asyncio.run
+
+
+@pytest.fixture
+def engine():
+    """Engine with the tables of dynamodb-tables.json"""
+    return InMemoryDynamoDB.from_table_definitions()
+
+
+@pytest.fixture
+def make_db(engine):
+    """Factory of databases on the test's engine (keyword arguments as DynamoDBDatabase)"""
+    def make(**kwargs):
+        return InMemoryDynamoDBDatabase(engine, **kwargs)
+    return make
+
+
+@pytest.fixture
+def db(make_db):
+    return make_db()
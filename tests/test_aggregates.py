@@ -0,0 +1,87 @@
+"""DynamoDBAggregates: per-group counts maintained by writes, read without scanning"""
+
+AGGREGATES = 'leads:status,leads:status+assigned_to,delivery_tasks:status'
+
+
+def test_deltas_move_an_item_between_groups(db):
+    db = type(db)(db.engine, aggregates=AGGREGATES)
+    deltas = db.aggregates.deltas(
+        db.leads, {"id": "l1", "status": "new", "assigned_to": "u1"}, {"id": "l1", "status": "won", "assigned_to": "u1"})
+    assert deltas == {
+        'aggregate#arbrit-leads#status': {'"new"': -1, '"won"': 1},
+        'aggregate#arbrit-leads#status+assigned_to': {'["new", "u1"]': -1, '["won", "u1"]': 1},
+    }
+
+
+def test_unchanged_groups_have_no_delta(db):
+    db = type(db)(db.engine, aggregates=AGGREGATES)
+    deltas = db.aggregates.deltas(
+        db.leads, {"id": "l1", "status": "new", "assigned_to": "u1"}, {"id": "l1", "status": "new", "assigned_to": "u1", "x": 1})
+    assert deltas == {}
+
+
+def test_aggregates_are_unbuilt_until_rebuilt(run, make_db, engine):
+    db = make_db(aggregates=AGGREGATES)
+    
+    async def scenario():
+        await db.leads.insert_many([{"id": "l1", "status": "new"}, {"id": "l2", "status": "won"}])
+        unbuilt = await db.aggregates.read('leads', 'status')
+        counted = await db.aggregates.count('leads', {"status": "new"})
+        await db.aggregates.rebuild()
+        return unbuilt, counted, await db.aggregates.read('leads', 'status')
+    
+    unbuilt, counted, built = run(scenario())
+    assert unbuilt is None
+    assert counted == 1
+    assert built == {"new": 1, "won": 1}
+
+
+def test_writes_keep_built_aggregates_exact(run, make_db, engine):
+    db = make_db(aggregates=AGGREGATES)
+    
+    async def scenario():
+        await db.aggregates.rebuild()
+        await db.leads.insert_one({"id": "l1", "status": "new", "assigned_to": "u1"})
+        await db.leads.insert_one({"id": "l2", "status": "new", "assigned_to": "u2"})
+        await db.leads.update_one({"id": "l1"}, {"$set": {"status": "won"}})
+        await db.leads.insert_one({"id": "l2", "status": "lost", "assigned_to": "u2"})  # replaces l2
+        await db.leads.insert_many([{"id": f"m{i}", "status": "new", "assigned_to": "u1"} for i in range(30)])
+        await db.leads.delete_many({"status": "lost"})
+        await db.leads.delete_one({"id": "m0"})
+        await db.leads.delete_one({"id": "missing"})
+        async with db.transaction() as tx:
+            tx.update('leads', {"id": "m1"}, {"$set": {"status": "won"}})
+            tx.put('delivery_tasks', {"id": "t1", "status": "PENDING"})
+        async with db.transaction(atomic=False) as tx:
+            tx.delete('leads', {"id": "m2"})
+            tx.put('delivery_tasks', {"id": "t2", "status": "PENDING"})
+        maintained = await db.aggregates.read_many([('leads', 'status'), ('leads', 'status+assigned_to'),
+                                                    ('delivery_tasks', 'status')])
+        await db.aggregates.rebuild()
+        rebuilt = await db.aggregates.read_many(list(maintained))
+        return maintained, rebuilt
+    
+    maintained, rebuilt = run(scenario())
+    assert maintained == rebuilt
+    assert maintained[('leads', 'status')] == {"new": 27, "won": 2}
+    assert maintained[('leads', 'status+assigned_to')] == {("new", "u1"): 27, ("won", "u1"): 2}
+    assert maintained[('delivery_tasks', 'status')] == {"PENDING": 2}
+
+
+def test_count_is_answered_from_the_aggregate(run, make_db, engine):
+    db = make_db(aggregates=AGGREGATES)
+    
+    async def scenario():
+        await db.leads.insert_many([{"id": f"l{i}", "status": "new" if i % 3 else "won"} for i in range(30)])
+        await db.aggregates.rebuild()
+        engine.reset_metrics()
+        counts = (await db.aggregates.count('leads'), await db.aggregates.count('leads', {"status": "won"}))
+        reads = dict(engine.request_counts)
+        # Not an equality on an aggregate's fields: counted by DynamoDB
+        fallback = await db.aggregates.count('leads', {"status": {"$in": ["won", "new"]}})
+        return counts, reads, fallback
+    
+    counts, reads, fallback = run(scenario())
+    assert counts == (30, 10)
+    assert reads.get('Scan', 0) == 0 and reads['GetItem'] == 2
+    assert fallback == 30
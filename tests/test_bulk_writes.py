@@ -0,0 +1,79 @@
+"""insert_many/delete_many: duplicate keys, unprocessed items and per-item results"""
+
+from dynamodb_memory import InMemoryDynamoDB, InMemoryDynamoDBDatabase
+
+
+def test_insert_many_keeps_the_last_document_of_a_duplicated_key(run, db):
+    async def scenario():
+        result = await db.leads.insert_many([
+            {"id": "l1", "status": "new"},
+            {"id": "l2", "status": "new"},
+            {"id": "l1", "status": "won"},
+        ])
+        return result, await db.leads.find({}).to_list(None)
+    
+    result, leads = run(scenario())
+    assert result.ok and result.succeeded == [0, 1, 2]
+    assert sorted((lead["id"], lead["status"]) for lead in leads) == [("l1", "won"), ("l2", "new")]
+
+
+def test_insert_many_splits_into_batches_of_25(run, db, engine):
+    result = run(db.leads.insert_many([{"id": f"l{i}"} for i in range(60)]))
+    assert len(result.succeeded) == 60
+    assert engine.request_counts['BatchWriteItem'] == 3
+    assert len(engine.table('arbrit-leads').items) == 60
+
+
+def test_unprocessed_items_are_retried_until_written(run):
+    engine = InMemoryDynamoDB.from_table_definitions(throttle_rate=0.3, throttle_tables=['arbrit-leads'], seed=7)
+    db = InMemoryDynamoDBDatabase(engine)
+    
+    async def scenario():
+        result = await db.leads.insert_many([{"id": f"l{i}"} for i in range(100)])
+        deleted = await db.leads.delete_many({})
+        return result, deleted
+    
+    result, deleted = run(scenario())
+    assert result.ok and len(result.succeeded) == 100
+    assert db.table_stats('arbrit-leads')['unprocessed'] > 0
+    assert deleted.ok and len(deleted.succeeded) == 100
+    assert not engine.table('arbrit-leads').items
+
+
+def test_a_rejected_batch_is_written_item_by_item(run, db):
+    # One oversized item makes BatchWriteItem reject the whole batch
+    documents = [{"id": "ok1"}, {"id": "big", "blob": "x" * (500 * 1024)}, {"id": "ok2"}]
+    result = run(db.leads.insert_many(documents))
+    assert result.succeeded == [0, 2]
+    assert list(result.failed) == [1]
+
+
+def test_replaced_documents_share_the_outcome_of_the_document_written(run, db):
+    documents = [
+        {"id": "big", "status": "new"},
+        {"id": "ok", "status": "new"},
+        {"id": "big", "status": "won"},
+        {"id": "ok", "status": "won"},
+        {"id": "big", "blob": "x" * (500 * 1024)},
+    ]
+    result = run(db.leads.insert_many(documents))
+    assert result.succeeded == [1, 3]
+    assert sorted(result.failed) == [0, 2, 4]
+    assert result.failed[0] == result.failed[4]
+
+
+def test_delete_many_deletes_only_matching_items(run, db):
+    async def scenario():
+        await db.leads.insert_many([{"id": f"l{i}", "status": "lost" if i % 2 else "new"} for i in range(40)])
+        result = await db.leads.delete_many({"status": "lost"})
+        return result, await db.leads.find({}).to_list(None)
+    
+    result, remaining = run(scenario())
+    assert len(result.succeeded) == 20
+    assert len(remaining) == 20 and all(lead["status"] == "new" for lead in remaining)
+
+
+def test_delete_many_of_nothing_writes_nothing(run, db, engine):
+    result = run(db.leads.delete_many({"status": "missing"}))
+    assert result.ok and result.succeeded == []
+    assert engine.request_counts['BatchWriteItem'] == 0
@@ -0,0 +1,203 @@
+"""Change events of writes: in-process subscribers, the journal and Streams-shaped consumers"""
+
+import json
+import threading
+
+from dynamodb_layer import ChangeEvent, ChangeJournal, ChangeStreamConsumer, DynamoDBChangeFeed
+from dynamodb_memory import InMemoryDynamoDB, InMemoryDynamoDBDatabase
+
+
+def _summary(events):
+    return [(e.table, e.operation, e.keys, e.old_image, e.new_image) for e in events]
+
+
+def _subscribe(db, tables=None):
+    events = []
+    
+    async def collect(event):
+        events.append(event)
+    
+    db.changes.subscribe(collect, tables=tables)
+    return events
+
+
+def test_single_writes_publish_old_and_new_images(run, db):
+    events = _subscribe(db)
+    
+    async def scenario():
+        await db.leads.insert_one({"id": "l1", "status": "new", "value": 1.5})
+        await db.leads.update_one({"id": "l1"}, {"$set": {"status": "won"}})
+        await db.leads.update_one({"id": "l1"}, {"$set": {"status": "won"}})  # changes nothing
+        await db.leads.delete_one({"id": "l1"})
+        await db.leads.delete_one({"id": "l1"})  # nothing to delete
+        await db.changes.flush()
+    
+    run(scenario())
+    assert _summary(events) == [
+        ('arbrit-leads', 'INSERT', {"id": "l1"}, None, {"id": "l1", "status": "new", "value": 1.5}),
+        ('arbrit-leads', 'MODIFY', {"id": "l1"}, {"id": "l1", "status": "new", "value": 1.5},
+         {"id": "l1", "status": "won", "value": 1.5}),
+        ('arbrit-leads', 'REMOVE', {"id": "l1"}, {"id": "l1", "status": "won", "value": 1.5}, None),
+    ]
+    assert [int(e.sequence_number) for e in events] == [1, 2, 3]
+
+
+def test_bulk_writes_and_transactions_publish_every_written_item(run, db):
+    events = _subscribe(db, tables=['leads', 'work_orders'])
+    
+    async def scenario():
+        await db.leads.insert_many([{"id": "l1", "status": "new"}, {"id": "l2"}, {"id": "l1", "status": "won"}])
+        await db.delivery_tasks.insert_one({"id": "t1"})  # not subscribed
+        async with db.transaction() as tx:
+            tx.put('work_orders', {"id": "w1"})
+            tx.update('leads', {"id": "l2"}, {"$set": {"status": "lost"}})
+        await db.leads.delete_many({})
+        await db.changes.flush()
+    
+    run(scenario())
+    summary = [(e.table, e.operation, e.keys["id"]) for e in events]
+    # Batches publish in write order, not input order
+    assert sorted(summary[:2]) == [('arbrit-leads', 'INSERT', 'l1'), ('arbrit-leads', 'INSERT', 'l2')]
+    assert summary[2:4] == [('arbrit-work-orders', 'INSERT', 'w1'), ('arbrit-leads', 'MODIFY', 'l2')]
+    assert sorted(summary[4:]) == [('arbrit-leads', 'REMOVE', 'l1'), ('arbrit-leads', 'REMOVE', 'l2')]
+    inserted = {e.keys["id"]: e.new_image for e in events[:2]}
+    assert inserted["l1"] == {"id": "l1", "status": "won"}  # the duplicate's last document is the one written
+    assert events[3].old_image == {"id": "l2"} and events[3].new_image == {"id": "l2", "status": "lost"}
+
+
+def test_failing_subscriber_does_not_fail_writes(run, db):
+    async def failing(event):
+        raise RuntimeError("subscriber bug")
+    
+    db.changes.subscribe(failing)
+    
+    async def scenario():
+        await db.leads.insert_one({"id": "l1"})
+        await db.changes.flush()
+        return await db.leads.find_one({"id": "l1"})
+    
+    assert run(scenario()) == {"id": "l1"}
+    assert db.changes.stats()['subscribers'][0]['failed'] == 1
+
+
+def test_search_shadow_attributes_stay_out_of_events(run, make_db):
+    db = make_db(search_fields='employees:designation')
+    events = _subscribe(db)
+    
+    async def scenario():
+        await db.employees.insert_one({"id": "e1", "designation": "Trainer"})
+        await db.changes.flush()
+    
+    run(scenario())
+    assert events[0].new_image == {"id": "e1", "designation": "Trainer"}
+
+
+def test_journal_replays_events_once_and_continues_numbering(run, make_db, tmp_path):
+    path = str(tmp_path / 'changes.jsonl')
+    db = make_db(change_journal=path)
+    
+    async def write(database, lead_id):
+        await database.leads.insert_one({"id": lead_id, "blob": b"\x00\x01"})
+        await database.changes.close()
+    
+    run(write(db, "l1"))
+    run(write(db, "l2"))
+    # A second process (or a restart) numbers after the journal's last record
+    run(write(make_db(change_journal=path), "l3"))
+    
+    replayed = []
+    
+    async def collect(event):
+        replayed.append(event)
+    
+    consumer = ChangeStreamConsumer(collect)
+    assert run(consumer.replay(ChangeJournal(path))) == 3
+    assert run(consumer.replay(ChangeJournal(path))) == 0
+    assert [(e.keys["id"], int(e.sequence_number)) for e in replayed] == [("l1", 1), ("l2", 2), ("l3", 3)]
+    assert replayed[0].new_image == {"id": "l1", "blob": b"\x00\x01"}
+    with open(path) as f:
+        assert [json.loads(line)['eventName'] for line in f] == ['INSERT'] * 3
+
+
+def test_journal_skips_a_torn_last_line(tmp_path):
+    path = tmp_path / 'changes.jsonl'
+    path.write_text('{"eventName": "INS')
+    journal = ChangeJournal(str(path))
+    assert journal.last_sequence_number() is None
+    assert list(journal.records()) == []
+
+
+def test_journal_rotates_by_size_and_keeps_numbering(tmp_path):
+    path = str(tmp_path / 'changes.jsonl')
+    journal = ChangeJournal(path, max_bytes=1000, backups=50)
+    last = 0
+    for i in range(30):
+        last = journal.append([ChangeEvent('arbrit-leads', 'INSERT', {"id": f"l{i}"}, None, {"id": f"l{i}"})])
+    journal.close()
+    
+    assert (tmp_path / 'changes.jsonl.1').exists()
+    assert all(p.stat().st_size < 1000 + 400 for p in tmp_path.iterdir())
+    # A new process continues after the newest record, even when the current file is empty
+    assert int(ChangeJournal(path, backups=50).last_sequence_number()) == last == 30
+    sequence_numbers = [int(r['dynamodb']['SequenceNumber']) for r in ChangeJournal(path, backups=50).records()]
+    assert sequence_numbers == list(range(1, 31))
+
+
+def test_journal_keeps_only_its_backups(tmp_path):
+    journal = ChangeJournal(str(tmp_path / 'changes.jsonl'), max_bytes=1, backups=2)
+    for i in range(5):
+        journal.append([ChangeEvent('arbrit-leads', 'INSERT', {"id": f"l{i}"}, None, {"id": f"l{i}"})])
+    journal.close()
+    assert sorted(p.name for p in tmp_path.iterdir()) == ['changes.jsonl.1', 'changes.jsonl.2']
+    assert [r['dynamodb']['Keys']['id'] for r in journal.records()] == [{"S": "l3"}, {"S": "l4"}]
+
+
+def test_journal_appends_run_off_the_event_loop(run, tmp_path):
+    journal = ChangeJournal(str(tmp_path / 'changes.jsonl'))
+    threads = []
+    append = journal.append
+    
+    def recording_append(events, after=0):
+        threads.append(threading.current_thread())
+        return append(events, after)
+    
+    journal.append = recording_append
+    feed = DynamoDBChangeFeed(journal)
+    
+    async def scenario():
+        await feed.publish([ChangeEvent('arbrit-leads', 'INSERT', {"id": "l1"}, None, {"id": "l1"})])
+        await feed.close()
+    
+    run(scenario())
+    assert threads and threads[0] is not threading.main_thread()
+    assert journal.last_sequence_number() == f"{1:021d}"
+
+
+def test_stream_consumer_reads_the_in_memory_streams_stand_in(run):
+    engine = InMemoryDynamoDB.from_table_definitions(streams=True)
+    db = InMemoryDynamoDBDatabase(engine)
+    live = _subscribe(db, tables=['leads'])
+    polled = []
+    
+    async def collect(event):
+        polled.append(event)
+    
+    consumer = ChangeStreamConsumer(collect)
+    
+    async def scenario():
+        await db.leads.insert_many([{"id": f"l{i}", "status": "new"} for i in range(5)])
+        await db.leads.update_one({"id": "l0"}, {"$set": {"status": "won"}})
+        await db.leads.delete_one({"id": "l1"})
+        await db.changes.flush()
+        client = await db.get_client()
+        stream_arn = (await client.describe_table(TableName='arbrit-leads'))['Table']['LatestStreamArn']
+        streams = engine.streams_client()
+        first = await consumer.poll(streams, stream_arn, limit=2)
+        await db.leads.insert_one({"id": "l9"})
+        await db.changes.flush()
+        second = await consumer.poll(streams, stream_arn)
+        return first, second
+    
+    first, second = run(scenario())
+    assert (first, second) == (7, 1)
+    assert _summary(polled) == _summary(live)
@@ -0,0 +1,90 @@
+"""Single-pass converters to and from DynamoDB values, and LazyItem/raw cursor results"""
+
+from datetime import date, datetime, timezone
+from decimal import Decimal
+
+from boto3.dynamodb.types import Binary
+
+from dynamodb_layer import LazyItem, encode_item, from_dynamodb_value, to_dynamodb_value
+
+
+def test_to_dynamodb_value_converts_what_dynamodb_cannot_store():
+    moment = datetime(2024, 3, 1, 9, 30, tzinfo=timezone.utc)
+    converted = to_dynamodb_value({
+        "price": 1.1,
+        "count": 3,
+        "active": True,
+        "at": moment,
+        "day": date(2024, 3, 1),
+        "pair": (1, 2.5),
+        "empty": set(),
+        "tags": {"a"},
+        "nested": {1: [0.5, None]},
+        "exact": Decimal("2.50"),
+    })
+    assert converted == {
+        "price": Decimal("1.1"),
+        "count": 3,
+        "active": True,
+        "at": "2024-03-01T09:30:00+00:00",
+        "day": "2024-03-01",
+        "pair": [1, Decimal("2.5")],
+        "empty": [],
+        "tags": {"a"},
+        "nested": {"1": [Decimal("0.5"), None]},
+        "exact": Decimal("2.50"),
+    }
+    assert type(converted["active"]) is bool
+
+
+def test_from_dynamodb_value_returns_plain_python():
+    converted = from_dynamodb_value({
+        "whole": Decimal("5"),
+        "fraction": Decimal("1.5"),
+        "tags": {"a"},
+        "blob": Binary(b"\x00\x01"),
+        "nested": [{"n": Decimal("2")}],
+        "flag": False,
+    })
+    assert converted == {"whole": 5, "fraction": 1.5, "tags": ["a"], "blob": b"\x00\x01",
+                         "nested": [{"n": 2}], "flag": False}
+    assert type(converted["whole"]) is int and type(converted["fraction"]) is float
+
+
+def test_documents_round_trip_through_the_table(run, db):
+    document = {"id": "l1", "value": 0.1, "count": 7, "created_at": datetime(2024, 1, 2, tzinfo=timezone.utc),
+                "tags": ("a", "b"), "notes": None, "meta": {"score": 9.75}}
+    
+    async def scenario():
+        await db.leads.insert_one(document)
+        return await db.leads.find_one({"id": "l1"})
+    
+    assert run(scenario()) == {"id": "l1", "value": 0.1, "count": 7, "created_at": "2024-01-02T00:00:00+00:00",
+                               "tags": ["a", "b"], "notes": None, "meta": {"score": 9.75}}
+
+
+def test_lazy_item_decodes_attributes_on_first_access():
+    item = LazyItem(encode_item(to_dynamodb_value({"id": "l1", "value": 2.5, "tags": ["a"]})))
+    assert not item._decoded
+    assert item["value"] == 2.5
+    assert list(item._decoded) == ["value"]
+    assert "tags" in item and "missing" not in item and len(item) == 3
+    assert item.get("missing") is None
+    assert item.to_dict() == dict(item) == {"id": "l1", "value": 2.5, "tags": ["a"]}
+
+
+def test_lazy_and_raw_cursors_return_the_same_documents(run, make_db):
+    db = make_db(search_fields='leads:name')
+    
+    async def scenario():
+        await db.leads.insert_many([{"id": f"l{i}", "name": f"Lead {i}", "value": i / 2} for i in range(5)])
+        eager = await db.leads.find({}).sort("id").to_list(None)
+        lazy = await db.leads.find({}).sort("id").lazy().to_list(None)
+        raw = await db.leads.find({}).sort("id").raw().to_list(None)
+        return eager, lazy, raw
+    
+    eager, lazy, raw = run(scenario())
+    assert [item.to_dict() for item in lazy] == eager
+    # Raw items are AttributeValue maps, without the search shadow attributes
+    assert raw[1] == {"id": {"S": "l1"}, "name": {"S": "Lead 1"}, "value": {"N": "0.5"}}
+    assert [item["id"]["S"] for item in raw] == [document["id"] for document in eager]
@@ -0,0 +1,89 @@
+"""Server-side counts: Select=COUNT pages, index queries, approximate and parallel counts"""
+
+import asyncio
+
+from dynamodb_memory import InMemoryDynamoDB, InMemoryDynamoDBDatabase
+
+LEADS = [{"id": f"l{i:03d}", "status": "won" if i % 4 == 0 else "new", "note": "x" * 100} for i in range(60)]
+
+
+def test_count_follows_every_page_without_returning_items(run):
+    engine = InMemoryDynamoDB.from_table_definitions(page_size_bytes=1024)
+    db = InMemoryDynamoDBDatabase(engine)
+    
+    async def scenario():
+        await db.leads.insert_many(LEADS)
+        engine.reset_metrics()
+        return await db.leads.count(), await db.leads.count({"status": "won"})
+    
+    total, won = run(scenario())
+    assert (total, won) == (60, 15)
+    assert engine.request_counts['Scan'] > 2
+
+
+def test_count_matches_find(run, db):
+    async def scenario():
+        await db.leads.insert_many(LEADS)
+        query = {"status": "new", "id": {"$gte": "l030"}}
+        return await db.leads.count(query), len(await db.leads.find(query).to_list(None))
+    
+    counted, found = run(scenario())
+    assert counted == found == sum(1 for lead in LEADS if lead["status"] == "new" and lead["id"] >= "l030")
+
+
+def test_count_uses_an_index_query(run, db, engine):
+    async def scenario():
+        await db.employees.insert_many([{"id": f"e{i}", "department": "Sales" if i < 7 else "Ops"} for i in range(10)])
+        engine.reset_metrics()
+        return await db.employees.count_documents({"department": "Sales"})
+    
+    assert run(scenario()) == 7
+    assert engine.request_counts['Query'] == 1 and engine.request_counts['Scan'] == 0
+
+
+def test_count_of_an_empty_in_reads_nothing(run, db, engine):
+    async def scenario():
+        await db.leads.insert_many(LEADS)
+        engine.reset_metrics()
+        return await db.leads.count({"status": {"$in": []}})
+    
+    assert run(scenario()) == 0
+    assert engine.request_counts['Scan'] == 0 and engine.request_counts['Query'] == 0
+
+
+def test_approximate_count_reads_item_count(run, db, engine):
+    async def scenario():
+        await db.leads.insert_many(LEADS)
+        engine.reset_metrics()
+        return await db.leads.count(approximate=True)
+    
+    assert run(scenario()) == 60
+    assert engine.request_counts['Scan'] == 0
+
+
+def test_approximate_is_ignored_for_filtered_counts(run, db):
+    async def scenario():
+        await db.leads.insert_many(LEADS)
+        return await db.count_items('leads', {"status": "won"}, approximate=True)
+    
+    assert run(scenario()) == 15
+
+
+def test_parallel_count_adds_up_segments(run, db, engine):
+    async def scenario():
+        await db.leads.insert_many(LEADS)
+        engine.reset_metrics()
+        return await db.leads.count({"status": "new"}, segments=4)
+    
+    assert run(scenario()) == 45
+    assert engine.request_counts['Scan'] == 4
+
+
+def test_concurrent_identical_counts_share_one_scan(run, db, engine):
+    async def scenario():
+        await db.leads.insert_many(LEADS)
+        engine.reset_metrics()
+        return await asyncio.gather(*(db.leads.count({"status": "won"}) for _ in range(5)))
+    
+    assert run(scenario()) == [15] * 5
+    assert engine.request_counts['Scan'] == 1
@@ -0,0 +1,63 @@
+"""DynamoDBCounters: atomic number blocks, seeding, and the certificate numbers built on them"""
+
+import asyncio
+from datetime import datetime, timezone
+
+import pytest
+
+
+def test_reserve_hands_out_consecutive_blocks(run, db):
+    async def scenario():
+        return [await db.counters.reserve('invoice', 3), await db.counters.next('invoice'),
+                await db.counters.current('invoice'), await db.counters.current('unused')]
+    
+    first, second, current, unused = run(scenario())
+    assert (first, second, current, unused) == (range(1, 4), 4, 4, 0)
+
+
+def test_concurrent_reservations_never_overlap(run, db):
+    sizes = [1, 5, 2, 8, 1, 3, 4, 1, 6, 2]
+    
+    async def scenario():
+        return await asyncio.gather(*(db.counters.reserve('certificate_no#2403', size) for size in sizes))
+    
+    blocks = run(scenario())
+    numbers = sorted(number for block in blocks for number in block)
+    assert numbers == list(range(1, sum(sizes) + 1))
+    assert [len(block) for block in blocks] == sizes
+
+
+def test_seed_only_raises_a_counter(run, db):
+    async def scenario():
+        raised = await db.counters.seed('invoice', 10)
+        lowered = await db.counters.seed('invoice', 4)
+        return raised, lowered, await db.counters.next('invoice')
+    
+    assert run(scenario()) == (True, False, 11)
+
+
+def test_reserving_nothing_is_rejected(run, db):
+    with pytest.raises(ValueError):
+        run(db.counters.reserve('invoice', 0))
+
+
+def test_certificate_numbers_continue_after_certificates_issued_this_month(run, db, monkeypatch):
+    server = pytest.importorskip('server')
+    monkeypatch.setattr(server, 'db', db)
+    monkeypatch.setattr(server, '_seeded_certificate_counters', set())
+    now = datetime(2024, 3, 15, 10, 0, tzinfo=timezone.utc)
+    
+    async def scenario():
+        # Two certificates issued this month (and one last month) before the counter existed
+        await db.certificate_candidates.insert_many([
+            {"id": "c1", "generated_at": "2024-03-02T09:00:00+00:00"},
+            {"id": "c2", "generated_at": "2024-03-10T09:00:00+00:00"},
+            {"id": "c0", "generated_at": "2024-02-28T09:00:00+00:00"},
+        ])
+        first, second = await asyncio.gather(server.reserve_certificate_numbers(now, 3),
+                                             server.reserve_certificate_numbers(now, 2))
+        return first, second, await server.reserve_certificate_numbers(now, 0)
+    
+    first, second, none = run(scenario())
+    assert sorted(first + second) == [f"ARB/24/03/{number:03d}" for number in range(3, 8)]
+    assert none == []
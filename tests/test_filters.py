@@ -0,0 +1,86 @@
+"""compile_filter: Mongo filter operators evaluated by DynamoDB, checked against Mongo semantics"""
+
+import pytest
+
+from dynamodb_layer import UnsupportedFilterError, compile_filter
+
+LEADS = [
+    {"id": "l1", "status": "new", "value": 10, "tags": ["a", "b"], "name": "Alice Smith", "assigned_to": "u1"},
+    {"id": "l2", "status": "won", "value": 20, "tags": ["b"], "name": "bob jones", "assigned_to": None},
+    {"id": "l3", "status": "lost", "value": 30, "name": "Carol"},
+    {"id": "l4", "status": "new", "value": 5, "tags": [], "name": "ALICE", "assigned_to": "u2"},
+]
+
+
+@pytest.fixture
+def leads(run, make_db):
+    db = make_db(search_fields='leads:name')
+    run(db.leads.insert_many(LEADS))
+    
+    def find(filter_dict):
+        return sorted(lead["id"] for lead in run(db.leads.find(filter_dict).to_list(None)))
+    return find
+
+
+@pytest.mark.parametrize('filter_dict, expected', [
+    ({"status": "new"}, ["l1", "l4"]),
+    ({"status": {"$eq": "won"}}, ["l2"]),
+    ({"status": {"$ne": "new"}}, ["l2", "l3"]),
+    ({"value": {"$gt": 10}}, ["l2", "l3"]),
+    ({"value": {"$gte": 10, "$lte": 20}}, ["l1", "l2"]),
+    ({"value": {"$gt": 5, "$lt": 30}}, ["l1", "l2"]),
+    ({"status": {"$in": ["won", "lost"]}}, ["l2", "l3"]),
+    ({"status": {"$in": []}}, []),
+    # Like Mongo, $nin and $ne also match documents without the field
+    ({"assigned_to": {"$nin": ["u1", "u2"]}}, ["l2", "l3"]),
+    ({"assigned_to": {"$ne": "u1"}}, ["l2", "l3", "l4"]),
+    # None matches a missing field and a null one; $ne None only set, non-null values
+    ({"assigned_to": None}, ["l2", "l3"]),
+    ({"assigned_to": {"$ne": None}}, ["l1", "l4"]),
+    ({"assigned_to": {"$in": [None, "u2"]}}, ["l2", "l3", "l4"]),
+    ({"assigned_to": {"$exists": True}}, ["l1", "l2", "l4"]),
+    ({"assigned_to": {"$exists": False}}, ["l3"]),
+    ({"value": {"$not": {"$gt": 10}}}, ["l1", "l4"]),
+    ({"tags": {"$size": 0}}, ["l4"]),
+    ({"tags": {"$all": ["a", "b"]}}, ["l1"]),
+    ({"tags": {"$all": []}}, []),
+    ({"$or": [{"status": "won"}, {"value": {"$lt": 10}}]}, ["l2", "l4"]),
+    ({"$or": [{"status": "won"}, {"status": {"$in": []}}]}, ["l2"]),
+    ({"$and": [{"status": "new"}, {"value": {"$gt": 5}}]}, ["l1"]),
+    ({"$nor": [{"status": "new"}, {"value": 20}]}, ["l3"]),
+    ({"status": "new", "$or": [{"assigned_to": "u2"}, {"value": 10}]}, ["l1", "l4"]),
+    ({"name": {"$regex": "^bob"}}, ["l2"]),
+    ({"name": {"$regex": "Smith"}}, ["l1"]),
+    ({"name": {"$regex": "^Carol$"}}, ["l3"]),
+    ({"name": {"$regex": "alice", "$options": "i"}}, ["l1", "l4"]),
+    ({"name": {"$regex": "^BOB", "$options": "i"}}, ["l2"]),
+    ({"name": {"$regex": "a\\.b"}}, []),
+])
+def test_filter_matches_like_mongo(leads, filter_dict, expected):
+    assert leads(filter_dict) == expected
+
+
+def test_case_insensitive_regex_without_shadow_attributes_tries_common_capitalizations(run, db):
+    run(db.leads.insert_many(LEADS))
+    found = run(db.leads.find({"name": {"$regex": "alice", "$options": "i"}}).to_list(None))
+    assert sorted(lead["id"] for lead in found) == ["l1", "l4"]
+
+
+def test_empty_filter_matches_everything():
+    assert compile_filter({}) is None
+    assert compile_filter({"$or": [{}, {"status": "new"}]}) is None
+
+
+@pytest.mark.parametrize('filter_dict', [
+    {"name": {"$regex": "^a.*b"}},
+    {"name": {"$regex": "Smith$"}},
+    {"name": {"$regex": "alice", "$options": "m"}},
+    {"name": {"$options": "i"}},
+    {"value": {"$mod": [2, 0]}},
+    {"value": {"$gt": 1, "other": 2}},
+    {"$where": "this.value > 1"},
+    {"$or": []},
+])
+def test_unsupported_filters_are_rejected(filter_dict):
+    with pytest.raises(UnsupportedFilterError):
+        compile_filter(filter_dict)
@@ -0,0 +1,65 @@
+"""Read-through ItemCache: key lookups are served from memory and dropped after writes"""
+
+
+def _cached_db(make_db):
+    return make_db(cache_tables='users,employees')
+
+
+def test_key_lookups_are_served_from_the_cache(run, make_db, engine):
+    db = _cached_db(make_db)
+    
+    async def scenario():
+        await db.employees.insert_one({"id": "e1", "name": "Asha", "department": "Sales"})
+        first = await db.employees.find_one({"id": "e1"})
+        second = await db.employees.find_one({"id": "e1"})
+        return first, second
+    
+    first, second = run(scenario())
+    assert first == second == {"id": "e1", "name": "Asha", "department": "Sales"}
+    assert engine.request_counts['GetItem'] == 1
+    assert db.employees.cache.stats()['hits'] == 1
+
+
+def test_update_and_delete_invalidate_the_cached_item(run, make_db):
+    db = _cached_db(make_db)
+    
+    async def scenario():
+        await db.employees.insert_one({"id": "e1", "name": "Asha"})
+        await db.employees.find_one({"id": "e1"})
+        await db.employees.update_one({"id": "e1"}, {"$set": {"name": "Asha K"}})
+        updated = await db.employees.find_one({"id": "e1"})
+        await db.employees.delete_one({"id": "e1"})
+        deleted = await db.employees.find_one({"id": "e1"})
+        return updated, deleted
+    
+    updated, deleted = run(scenario())
+    assert updated["name"] == "Asha K"
+    assert deleted is None
+
+
+def test_index_lookups_are_invalidated_by_writes_to_the_item(run, make_db):
+    db = _cached_db(make_db)
+    
+    async def scenario():
+        await db.users.insert_one({"mobile": "971500000001", "id": "u1", "name": "Omar"})
+        # users is keyed by mobile; a lookup by id goes through id-index
+        await db.users.find_one({"id": "u1"})
+        await db.users.update_one({"mobile": "971500000001"}, {"$set": {"name": "Omar R"}})
+        return await db.users.find_one({"id": "u1"})
+    
+    assert run(scenario())["name"] == "Omar R"
+
+
+def test_bulk_writes_and_transactions_invalidate_cached_items(run, make_db):
+    db = _cached_db(make_db)
+    
+    async def scenario():
+        await db.employees.insert_many([{"id": "e1", "name": "A"}, {"id": "e2", "name": "B"}])
+        await db.employees.find_many_by_keys(["e1", "e2"])
+        await db.employees.insert_many([{"id": "e1", "name": "A2"}])
+        async with db.transaction() as tx:
+            tx.update('employees', {"id": "e2"}, {"$set": {"name": "B2"}})
+        return await db.employees.find_many_by_keys(["e1", "e2"])
+    
+    found = run(scenario())
+    assert {key: item["name"] for key, item in found.items()} == {"e1": "A2", "e2": "B2"}
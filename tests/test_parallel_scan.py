@@ -0,0 +1,77 @@
+"""When reads are split into parallel scan segments, and that the segments add up to a sequential scan"""
+
+import pytest
+
+from dynamodb_layer import TableSchema
+
+LEADS = [{"id": f"l{i:03d}", "status": "new" if i % 3 else "won", "note": "x" * 200} for i in range(90)]
+
+
+@pytest.fixture
+def seeded(run, make_db, monkeypatch):
+    """Factory of databases over 90 leads (~20KB) with the given parallel scan settings"""
+    run(make_db().leads.insert_many(LEADS))
+    
+    def make(segments='4', min_bytes='10000'):
+        monkeypatch.setenv('DYNAMODB_PARALLEL_SCAN_SEGMENTS', segments)
+        monkeypatch.setenv('DYNAMODB_PARALLEL_SCAN_MIN_BYTES', min_bytes)
+        return make_db()
+    return make
+
+
+@pytest.mark.parametrize('segments, size_bytes, expected', [
+    (4, 8 * 1024 * 1024, 4),
+    (4, 8 * 1024 * 1024 - 1, 1),
+    (1, 1024 ** 3, 1),
+])
+def test_auto_scan_segments_from_table_size(make_db, monkeypatch, segments, size_bytes, expected):
+    monkeypatch.setenv('DYNAMODB_PARALLEL_SCAN_SEGMENTS', str(segments))
+    db = make_db()
+    assert db.auto_scan_segments(TableSchema('id', size_bytes=size_bytes)) == expected
+
+
+@pytest.mark.parametrize('min_bytes, scans', [('10000', 4), ('100000000', 1)])
+def test_large_tables_are_scanned_in_segments(run, seeded, engine, min_bytes, scans):
+    db = seeded(min_bytes=min_bytes)
+    engine.reset_metrics()
+    leads = run(db.leads.find({"status": "won"}).to_list(None))
+    assert sorted(lead["id"] for lead in leads) == sorted(lead["id"] for lead in LEADS if lead["status"] == "won")
+    assert engine.request_counts['Scan'] == scans
+
+
+def test_parallel_can_be_forced_or_disabled_per_cursor(run, seeded, engine):
+    db = seeded(min_bytes='100000000')
+    engine.reset_metrics()
+    forced = run(db.leads.find({}).parallel(3).to_list(None))
+    assert engine.request_counts['Scan'] == 3
+    
+    db = seeded(min_bytes='0')
+    engine.reset_metrics()
+    sequential = run(db.leads.find({}).parallel(1).to_list(None))
+    assert engine.request_counts['Scan'] == 1
+    assert sorted(lead["id"] for lead in forced) == sorted(lead["id"] for lead in sequential)
+
+
+def test_order_by_key_merges_segments_in_key_order(run, seeded):
+    db = seeded()
+    leads = run(db.leads.find({}).parallel(4, order_by_key=True).to_list(None))
+    assert [lead["id"] for lead in leads] == sorted(lead["id"] for lead in LEADS)
+
+
+def test_limit_stops_every_segment_early(run, seeded):
+    db = seeded()
+    leads = run(db.leads.find({}).to_list(10))
+    assert len(leads) == 10
+
+
+def test_queries_are_never_split(run, make_db, engine, monkeypatch):
+    monkeypatch.setenv('DYNAMODB_PARALLEL_SCAN_MIN_BYTES', '0')
+    db = make_db()
+    
+    async def scenario():
+        await db.employees.insert_many([{"id": f"e{i}", "department": "Sales"} for i in range(10)])
+        engine.reset_metrics()
+        return await db.employees.find({"department": "Sales"}).parallel(4).to_list(None)
+    
+    assert len(run(scenario())) == 10
+    assert engine.request_counts['Query'] == 1 and engine.request_counts['Scan'] == 0
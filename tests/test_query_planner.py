@@ -0,0 +1,160 @@
+"""Which index or scan the planner picks, and plans bound from the PlanCache"""
+
+import pytest
+
+from dynamodb_layer import PlanCache, TableSchema, plan_query
+from dynamodb_memory import _DynamoError
+
+
+@pytest.mark.parametrize('collection, filter_dict, sort_key, expected', [
+    ('users', {"mobile": "971500000001"}, None, ('GetItem', None)),
+    ('users', {"id": "u1"}, None, ('Query', 'id-index')),
+    ('employees', {"department": "Sales"}, None, ('Query', 'department-index')),
+    ('employees', {"department": "Sales", "designation": "SALES_HEAD"}, None, ('Query', 'department-index')),
+    ('employees', {"department": {"$in": ["Sales", "Academic"]}}, None, ('Scan', None)),
+    ('employees', {"designation": "COO"}, None, ('Scan', None)),
+    ('attendance', {"employee_id": "e1"}, "date", ('Query', 'employee_id-index')),
+    ('attendance', {"date": "2024-01-01"}, None, ('Query', 'date-index')),
+    ('employees', {"department": {"$in": []}}, None, (None, None)),
+    ('employees', {}, None, ('Scan', None)),
+])
+def test_planner_picks_key_lookup_index_or_scan(run, db, collection, filter_dict, sort_key, expected):
+    explained = run(getattr(db, collection).explain(filter_dict, sort_key))
+    assert (explained['operation'], explained['index']) == expected
+
+
+def test_planned_reads_return_the_same_items_as_a_scan(run, db, engine):
+    async def scenario():
+        await db.employees.insert_many([
+            {"id": f"e{i}", "mobile": f"9715{i:08d}", "department": ["Sales", "Academic", "HR"][i % 3],
+             "designation": "TRAINER" if i % 4 == 0 else "STAFF"}
+            for i in range(40)
+        ])
+        queried = await db.employees.find({"department": "Sales", "designation": "TRAINER"}).to_list(None)
+        every = await db.employees.find({}).to_list(None)
+        return queried, every
+    
+    engine.reset_metrics()
+    queried, every = run(scenario())
+    expected = [e for e in every if e["department"] == "Sales" and e["designation"] == "TRAINER"]
+    assert sorted(e["id"] for e in queried) == sorted(e["id"] for e in expected)
+    assert engine.request_counts['Query'] == 1
+
+
+def _employees_schema(engine):
+    return TableSchema.from_description(engine.table('arbrit-employees').describe())
+
+
+def _describe_table_denied(params):
+    raise _DynamoError('AccessDeniedException', "not authorized to perform: dynamodb:DescribeTable")
+
+
+@pytest.mark.parametrize('first, second', [
+    ({"department": "Sales"}, {"department": "HR"}),
+    ({"department": "Sales", "designation": {"$in": ["A", "B"]}},
+     {"department": "HR", "designation": {"$in": ["C", "D"]}}),
+    ({"status": {"$nin": ["DELIVERED", "FAILED"]}, "due_date": {"$lt": "2024-01-01", "$ne": None}},
+     {"status": {"$nin": ["RETURNED", "LOST"]}, "due_date": {"$lt": "2025-06-30", "$ne": None}}),
+    ({"$or": [{"designation": {"$regex": "trainer", "$options": "i"}}, {"role": "x"}]},
+     # $regex patterns are part of the shape; only the other values are bound
+     {"$or": [{"designation": {"$regex": "trainer", "$options": "i"}}, {"role": "y"}]}),
+    ({"id": {"$ne": "e1"}, "is_default": True}, {"id": {"$ne": "e2"}, "is_default": False}),
+])
+def test_plan_cache_binds_new_values_into_cached_shapes(engine, first, second):
+    cache = PlanCache()
+    schema = _employees_schema(engine)
+    cache.plan('arbrit-employees', schema, first)
+    cached = cache.plan('arbrit-employees', schema, second)
+    uncached = plan_query(schema, second)
+    
+    assert cache.stats()['hits'] == 1
+    assert (cached.operation, cached.index_name) == (uncached.operation, uncached.index_name)
+    bound = cached.client_kwargs('arbrit-employees').get('ExpressionAttributeValues', {})
+    planned = uncached.client_kwargs('arbrit-employees').get('ExpressionAttributeValues', {})
+    assert sorted(map(str, bound.values())) == sorted(map(str, planned.values()))
+
+
+def test_plan_cache_keeps_shapes_apart(engine):
+    cache = PlanCache()
+    schema = _employees_schema(engine)
+    cache.plan('arbrit-employees', schema, {"department": "Sales"})
+    # Same field, different operator: a different shape, planned from scratch
+    plan = cache.plan('arbrit-employees', schema, {"department": {"$in": ["Sales", "HR"]}})
+    assert cache.stats()['hits'] == 0
+    assert plan.operation == 'scan'
+
+
+def test_plan_cache_does_not_keep_plans_of_an_unknown_schema(engine):
+    cache = PlanCache()
+    assert cache.plan('arbrit-employees', TableSchema(None), {"department": "Sales"}).operation == 'scan'
+    plan = cache.plan('arbrit-employees', _employees_schema(engine), {"department": "HR"})
+    assert (plan.operation, plan.index_name) == ('query', 'department-index')
+
+
+def test_plans_recover_after_a_failed_describe_table(run, db, engine, monkeypatch):
+    describe = engine._describe_table
+    
+    def denied_once(params):
+        monkeypatch.setattr(engine, '_describe_table', describe)
+        _describe_table_denied(params)
+    
+    monkeypatch.setattr(engine, '_describe_table', denied_once)
+    
+    async def scenario():
+        await db.employees.plan({"department": "Sales"})
+        db.employees._schema_retry_at = 0.0  # the retry window has passed
+        plan = await db.employees.plan({"department": "HR"})
+        explained = await db.employees.explain({"department": "HR"})
+        return plan, explained
+    
+    plan, explained = run(scenario())
+    assert (plan.operation_name, plan.index_name) == ('Query', 'department-index')
+    assert (explained['operation'], explained['index']) == ('Query', 'department-index')
+
+
+def test_plan_cache_results_match_uncached_plans(run, make_db):
+    async def scenario(db):
+        await db.delivery_tasks.insert_many([
+            {"id": f"t{i}", "status": ["PENDING", "DELIVERED", "FAILED"][i % 3], "due_date": f"2024-01-{i % 28 + 1:02d}"}
+            for i in range(60)
+        ])
+        results = []
+        for cutoff in ("2024-01-05", "2024-01-15", "2024-01-25"):
+            tasks = await db.delivery_tasks.find({"status": {"$nin": ["DELIVERED"]}, "due_date": {"$lt": cutoff}}).to_list(None)
+            results.append(sorted(task["id"] for task in tasks))
+        return results
+    
+    cached_db = make_db()
+    cached = run(scenario(cached_db))
+    assert cached_db.plan_cache_stats()['hits'] == 2
+    
+    uncached_db = make_db()
+    uncached_db.plan_cache.max_items = 0
+    assert run(scenario(uncached_db)) == cached
+
+
+def test_table_definitions_stand_in_for_describe_table(run, db, engine, monkeypatch):
+    monkeypatch.setattr(engine, '_describe_table', _describe_table_denied)
+    
+    async def scenario():
+        await db.employees.insert_many([{"id": f"e{i}", "department": "Sales"} for i in range(3)])
+        engine.reset_metrics()
+        found = await db.employees.find_one({"id": "e1"})
+        by_keys = await db.employees.find_many_by_keys(["e0", "e2"])
+        explained = await db.employees.explain({"department": "Sales"})
+        deleted = await db.employees.delete_many({"department": "Sales"})
+        return found, by_keys, explained, deleted
+    
+    found, by_keys, explained, deleted = run(scenario())
+    assert found["id"] == "e1" and sorted(by_keys) == ["e0", "e2"]
+    assert (explained['operation'], explained['index']) == ('Query', 'department-index')
+    assert deleted.succeeded == [0, 1, 2]
+    assert engine.request_counts['GetItem'] == 1 and engine.request_counts['BatchGetItem'] == 1
+
+
+def test_tables_without_a_definition_are_scanned_while_describe_table_fails(run, make_db, engine, monkeypatch, tmp_path):
+    monkeypatch.setenv('DYNAMODB_TABLE_DEFINITIONS', str(tmp_path / 'missing.json'))
+    db = make_db()
+    monkeypatch.setattr(engine, '_describe_table', _describe_table_denied)
+    explained = run(db.employees.explain({"id": "e1"}))
+    assert explained['operation'] == 'Scan'
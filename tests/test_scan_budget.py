@@ -0,0 +1,151 @@
+"""Scan budgets: truncation, raising, and reads of other requests that run at the same time"""
+
+import asyncio
+
+import pytest
+
+from dynamodb_layer import ScanBudgetExceeded
+from dynamodb_memory import InMemoryDynamoDB, InMemoryDynamoDBDatabase
+
+
+def _leads(count):
+    return [{"id": f"l{i:03d}", "status": "new"} for i in range(count)]
+
+
+def test_truncate_mode_stops_scanning_at_the_item_budget(run, db, engine):
+    async def scenario():
+        await db.leads.insert_many(_leads(50))
+        engine.reset_metrics()
+        with db.scan_budget(max_items=20) as budget:
+            leads = await db.leads.find({"status": "new"}).to_list(None)
+        return leads, budget
+    
+    leads, budget = run(scenario())
+    assert len(leads) == 20
+    assert budget.truncated and budget.items == 20
+    assert engine.request_counts['Scan'] == 1
+
+
+def test_page_budget_counts_scan_pages(run):
+    engine = InMemoryDynamoDB.from_table_definitions(page_size_bytes=256)
+    db = InMemoryDynamoDBDatabase(engine)
+    
+    async def scenario():
+        await db.leads.insert_many(_leads(50))
+        engine.reset_metrics()
+        with db.scan_budget(max_pages=2) as budget:
+            leads = await db.leads.find({}).to_list(None)
+        return leads, budget
+    
+    leads, budget = run(scenario())
+    assert 0 < len(leads) < 50
+    assert budget.truncated and budget.pages == 2
+    assert engine.request_counts['Scan'] == 2
+
+
+def test_key_lookups_and_queries_are_not_charged(run, db):
+    async def scenario():
+        await db.leads.insert_many(_leads(5))
+        await db.employees.insert_many([{"id": f"e{i}", "department": "Sales"} for i in range(5)])
+        with db.scan_budget(max_items=1, mode='raise') as budget:
+            lead = await db.leads.find_one({"id": "l001"})
+            employees = await db.employees.find({"department": "Sales"}).to_list(None)
+        return lead, employees, budget
+    
+    lead, employees, budget = run(scenario())
+    assert lead["id"] == "l001" and len(employees) == 5
+    assert (budget.items, budget.pages, budget.truncated) == (0, 0, False)
+
+
+def test_budget_defaults_come_from_the_environment(run, make_db, monkeypatch):
+    monkeypatch.setenv('DYNAMODB_SCAN_BUDGET_ITEMS', '10')
+    monkeypatch.setenv('DYNAMODB_SCAN_BUDGET_MODE', 'raise')
+    db = make_db()
+    
+    async def scenario():
+        await db.leads.insert_many(_leads(30))
+        with db.scan_budget():
+            await db.leads.find({}).to_list(None)
+    
+    with pytest.raises(ScanBudgetExceeded) as raised:
+        run(scenario())
+    assert raised.value.table_name == 'arbrit-leads'
+    # Outside a scan_budget() block scans are not limited
+    assert len(run(db.leads.find({}).to_list(None))) == 30
+
+
+def test_unknown_budget_mode_is_rejected(db):
+    with pytest.raises(ValueError):
+        with db.scan_budget(mode='ignore'):
+            pass
+
+
+def test_concurrent_reads_do_not_share_a_limiting_budget(run, db, engine):
+    async def budgeted():
+        with db.scan_budget(max_items=5) as budget:
+            leads = await db.leads.find({"status": "new"}).to_list(None)
+        return leads, budget
+    
+    async def unbudgeted():
+        with db.scan_budget() as budget:
+            leads = await db.leads.find({"status": "new"}).to_list(None)
+        return leads, budget
+    
+    async def scenario():
+        await db.leads.insert_many(_leads(50))
+        return await asyncio.gather(budgeted(), unbudgeted())
+    
+    (partial, limited), (complete, counted) = run(scenario())
+    assert len(partial) <= 5 and limited.truncated
+    assert len(complete) == 50 and not counted.truncated
+
+
+def test_raise_mode_fails_only_the_request_over_budget(run, db):
+    async def budgeted():
+        with db.scan_budget(max_items=5, mode='raise'):
+            return await db.leads.find({"status": "new"}).to_list(None)
+    
+    async def scenario():
+        await db.leads.insert_many(_leads(50))
+        return await asyncio.gather(budgeted(), db.leads.find({"status": "new"}).to_list(None),
+                                    return_exceptions=True)
+    
+    failed, complete = run(scenario())
+    assert isinstance(failed, ScanBudgetExceeded)
+    assert len(complete) == 50
+
+
+def test_reads_of_different_endpoints_are_charged_to_each(run, db, engine):
+    async def read(endpoint):
+        with db.metrics.endpoint(endpoint):
+            return await db.leads.find({"status": "new"}).to_list(None)
+    
+    async def scenario():
+        await db.leads.insert_many(_leads(10))
+        engine.reset_metrics()
+        return await asyncio.gather(read("GET /api/leads"), read("GET /api/reports"))
+    
+    first, second = run(scenario())
+    assert len(first) == len(second) == 10
+    assert engine.request_counts['Scan'] == 2
+    scans = {entry['endpoint']: entry['requests'] for entry in db.metrics.summary()['requests']
+             if entry['operation'] == 'Scan'}
+    assert scans == {"GET /api/leads": 1, "GET /api/reports": 1}
+
+
+@pytest.mark.parametrize('budget_items', [None, 5])
+def test_identical_reads_are_coalesced_unless_a_budget_limits_them(run, make_db, engine, budget_items):
+    db = make_db()
+    
+    async def read():
+        with db.scan_budget(max_items=budget_items):
+            return await db.leads.find({"status": "new"}).to_list(None)
+    
+    async def scenario():
+        await db.leads.insert_many(_leads(3))
+        engine.reset_metrics()
+        return await asyncio.gather(read(), read())
+    
+    run(scenario())
+    coalesced = db.single_flight_stats()['coalesced']
+    assert (coalesced, engine.request_counts['Scan']) == ((1, 1) if budget_items is None else (0, 2))
@@ -0,0 +1,113 @@
+"""SingleFlight: identical concurrent reads share one request, never across a write"""
+
+import asyncio
+
+from dynamodb_layer import SingleFlight
+
+
+def test_identical_concurrent_lookups_share_one_request(run, db, engine):
+    async def scenario():
+        await db.leads.insert_one({"id": "l1", "status": "new", "tags": ["a"]})
+        engine.reset_metrics()
+        return await asyncio.gather(*(db.leads.find_one({"id": "l1"}) for _ in range(3)))
+    
+    results = run(scenario())
+    assert engine.request_counts['GetItem'] == 1
+    assert db.single_flight_stats()['coalesced'] == 2
+    # Every caller gets its own copy
+    results[0]["tags"].append("b")
+    assert results[1] == results[2] == {"id": "l1", "status": "new", "tags": ["a"]}
+
+
+def test_different_reads_are_not_shared(run, db, engine):
+    async def scenario():
+        await db.leads.insert_many([{"id": "l1", "status": "new"}, {"id": "l2", "status": "won"}])
+        engine.reset_metrics()
+        return await asyncio.gather(
+            db.leads.find_one({"id": "l1"}),
+            db.leads.find_one({"id": "l2"}),
+            db.leads.find({"status": "new"}).to_list(None),
+            db.leads.find({"status": "new"}, {"id": 1}).to_list(None),
+            db.leads.find({"status": "new"}).to_list(10),
+        )
+    
+    run(scenario())
+    assert engine.request_counts['GetItem'] == 2 and engine.request_counts['Scan'] == 3
+    assert db.single_flight_stats()['coalesced'] == 0
+
+
+def test_read_started_after_a_write_does_not_join_an_earlier_read(run, make_db, engine):
+    engine.latency = lambda operation: 0.05 if operation == 'GetItem' else 0.0
+    db = make_db()
+    
+    async def scenario():
+        await db.leads.insert_one({"id": "l1", "status": "new"})
+        engine.reset_metrics()
+        before = asyncio.ensure_future(db.leads.find_one({"id": "l1"}))
+        await asyncio.sleep(0.01)  # the first read is in flight
+        await db.leads.update_one({"id": "l1"}, {"$set": {"status": "won"}})
+        after = await db.leads.find_one({"id": "l1"})
+        await before
+        return after
+    
+    assert run(scenario())["status"] == "won"
+    assert engine.request_counts['GetItem'] == 2
+
+
+def test_a_cancelled_caller_does_not_cancel_the_shared_read(run, make_db, engine):
+    engine.latency = 0.02
+    db = make_db()
+    
+    async def scenario():
+        await db.leads.insert_one({"id": "l1"})
+        first = asyncio.ensure_future(db.leads.find_one({"id": "l1"}))
+        second = asyncio.ensure_future(db.leads.find_one({"id": "l1"}))
+        await asyncio.sleep(0.005)
+        first.cancel()
+        return await second
+    
+    assert run(scenario()) == {"id": "l1"}
+
+
+def test_failures_reach_every_caller_and_are_not_kept(run):
+    flight = SingleFlight()
+    attempts = []
+    
+    async def failing():
+        attempts.append(1)
+        await asyncio.sleep(0.01)
+        raise RuntimeError("read failed")
+    
+    async def scenario():
+        shared = await asyncio.gather(flight.run(('k',), failing), flight.run(('k',), failing),
+                                      return_exceptions=True)
+        assert len(attempts) == 1
+        later = await asyncio.gather(flight.run(('k',), failing), return_exceptions=True)
+        return shared + later
+    
+    results = run(scenario())
+    assert all(isinstance(result, RuntimeError) for result in results)
+    assert len(attempts) == 2 and flight.stats()['in_flight'] == 0
+
+
+def test_single_flight_can_be_disabled(run, make_db, engine, monkeypatch):
+    monkeypatch.setenv('DYNAMODB_SINGLE_FLIGHT', 'false')
+    db = make_db()
+    
+    async def scenario():
+        await db.leads.insert_one({"id": "l1"})
+        engine.reset_metrics()
+        await asyncio.gather(db.leads.find_one({"id": "l1"}), db.leads.find_one({"id": "l1"}))
+    
+    run(scenario())
+    assert engine.request_counts['GetItem'] == 2
+
+
+def test_unhashable_keys_run_on_their_own(run):
+    flight = SingleFlight()
+    
+    async def read():
+        return 1
+    
+    assert run(flight.run((['unhashable'],), read)) == 1
+    assert flight.stats() == {'calls': 1, 'coalesced': 0, 'in_flight': 0}
@@ -0,0 +1,82 @@
+"""Sorted reads: top-k selection over pages, mixed-type ordering, and sorts pushed down to a Query"""
+
+import pytest
+
+from dynamodb_layer import sort_value
+from dynamodb_memory import InMemoryDynamoDB, InMemoryDynamoDBDatabase
+
+
+@pytest.fixture
+def paged_db():
+    """Database whose Scan pages hold a handful of items, so top-k sees many pages"""
+    engine = InMemoryDynamoDB.from_table_definitions(page_size_bytes=300)
+    return InMemoryDynamoDBDatabase(engine)
+
+
+def _leads(count):
+    return [{"id": f"l{i:03d}", "value": (i * 37) % count, "status": "new" if i % 2 else "won"} for i in range(count)]
+
+
+@pytest.mark.parametrize('direction', [1, -1])
+@pytest.mark.parametrize('limit', [1, 7, None])
+def test_top_k_matches_a_full_sort(run, paged_db, direction, limit):
+    leads = _leads(60)
+    
+    async def scenario():
+        await paged_db.leads.insert_many(leads)
+        paged_db.engine.reset_metrics()
+        return await paged_db.leads.find({"status": "new"}).sort("value", direction).to_list(limit)
+    
+    expected = sorted((lead for lead in leads if lead["status"] == "new"),
+                      key=lambda lead: lead["value"], reverse=direction == -1)
+    assert run(scenario()) == expected[:limit]
+    assert paged_db.engine.request_counts['Scan'] > 2
+
+
+def test_mixed_types_sort_like_mongo(run, db):
+    values = ["b", 2, None, True, "a", 1.5, {"k": 1}, [1]]
+    
+    async def scenario():
+        await db.leads.insert_many([{"id": f"l{i}", "value": value} for i, value in enumerate(values)]
+                                   + [{"id": "missing"}])
+        return await db.leads.find({}).sort("value").to_list(None)
+    
+    ordered = [lead.get("value", "<missing>") for lead in run(scenario())]
+    # Missing and null first, then numbers, strings, maps, lists and booleans
+    assert ordered[:2] in ([None, "<missing>"], ["<missing>", None])
+    assert ordered[2:] == [1.5, 2, "a", "b", {"k": 1}, [1], True]
+    assert sorted(values[:3] + [1.5], key=sort_value) == [None, 1.5, 2, "b"]
+
+
+def test_sort_with_projection_reads_the_sort_field(run, paged_db):
+    leads = _leads(20)
+    
+    async def scenario():
+        await paged_db.leads.insert_many(leads)
+        return await paged_db.leads.find({}, {"id": 1, "_id": 0}).sort("value", -1).to_list(3)
+    
+    expected = sorted(leads, key=lambda lead: lead["value"], reverse=True)[:3]
+    assert run(scenario()) == [{"id": lead["id"]} for lead in expected]
+
+
+def test_sort_on_the_range_key_is_pushed_down_to_the_query(run):
+    engine = InMemoryDynamoDB.from_table_definitions()
+    engine.create_table(
+        TableName='arbrit-lead-events',
+        KeySchema=[{'AttributeName': 'lead_id', 'KeyType': 'HASH'}, {'AttributeName': 'at', 'KeyType': 'RANGE'}],
+        AttributeDefinitions=[{'AttributeName': 'lead_id', 'AttributeType': 'S'},
+                              {'AttributeName': 'at', 'AttributeType': 'S'}],
+    )
+    db = InMemoryDynamoDBDatabase(engine)
+    
+    async def scenario():
+        await db.lead_events.insert_many([{"lead_id": "l1", "at": f"2024-01-{day:02d}"} for day in range(1, 29)])
+        engine.reset_metrics()
+        latest = await db.lead_events.find({"lead_id": "l1"}).sort("at", -1).to_list(3)
+        return latest, db.metrics.summary()['requests']
+    
+    latest, requests = run(scenario())
+    assert [event["at"] for event in latest] == ["2024-01-28", "2024-01-27", "2024-01-26"]
+    assert engine.request_counts['Query'] == 1
+    # Read in reverse key order, stopping at the limit
+    assert [entry['items_scanned'] for entry in requests if entry['operation'] == 'Query'] == [3]
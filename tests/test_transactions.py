@@ -0,0 +1,136 @@
+"""DynamoDBTransaction: atomic (all or nothing) and non-atomic (per-operation results) commits"""
+
+import pytest
+from botocore.exceptions import ClientError
+
+from dynamodb_layer import TRANSACT_WRITE_SIZE
+
+
+def _seed(run, db):
+    async def seed():
+        await db.work_orders.insert_one({"id": "w1", "status": "open"})
+        await db.delivery_tasks.insert_one({"id": "t1", "status": "PENDING"})
+    run(seed())
+
+
+def test_atomic_transaction_writes_every_table_in_one_request(run, db, engine):
+    _seed(run, db)
+    engine.reset_metrics()
+    
+    async def scenario():
+        async with db.transaction() as tx:
+            tx.put('certificate_candidates', {"id": "c1", "work_order_id": "w1"})
+            tx.update('work_orders', {"id": "w1"}, {"$set": {"status": "completed"}})
+            tx.delete('delivery_tasks', {"id": "t1"})
+        return (tx.result,
+                await db.certificate_candidates.find_one({"id": "c1"}),
+                await db.work_orders.find_one({"id": "w1"}),
+                await db.delivery_tasks.find_one({"id": "t1"}))
+    
+    result, certificate, work_order, task = run(scenario())
+    assert result.succeeded == [0, 1, 2]
+    assert certificate == {"id": "c1", "work_order_id": "w1"}
+    assert work_order["status"] == "completed"
+    assert task is None
+    assert engine.request_counts['TransactWriteItems'] == 1
+
+
+def test_atomic_transaction_writes_nothing_when_one_operation_fails(run, db):
+    _seed(run, db)
+    
+    async def scenario():
+        with pytest.raises(ClientError):
+            async with db.transaction() as tx:
+                tx.update('work_orders', {"id": "w1"}, {"$set": {"status": "completed"}})
+                # Updating a key attribute is rejected by DynamoDB, cancelling the whole transaction
+                tx.update('delivery_tasks', {"id": "t1"}, {"$set": {"id": "t2"}})
+        return await db.work_orders.find_one({"id": "w1"})
+    
+    assert run(scenario())["status"] == "open"
+
+
+def test_transaction_block_that_raises_writes_nothing(run, db):
+    async def scenario():
+        with pytest.raises(RuntimeError):
+            async with db.transaction() as tx:
+                tx.put('work_orders', {"id": "w9"})
+                raise RuntimeError("abandon")
+        return tx.result, await db.work_orders.find_one({"id": "w9"})
+    
+    assert run(scenario()) == (None, None)
+
+
+def test_single_operation_is_sent_as_a_plain_write(run, db, engine):
+    async def scenario():
+        async with db.transaction() as tx:
+            tx.put('work_orders', {"id": "w2"})
+    
+    run(scenario())
+    assert engine.request_counts['TransactWriteItems'] == 0
+    assert engine.request_counts['PutItem'] == 1
+
+
+def test_atomic_transaction_is_limited_to_one_request(db):
+    tx = db.transaction()
+    for i in range(TRANSACT_WRITE_SIZE):
+        tx.put('work_orders', {"id": f"w{i}"})
+    with pytest.raises(ValueError):
+        tx.put('work_orders', {"id": "one-too-many"})
+
+
+def test_aggregate_counter_updates_take_room_in_a_transaction(make_db):
+    db = make_db(aggregates='certificates:status')
+    tx = db.transaction()
+    assert tx.capacity(['certificate_candidates', 'certificates']) == TRANSACT_WRITE_SIZE - 1
+    for i in range(TRANSACT_WRITE_SIZE // 2 - 1):
+        tx.put('certificate_candidates', {"id": f"c{i}"})
+        tx.put('certificates', {"id": f"d{i}", "status": "approved"})
+    tx.put('certificate_candidates', {"id": "c-last"})
+    # The 100th operation would leave no room for the counter update of certificates:status
+    with pytest.raises(ValueError):
+        tx.put('certificates', {"id": "d-last", "status": "approved"})
+
+
+def test_transaction_filled_to_capacity_commits_with_its_counters(run, make_db):
+    db = make_db(aggregates='certificates:status')
+    
+    async def scenario():
+        await db.aggregates.rebuild()
+        per_transaction = db.transaction().capacity(['certificate_candidates', 'certificates']) // 2
+        async with db.transaction() as tx:
+            for i in range(per_transaction):
+                tx.put('certificate_candidates', {"id": f"c{i}"})
+                tx.put('certificates', {"id": f"d{i}", "status": "approved"})
+        return per_transaction, await db.aggregates.read('certificates', 'status')
+    
+    per_transaction, counts = run(scenario())
+    assert per_transaction == (TRANSACT_WRITE_SIZE - 1) // 2
+    assert counts == {"approved": per_transaction}
+
+
+def test_non_atomic_transaction_reports_failures_per_operation(run, db):
+    _seed(run, db)
+    
+    async def scenario():
+        async with db.transaction(atomic=False) as tx:
+            tx.put('work_orders', {"id": "w2", "status": "open"})
+            tx.update('delivery_tasks', {"id": "t1"}, {"$set": {"id": "t2"}})
+            tx.update('work_orders', {"id": "w1"}, {"$set": {"status": "completed"}})
+            tx.delete('delivery_tasks', {"id": "t1"})
+        return tx.result, await db.work_orders.find({}).to_list(None)
+    
+    result, work_orders = run(scenario())
+    assert result.succeeded == [0, 2, 3]
+    assert list(result.failed) == [1]
+    assert sorted((w["id"], w["status"]) for w in work_orders) == [("w1", "completed"), ("w2", "open")]
+
+
+def test_committed_transaction_cannot_take_more_operations(run, db):
+    async def scenario():
+        async with db.transaction() as tx:
+            tx.put('work_orders', {"id": "w3"})
+        return tx
+    
+    tx = run(scenario())
+    with pytest.raises(RuntimeError):
+        tx.put('work_orders', {"id": "w4"})